@@ -2,7 +2,7 @@ from __future__ import absolute_import, unicode_literals
 import os
 from celery import Celery
 from celery import current_app
-from celery.signals import after_task_publish, celeryd_init
+from celery.signals import after_task_publish, celeryd_init, worker_init, worker_process_shutdown, worker_shutdown
 
 # set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings.prod')
@@ -32,6 +32,22 @@ def setup_log_format(sender, conf, **kwargs):
     ).format(sender)
 
 
+@worker_init.connect
+def start_metrics_exporter(sender=None, **kwargs):
+    # The pool processes share their metrics through METRICS_MULTIPROC_DIR, served by the main process
+    if settings.METRICS_PORT:
+        from libs.metrics import start_http_server
+        start_http_server(settings.METRICS_PORT)
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def wait_for_tuple_status_updates(sender=None, **kwargs):
+    # The final status updates of the tuples are committed in the background
+    from substrapp.ledger.api import wait_for_tuple_status_updates
+    wait_for_tuple_status_updates(timeout=settings.LEDGER_WAIT_FOR_EVENT_TIMEOUT_SECONDS)
+
+
 @app.on_after_configure.connect
 def setup_periodic_tasks(sender, **kwargs):
     from substrapp.tasks.tasks import (prepare_training_task,
@@ -148,9 +148,40 @@ CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
         'LOCATION': '/tmp/django_cache',
-    }
+    },
+    # read-through cache of ledger assets (algos, objectives, data managers), local to each pod
+    'ledger': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': '/tmp/django_cache_ledger',
+        'TIMEOUT': int(os.environ.get('LEDGER_CACHE_TIMEOUT_SECONDS', 24 * 60 * 60)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('LEDGER_CACHE_MAX_ENTRIES', 10000)),
+        },
+    },
 }
 
+# Assets modified by invokes (data managers) are only invalidated in the ledger cache of the pod which made
+# the invoke: the other pods cache them for LEDGER_CACHE_MUTABLE_TIMEOUT_SECONDS at most.
+LEDGER_CACHE_MUTABLE_TIMEOUT_SECONDS = int(os.environ.get('LEDGER_CACHE_MUTABLE_TIMEOUT_SECONDS', 30))
+
+# Ledger calls to a channel fail fast for LEDGER_CIRCUIT_BREAKER_RESET_TIMEOUT_SECONDS after
+# LEDGER_CIRCUIT_BREAKER_FAILURE_THRESHOLD consecutive connection errors, then a probe call is let through.
+LEDGER_CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('LEDGER_CIRCUIT_BREAKER_FAILURE_THRESHOLD', 5))
+LEDGER_CIRCUIT_BREAKER_RESET_TIMEOUT_SECONDS = int(os.environ.get('LEDGER_CIRCUIT_BREAKER_RESET_TIMEOUT_SECONDS', 30))
+
+# The health checks read the state of the channels, whose connection is checked in the background every
+# LEDGER_HEALTH_CHECK_INTERVAL_SECONDS. The server is not ready if the last successful check of a channel
+# is older than LEDGER_HEALTH_CHECK_MAX_AGE_SECONDS. A check fails if the peer does not answer within
+# LEDGER_HEALTH_CHECK_TIMEOUT_SECONDS.
+LEDGER_HEALTH_CHECK_INTERVAL_SECONDS = int(os.environ.get('LEDGER_HEALTH_CHECK_INTERVAL_SECONDS', 30))
+LEDGER_HEALTH_CHECK_MAX_AGE_SECONDS = int(os.environ.get('LEDGER_HEALTH_CHECK_MAX_AGE_SECONDS', 120))
+LEDGER_HEALTH_CHECK_TIMEOUT_SECONDS = int(os.environ.get('LEDGER_HEALTH_CHECK_TIMEOUT_SECONDS', 10))
+
+# Internal port serving the metrics, by the server on /metrics/ and by the celery worker main process
+# (0 disables them).
+# The processes of a pod share their metrics through the METRICS_MULTIPROC_DIR directory (see libs.metrics).
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 0))
+
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
 
@@ -214,6 +245,11 @@ TASK = {
     'KANIKO_MIRROR': to_bool(os.environ.get('KANIKO_MIRROR', False)),
     'KANIKO_IMAGE': os.environ.get('KANIKO_IMAGE'),
     'COMPUTE_REGISTRY': os.environ.get('COMPUTE_REGISTRY'),
+    # Size in bytes of the local cache of the algos, metrics and models fetched by the worker (0 disables it).
+    # Both caches are stored on the volume of the subtuple folders.
+    'ASSET_CACHE_MAX_SIZE': int(os.environ.get('TASK_ASSET_CACHE_MAX_SIZE', 2 * 1024 ** 3)),
+    # Size in bytes of the local cache of the uncompressed algos and metrics (0 disables it)
+    'ARCHIVE_CACHE_MAX_SIZE': int(os.environ.get('TASK_ARCHIVE_CACHE_MAX_SIZE', 1024 ** 3)),
 }
 
 CELERY_ACCEPT_CONTENT = ['application/json']
@@ -237,6 +273,15 @@ GZIP_MODELS = to_bool(os.environ.get('GZIP_MODELS', False))
 ENABLE_REMOVE_LOCAL_CP_FOLDERS = to_bool(os.environ.get('ENABLE_REMOVE_LOCAL_CP_FOLDERS', True))
 
 HTTP_CLIENT_TIMEOUT_SECONDS = int(os.environ.get('HTTP_CLIENT_TIMEOUT_SECONDS', 30))
+# Connections to the other nodes are kept alive, up to HTTP_CLIENT_POOL_MAXSIZE connections per node.
+# Failed connections and 502, 503 and 504 responses are retried HTTP_CLIENT_RETRIES times.
+HTTP_CLIENT_POOL_MAXSIZE = int(os.environ.get('HTTP_CLIENT_POOL_MAXSIZE', 10))
+HTTP_CLIENT_RETRIES = int(os.environ.get('HTTP_CLIENT_RETRIES', 3))
+HTTP_CLIENT_RETRY_BACKOFF_FACTOR = float(os.environ.get('HTTP_CLIENT_RETRY_BACKOFF_FACTOR', 0.5))
+# Files of HTTP_CLIENT_SEGMENTED_DOWNLOAD_THRESHOLD bytes or more are downloaded from the other nodes with
+# HTTP_CLIENT_SEGMENTED_DOWNLOAD_SEGMENTS concurrent range requests (0 disables it)
+HTTP_CLIENT_SEGMENTED_DOWNLOAD_THRESHOLD = int(os.environ.get('HTTP_CLIENT_SEGMENTED_DOWNLOAD_THRESHOLD', 0))
+HTTP_CLIENT_SEGMENTED_DOWNLOAD_SEGMENTS = int(os.environ.get('HTTP_CLIENT_SEGMENTED_DOWNLOAD_SEGMENTS', 4))
 
 LOGGING_USE_COLORS = to_bool(os.environ.get('LOGGING_USE_COLORS', True))
 
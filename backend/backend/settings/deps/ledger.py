@@ -34,3 +34,30 @@ LEDGER_GRPC_HTTP2_MAX_PINGS_WITHOUT_DATA = 0
 LEDGER_GRPC_KEEPALIVE_PERMIT_WITHOUT_CALLS = 1
 LEDGER_GRPC_KEEPALIVE_TIME_MS = int(os.getenv('LEDGER_GRPC_KEEPALIVE_TIME_MS'))
 LEDGER_GRPC_HTTP2_MIN_TIME_BETWEEN_PINGS_MS = int(os.getenv('LEDGER_GRPC_HTTP2_MIN_TIME_BETWEEN_PINGS_MS'))
+
+# Maximum number of warm ledger connections kept per channel and per process
+LEDGER_CLIENT_POOL_MAX_SIZE = int(os.getenv('LEDGER_CLIENT_POOL_MAX_SIZE', 4))
+
+# Channel discovery results are refreshed in the background after LEDGER_DISCOVERY_REFRESH_INTERVAL_SECONDS
+# and discovered again synchronously after LEDGER_DISCOVERY_CACHE_TTL_SECONDS
+LEDGER_DISCOVERY_CACHE_TTL_SECONDS = int(os.getenv('LEDGER_DISCOVERY_CACHE_TTL_SECONDS', 300))
+LEDGER_DISCOVERY_REFRESH_INTERVAL_SECONDS = int(os.getenv('LEDGER_DISCOVERY_REFRESH_INTERVAL_SECONDS', 60))
+
+# The events app synchronizes the local projection of the ledger assets every
+# LEDGER_PROJECTION_SYNC_INTERVAL_SECONDS (0 disables it), only listing the assets again if blocks have been
+# committed since the last synchronization. Reads fall back to the ledger when the projection has not been
+# synchronized for LEDGER_PROJECTION_MAX_AGE_SECONDS.
+LEDGER_PROJECTION_SYNC_INTERVAL_SECONDS = int(os.getenv('LEDGER_PROJECTION_SYNC_INTERVAL_SECONDS', 60))
+LEDGER_PROJECTION_MAX_AGE_SECONDS = int(os.getenv('LEDGER_PROJECTION_MAX_AGE_SECONDS', 180))
+
+# Retries of the ledger calls failing with transient errors: exponential backoff with full jitter,
+# capped to LEDGER_CALL_RETRY_MAX_DELAY_SECONDS, and given up after LEDGER_CALL_RETRY_MAX_ATTEMPTS attempts
+# or LEDGER_CALL_RETRY_DEADLINE_SECONDS. LEDGER_CALL_RETRY_MAX_ATTEMPTS_PER_ERROR is a JSON object
+# limiting the attempts by error class, e.g. {"LedgerTimeout": 3}.
+LEDGER_CALL_RETRY_POLICY = {
+    'max_attempts': int(os.getenv('LEDGER_CALL_RETRY_MAX_ATTEMPTS', 15)),
+    'base_delay': float(os.getenv('LEDGER_CALL_RETRY_BASE_DELAY_SECONDS', 1)),
+    'max_delay': float(os.getenv('LEDGER_CALL_RETRY_MAX_DELAY_SECONDS', 30)),
+    'deadline': float(os.getenv('LEDGER_CALL_RETRY_DEADLINE_SECONDS', 180)),
+    'max_attempts_per_error': json.loads(os.getenv('LEDGER_CALL_RETRY_MAX_ATTEMPTS_PER_ERROR', '{}')),
+}
@@ -1,3 +1,5 @@
+import os
+
 from ..deps.ledger import *
 from ..dev import *
 
@@ -6,5 +8,14 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django_celery_results',
     'rest_framework',
+    'substrapp',
     'events'
 ]
+
+# On (re)connection, chaincode events are replayed from the last processed block
+# minus LEDGER_EVENTS_CHECKPOINT_OVERLAP_BLOCKS
+LEDGER_EVENTS_CHECKPOINT_OVERLAP_BLOCKS = int(os.getenv('LEDGER_EVENTS_CHECKPOINT_OVERLAP_BLOCKS', 10))
+
+# Only the events process loads these settings: it listens to the chaincode events unless
+# LEDGER_EVENTS_LISTENER_ENABLED is false, e.g. to run management commands without connecting to the ledger
+LEDGER_EVENTS_LISTENER_ENABLED = to_bool(os.environ.get('LEDGER_EVENTS_LISTENER_ENABLED', True))
@@ -7,3 +7,6 @@ logging.disable(logging.CRITICAL)
 
 ORG_NAME = 'OrgTestSuite'
 LEDGER_SYNC_ENABLED = True
+LEDGER_PROJECTION_MAX_AGE_SECONDS = 0
+
+CACHES['ledger'] = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
@@ -25,7 +25,7 @@ from drf_spectacular.views import (
     SpectacularSwaggerView,
 )
 
-from backend.views import obtain_auth_token, info_view
+from backend.views import obtain_auth_token, info_view, metrics_view
 
 from substrapp.urls import router
 from node.urls import router as node_router
@@ -60,3 +60,4 @@ if BrowsableAPIRenderer in api_settings.DEFAULT_RENDERER_CLASSES:
     urlpatterns += [url(r'^api-auth/', include('rest_framework.urls'))]
 
 urlpatterns += [url(r'^info/', info_view)]
+urlpatterns += [url(r'^metrics/', metrics_view)]
@@ -1,11 +1,14 @@
 import os
+from django.http import Http404, HttpResponse
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.permissions import AllowAny
 from rest_framework.throttling import AnonRateThrottle
 
 from rest_framework.authtoken.models import Token
 from rest_framework.response import Response
 
 from libs.expiry_token_authentication import token_expire_handler, expires_at
+from libs.metrics import REGISTRY, CONTENT_TYPE
 from libs.user_login_throttle import UserLoginThrottle
 
 from rest_framework.views import APIView
@@ -54,5 +57,18 @@ class Info(APIView):
         })
 
 
+class Metrics(APIView):
+    # Scraped without credentials: the metrics are only served on METRICS_PORT, which is not exposed
+    # by the server service
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request, *args, **kwargs):
+        if not settings.METRICS_PORT or request.get_port() != str(settings.METRICS_PORT):
+            raise Http404
+        return HttpResponse(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
 obtain_auth_token = ExpiryObtainAuthToken.as_view()
 info_view = Info.as_view()
+metrics_view = Metrics.as_view()
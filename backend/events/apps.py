@@ -1,7 +1,9 @@
 import asyncio
+import concurrent.futures
 import json
 import logging
 import multiprocessing
+import threading
 import time
 import contextlib
 
@@ -18,13 +20,19 @@ from hfc.util.keyvaluestore import FileKeyValueStore
 
 from substrapp.tasks.tasks import prepare_tuple, on_compute_plan
 from substrapp.utils import get_owner
-from substrapp.ledger.connection import get_hfc, ledger_grpc_options
+from substrapp.ledger.api import aget_ledger_height, get_ledger_height
+from substrapp.ledger.connection import ledger_grpc_options, run_async
 
-from celery.result import AsyncResult
+from celery import states
+
+from backend.celery import app
 
 
 logger = logging.getLogger(__name__)
 
+# Last block processed by this process, by channel
+_checkpoints = {}
+
 
 @contextlib.contextmanager
 def get_event_loop():
@@ -43,9 +51,9 @@ def tuple_get_worker(event_type, asset):
 
 
 def on_tuples_event(channel_name, block_number, tx_id, tx_status, event_type, asset):
+    """Return the task to publish for a tuple event as a (task, args, task_id) tuple, None if there is none."""
 
     owner = get_owner()
-    worker_queue = f"{settings.ORG_NAME}.worker"
 
     key = asset['key']
     status = asset['status']
@@ -71,20 +79,11 @@ def on_tuples_event(channel_name, block_number, tx_id, tx_status, event_type, as
                     f' ({tuple_owner} vs {owner})')
         return
 
-    if AsyncResult(key).state != 'PENDING':
-        logger.info(f'Skipping task {key}: already exists')
-        return
-
-    prepare_tuple.apply_async(
-        (channel_name, asset, event_type),
-        task_id=key,
-        queue=worker_queue
-    )
+    return prepare_tuple, (channel_name, asset, event_type), key
 
 
 def on_compute_plan_event(channel_name, block_number, tx_id, tx_status, asset):
-
-    worker_queue = f"{settings.ORG_NAME}.worker"
+    """Return the task to publish for a compute plan event as a (task, args, task_id) tuple, None if there is none."""
 
     key = asset['compute_plan_key']
 
@@ -101,22 +100,50 @@ def on_compute_plan_event(channel_name, block_number, tx_id, tx_status, asset):
 
     logger.info(f'Processing cleaning task {key}: type=computePlan status={status}')
 
-    task_id = f'{key}_{tx_id}'
+    return on_compute_plan, (channel_name, asset, ), f'{key}_{tx_id}'
 
-    if AsyncResult(task_id).state != 'PENDING':
-        logger.info(f'Skipping cleaning task: already exists. '
-                    f'Info: compute_plan={key}, block_numer={block_number}, tx_id={tx_id}')
-        return
 
-    on_compute_plan.apply_async(
-        (channel_name, asset, ),
-        task_id=task_id,
-        queue=worker_queue
+def get_published_task_ids(task_ids):
+    """Return the tasks which have already been published, among `task_ids`.
+
+    Equivalent to checking that `AsyncResult(task_id).state` is not PENDING for each task,
+    in a single query to the result backend.
+    """
+    from django_celery_results.models import TaskResult
+
+    return set(
+        TaskResult.objects.filter(task_id__in=task_ids).exclude(status=states.PENDING).values_list('task_id', flat=True)
     )
 
 
+def publish_tasks(tasks):
+    """Publish the tasks of an event which have not been published yet, on a single broker connection."""
+    if not tasks:
+        return
+
+    worker_queue = f"{settings.ORG_NAME}.worker"
+    published_task_ids = get_published_task_ids({task_id for _, _, task_id in tasks})
+
+    with app.producer_or_acquire() as producer:
+        for task, args, task_id in tasks:
+            if task_id in published_task_ids:
+                logger.info(f'Skipping task {task_id}: already exists')
+                continue
+
+            task.apply_async(
+                args,
+                task_id=task_id,
+                queue=worker_queue,
+                producer=producer,
+            )
+            published_task_ids.add(task_id)
+
+
 def on_event(channel_name, cc_event, block_number, tx_id, tx_status):
+    from substrapp.ledger.projection import apply_event
+
     payload = json.loads(cc_event['payload'])
+    tasks = []
 
     for event_type, assets in payload.items():
 
@@ -124,23 +151,191 @@ def on_event(channel_name, cc_event, block_number, tx_id, tx_status):
             continue
 
         for asset in assets:
+            if tx_status == 'VALID':
+                try:
+                    apply_event(channel_name, event_type, asset, block_number)
+                except Exception as e:
+                    logger.exception(f'Failed to update ledger projection ({type(e)}): {e}')
+
             if event_type == 'compute_plan':
-                on_compute_plan_event(channel_name, block_number, tx_id, tx_status, asset)
+                task = on_compute_plan_event(channel_name, block_number, tx_id, tx_status, asset)
             else:
-                on_tuples_event(channel_name, block_number, tx_id, tx_status, event_type, asset)
+                task = on_tuples_event(channel_name, block_number, tx_id, tx_status, event_type, asset)
+
+            if task is not None:
+                tasks.append(task)
+
+    # all the assets of an event are checked and published at once: a compute plan
+    # registration can carry hundreds of tuples
+    publish_tasks(tasks)
+
+    save_checkpoint(channel_name, block_number)
+
+
+def save_checkpoint(channel_name, block_number):
+    """Persist the last block processed on a channel."""
+    from substrapp.models import LedgerEventCheckpoint
+
+    if _checkpoints.get(channel_name, -1) >= block_number:
+        return
+
+    LedgerEventCheckpoint.objects.update_or_create(channel=channel_name, defaults={'block_number': block_number})
+    _checkpoints[channel_name] = block_number
+
+
+def get_checkpoint(channel_name):
+    """Return the last block processed on a channel, None if there is none."""
+    from substrapp.models import LedgerEventCheckpoint
+
+    return LedgerEventCheckpoint.objects.filter(
+        channel=channel_name).values_list('block_number', flat=True).first()
+
+
+def delete_checkpoint(channel_name):
+    from substrapp.models import LedgerEventCheckpoint
+
+    LedgerEventCheckpoint.objects.filter(channel=channel_name).delete()
+    _checkpoints.pop(channel_name, None)
+
+
+async def get_start_block(channel_name, executor):
+    """Return the block from which the events of a channel must be replayed.
 
+    Events are replayed from the last processed block, minus a safety overlap: the events of the
+    last blocks may have been partially processed. Replayed events are deduplicated by the handlers.
+    The checkpoint is read on the `executor` processing the events of the channel, once the events
+    already received have been processed.
+    """
+    loop = asyncio.get_event_loop()
 
-def wait(channel_name):
+    block_number = await loop.run_in_executor(executor, get_checkpoint, channel_name)
+    if block_number is None:
+        return 0
+
+    try:
+        height = await run_async(aget_ledger_height(channel_name))
+    except Exception as e:
+        logger.warning(f'Failed to get ledger height of channel {channel_name} ({type(e)}): {e}')
+    else:
+        if block_number >= height:
+            # the ledger has been reset since the checkpoint
+            logger.warning(f'Events checkpoint of channel {channel_name} at block {block_number} '
+                           f'is ahead of the ledger height {height}, replaying all the events')
+            await loop.run_in_executor(executor, delete_checkpoint, channel_name)
+            return 0
+
+    _checkpoints[channel_name] = max(_checkpoints.get(channel_name, -1), block_number)
+    return max(0, block_number - settings.LEDGER_EVENTS_CHECKPOINT_OVERLAP_BLOCKS)
+
+
+def sync_projections_periodically(channel_names):
+    from django.db import close_old_connections
+    from substrapp.ledger.projection import sync_projections
+
+    while True:
+        for channel_name in channel_names:
+            sync_projections(channel_name)
+        close_old_connections()
+        time.sleep(settings.LEDGER_PROJECTION_SYNC_INTERVAL_SECONDS)
+
+
+def connect_to_channel(channel_name):
+    # We try to query the peer first, and wait for it before listening to the channel events.
+    # It prevents potential issues when we launch the channel event hub.
+    while True:
+        try:
+            get_ledger_height(channel_name)
+            logger.info(f'Events: Connected to channel {channel_name}.')
+        except Exception as e:
+            logger.exception(e)
+            time.sleep(5)
+            logger.error(f'Events: Retry connecting to channel {channel_name}.')
+        else:
+            break
+
+
+def get_event_handler(loop, executor, channel_name, channel_event_hub):
+    """Return a callback processing the events of a channel event hub in order on `executor`.
+
+    If an event cannot be processed, the following events are skipped and the event hub is disconnected:
+    they are replayed from the last checkpoint once reconnected.
+    """
+    failed = threading.Event()
+
+    def process_event(cc_event, block_number, tx_id, tx_status):
+        if failed.is_set():
+            return
+        try:
+            on_event(channel_name, cc_event, block_number, tx_id, tx_status)
+        except Exception as e:
+            failed.set()
+            logger.exception(f'Failed to process event of channel {channel_name} at block {block_number} '
+                             f'({type(e)}): {e}')
+            loop.call_soon_threadsafe(channel_event_hub.disconnect)
 
     def on_channel_event(cc_event, block_number, tx_id, tx_status):
-        on_event(channel_name, cc_event, block_number, tx_id, tx_status)
+        loop.run_in_executor(executor, process_event, cc_event, block_number, tx_id, tx_status)
+
+    return on_channel_event
+
+
+async def listen_to_channel(client, channel_name, target_peer, requestor):
+    """Process the chaincode events of a channel, reconnecting to its event hub on errors.
+
+    The events are processed in order by a thread of the channel, off the event loop: the handlers
+    write to the database and publish tasks, while the other channels keep being listened to.
+    """
+    loop = asyncio.get_event_loop()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    # the channel connection is checked off the event loop: other channels keep being processed meanwhile
+    await loop.run_in_executor(None, connect_to_channel, channel_name)
+
+    channel = client.new_channel(channel_name)
+
+    # Note:
+    #   We do a loop to connect to the channel event hub because grpc may disconnect and create an exception
+    #   Since we're in a django app of backend, an exception here will not crash the server (if the "ready"
+    #   method has already returned "true").
+    #   It makes it difficult to reconnect automatically because we need to kill the server
+    #   to trigger the connexion.
+    #   So we catch this exception (RPC error) and retry to connect to the event loop.
+    #   Other channels keep being processed while a channel reconnects.
+
+    while True:
+        # use chaincode event
+        channel_event_hub = channel.newChannelEventHub(target_peer,
+                                                       requestor)
+        try:
+            # We want to replay blocks from the last processed block if channel event hub was disconnected
+            # during events emission
+            start = await get_start_block(channel_name, executor)
+            stream = channel_event_hub.connect(start=start,
+                                               filtered=False)
+
+            channel_event_hub.registerChaincodeEvent(
+                settings.LEDGER_CHANNELS[channel_name]['chaincode']['name'],
+                'chaincode-updates',
+                onEvent=get_event_handler(loop, executor, channel_name, channel_event_hub))
+
+            logger.info(f'Connect to Channel Event Hub ({channel_name}) from block {start}')
+            await stream
+
+        except Exception as e:
+            logger.error(f'Channel Event Hub failed for {channel_name} ({type(e)}): {e} re-connecting in 5s')
+            await asyncio.sleep(5)
+
+
+def wait(channel_names):
+    """Process the chaincode events of all the channels on a single event loop."""
+
+    if settings.LEDGER_PROJECTION_SYNC_INTERVAL_SECONDS:
+        threading.Thread(target=sync_projections_periodically, args=[channel_names], daemon=True).start()
 
     with get_event_loop() as loop:
 
         client = Client()
 
-        channel = client.new_channel(channel_name)
-
         target_peer = Peer(name=settings.LEDGER_PEER_NAME)
 
         target_peer.init_with_bundle({
@@ -164,58 +359,24 @@ def wait(channel_name):
         except BaseException:
             pass
         else:
-
-            # Note:
-            #   We do a loop to connect to the channel event hub because grpc may disconnect and create an exception
-            #   Since we're in a django app of backend, an exception here will not crash the server (if the "ready"
-            #   method has already returned "true").
-            #   It makes it difficult to reconnect automatically because we need to kill the server
-            #   to trigger the connexion.
-            #   So we catch this exception (RPC error) and retry to connect to the event loop.
-
-            while True:
-                # use chaincode event
-                channel_event_hub = channel.newChannelEventHub(target_peer,
-                                                               requestor)
-                try:
-                    # We want to replay blocks from the beginning (start=0) if channel event hub was disconnected during
-                    # events emission
-                    stream = channel_event_hub.connect(start=0,
-                                                       filtered=False)
-
-                    channel_event_hub.registerChaincodeEvent(
-                        settings.LEDGER_CHANNELS[channel_name]['chaincode']['name'],
-                        'chaincode-updates',
-                        onEvent=on_channel_event)
-
-                    logger.info(f'Connect to Channel Event Hub ({channel_name})')
-                    loop.run_until_complete(stream)
-
-                except Exception as e:
-                    logger.error(f'Channel Event Hub failed for {channel_name} ({type(e)}): {e} re-connecting in 5s')
-                    time.sleep(5)
+            loop.run_until_complete(asyncio.gather(*[
+                listen_to_channel(client, channel_name, target_peer, requestor)
+                for channel_name in channel_names
+            ]))
 
 
 class EventsConfig(AppConfig):
     name = 'events'
 
-    def listen_to_channel(self, channel_name):
-        # We try to connect a client first, if it fails the backend will not start.
-        # It prevents potential issues when we launch the channel event hub in a subprocess.
-        while True:
-            try:
-                with get_hfc(channel_name) as (loop, client, user):
-                    logger.info(f'Events: Connected to channel {channel_name}.')
-            except Exception as e:
-                logger.exception(e)
-                time.sleep(5)
-                logger.error(f'Events: Retry connecting to channel {channel_name}.')
-            else:
-                break
+    def ready(self):
+        # Only the processes of the events role listen to the ledger, see LEDGER_EVENTS_LISTENER_ENABLED
+        if not settings.LEDGER_EVENTS_LISTENER_ENABLED:
+            logger.info('Events: listener disabled.')
+            return
 
-        p1 = multiprocessing.Process(target=wait, args=[channel_name])
-        p1.start()
+        channel_names = list(settings.LEDGER_CHANNELS.keys())
 
-    def ready(self):
-        for channel_name in settings.LEDGER_CHANNELS.keys():
-            self.listen_to_channel(channel_name)
+        # A single process listens to all the channels. It waits for the channels to be reachable
+        # on its own, so that the startup does not depend on the ledger availability.
+        p1 = multiprocessing.Process(target=wait, args=[channel_names])
+        p1.start()
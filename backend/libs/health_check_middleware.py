@@ -1,6 +1,16 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
 from django.conf import settings
 from django.http import HttpResponse
-from substrapp.ledger.connection import get_hfc
+from rest_framework import status
+from substrapp.ledger.api import aget_ledger_height
+from substrapp.ledger.connection import CircuitBreaker, get_circuit_breaker_states, run_sync
+
+logger = logging.getLogger(__name__)
 
 
 class HealthCheckMiddleware(object):
@@ -18,23 +28,106 @@ class HealthCheckMiddleware(object):
 
     def liveness(self, request):
         """
-        Returns that the server is alive.
+        Returns that the server is alive. The ledger is not checked: an unreachable ledger
+        must not restart the server.
         """
-        validate_channels()
         return HttpResponse("OK")
 
     def readiness(self, request):
         """
-        Returns that the server is alive.
+        Returns that the server is ready, unless the ledger calls of a channel are failing fast or
+        the last connection check of a channel, made in the background, failed or is stale.
         """
-        validate_channels()
+        open_channels = [
+            channel_name for channel_name, state in get_circuit_breaker_states().items()
+            if state == CircuitBreaker.OPEN
+        ]
+        if open_channels:
+            return HttpResponse(f"Ledger circuit open for channels: {', '.join(open_channels)}",
+                                status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        unavailable_channels = get_channels_checker().get_unavailable_channels()
+        if unavailable_channels:
+            return HttpResponse(f"Ledger unavailable for channels: {', '.join(unavailable_channels)}",
+                                status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
         return HttpResponse("OK")
 
 
-def validate_channels():
-    # Check ledger connection for each channel
-    for channel_name, channel in settings.LEDGER_CHANNELS.items():
-        with get_hfc(channel_name) as (loop, client, user):
-            # if channel_name starts with 'solo-' channel name is include channel['restricted']
-            # get_hfc will throw if the solo channel has more than 1 member
-            pass
+def validate_channel(channel_name):
+    # Check ledger connection for the channel: checking out a pooled connection does not reach
+    # the peer, query the channel info instead
+    # if channel_name starts with 'solo-' channel name is include channel['restricted']
+    # a new connection will throw if the solo channel has more than 1 member
+    run_sync(asyncio.wait_for(
+        aget_ledger_height(channel_name),
+        timeout=settings.LEDGER_HEALTH_CHECK_TIMEOUT_SECONDS
+    ))
+
+
+class ChannelsChecker(object):
+    """Connection state of the channels, checked every `interval` seconds in a background thread.
+
+    A channel is unavailable if its last check failed, or succeeded more than `max_age` seconds ago.
+    """
+
+    def __init__(self, interval, max_age):
+        self.interval = interval
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._last_successes = {}
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        with self._lock:
+            # Threads are not inherited by forked processes: start a new checker in the child process
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._last_successes = {}
+            self._thread = threading.Thread(target=self._run, name='ledger-health-check', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self.check()
+            time.sleep(self.interval)
+
+    def check(self):
+        for channel_name in settings.LEDGER_CHANNELS:
+            try:
+                validate_channel(channel_name)
+            except Exception as e:
+                logger.warning(f'Health check of channel {channel_name} failed ({type(e)}): {e}')
+                with self._lock:
+                    self._last_successes.pop(channel_name, None)
+            else:
+                with self._lock:
+                    self._last_successes[channel_name] = time.time()
+
+    def get_unavailable_channels(self):
+        self.start()
+        now = time.time()
+        with self._lock:
+            return [
+                channel_name for channel_name in settings.LEDGER_CHANNELS
+                if now - self._last_successes.get(channel_name, float('-inf')) > self.max_age
+            ]
+
+
+_channels_checker = None
+_lock = threading.Lock()
+
+
+def get_channels_checker():
+    global _channels_checker
+
+    if _channels_checker is None:
+        with _lock:
+            if _channels_checker is None:
+                _channels_checker = ChannelsChecker(
+                    interval=settings.LEDGER_HEALTH_CHECK_INTERVAL_SECONDS,
+                    max_age=settings.LEDGER_HEALTH_CHECK_MAX_AGE_SECONDS,
+                )
+    return _channels_checker
@@ -0,0 +1,334 @@
+"""Minimal metrics rendered in the Prometheus text exposition format.
+
+Metrics are kept in the memory of the process which records them. When the registry has a directory
+(METRICS_MULTIPROC_DIR for the default registry), each process also writes its values to its own file of
+this directory every FLUSH_INTERVAL_SECONDS, and the registry renders the sum of the values of all the
+processes sharing it: the uwsgi or celery worker processes of a pod are scraped as a whole. The files of
+the processes which have exited are merged into an aggregate file, so that counters do not go backwards.
+"""
+import atexit
+import fcntl
+import glob
+import json
+import os
+import socketserver
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+FLUSH_INTERVAL_SECONDS = 5
+AGGREGATE_FILENAME = 'aggregate.json'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        self._registry = None
+
+    def _get_label_values(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'Metric {self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _update(self, key, update):
+        if self._registry is not None:
+            self._registry.check_pid()
+        with self._lock:
+            self._values[key] = update(self._values.get(key))
+        if self._registry is not None:
+            self._registry.schedule_flush()
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def get_values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self, values=None):
+        """Render the values of the process, or `values` if given."""
+        if values is None:
+            values = self.get_values()
+        lines = [
+            f'# HELP {self.name} {_escape(self.documentation)}',
+            f'# TYPE {self.name} {self.type}',
+        ]
+        lines.extend(f'{name}{_format_labels(labels)} {_format_value(value)}'
+                     for name, labels, value in self._samples(values))
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        self._update(self._get_label_values(labels), lambda value: (value or 0) + amount)
+
+    def get(self, **labels):
+        return self._values.get(self._get_label_values(labels), 0)
+
+    @staticmethod
+    def merge(value, other):
+        return value + other
+
+    def _samples(self, values):
+        for key, value in sorted(values.items()):
+            yield f'{self.name}_total', list(zip(self.labelnames, key)), value
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        observation = ([int(value <= bound) for bound in self.buckets], value)
+        self._update(self._get_label_values(labels),
+                     lambda previous: self.merge(previous, observation) if previous else observation)
+
+    def get_count(self, **labels):
+        bucket_counts, _ = self._values.get(self._get_label_values(labels), ([0], 0))
+        return bucket_counts[-1]
+
+    @staticmethod
+    def merge(value, other):
+        return [a + b for a, b in zip(value[0], other[0])], value[1] + other[1]
+
+    def _samples(self, values):
+        for key, (bucket_counts, total) in sorted(values.items()):
+            labels = list(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, bucket_counts):
+                yield f'{self.name}_bucket', labels + [('le', _format_value(bound))], count
+            yield f'{self.name}_count', labels, bucket_counts[-1]
+            yield f'{self.name}_sum', labels, total
+
+
+def _is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_values(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_values(path, values):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(values, f)
+    os.replace(tmp_path, path)
+
+
+def _merge_values(values, other):
+    """Add the values of a file to `values`, a dict of (type, {key: value}) by metric name."""
+    merge = {Counter.type: Counter.merge, Histogram.type: Histogram.merge}
+    for name, (metric_type, samples) in other.items():
+        if metric_type not in merge:
+            continue
+        _, metric_values = values.setdefault(name, (metric_type, {}))
+        for key, value in samples:
+            key = tuple(key)
+            previous = metric_values.get(key)
+            metric_values[key] = value if previous is None else merge[metric_type](previous, value)
+
+
+def _dump_values(values):
+    return {
+        name: [metric_type, [[list(key), value] for key, value in metric_values.items()]]
+        for name, (metric_type, metric_values) in values.items()
+    }
+
+
+class Registry:
+
+    def __init__(self, directory=None, flush_interval=FLUSH_INTERVAL_SECONDS):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._metrics = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._path = None
+        self._dirty = False
+        self._flush_thread_pid = None
+
+    def register(self, metric):
+        with self._lock:
+            if any(m.name == metric.name for m in self._metrics):
+                raise ValueError(f'Metric {metric.name} is already registered')
+            self._metrics.append(metric)
+            metric._registry = self
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def check_pid(self):
+        # A forked process inherits the values of its parent: they must not be counted twice
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                for metric in self._metrics:
+                    metric.clear()
+                self._pid = os.getpid()
+                self._path = None
+
+    def schedule_flush(self):
+        """Mark the values of the process as updated, to be written by a background thread of the process."""
+        if not self.directory:
+            return
+
+        self._dirty = True
+        if self._flush_thread_pid == os.getpid():
+            return
+        with self._lock:
+            # threads are not inherited by forked processes
+            if self._flush_thread_pid != os.getpid():
+                if self._flush_thread_pid is None:
+                    atexit.register(self.flush)
+                self._flush_thread_pid = os.getpid()
+                threading.Thread(target=self._flush_periodically, name='metrics-flush', daemon=True).start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Write the values of the process to its file of the shared directory, if they have been updated."""
+        if not self.directory:
+            return
+
+        with self._lock:
+            # the values are those of the parent process until they have been updated in this one
+            if not self._dirty or self._pid != os.getpid():
+                return
+            self._dirty = False
+
+            values = {
+                metric.name: [metric.type, [[list(key), value] for key, value in metric.get_values().items()]]
+                for metric in self._metrics
+            }
+            try:
+                if self._path is None:
+                    os.makedirs(self.directory, exist_ok=True)
+                    # the pid may be reused by another process once this one has exited
+                    self._path = os.path.join(self.directory, f'{os.getpid()}-{uuid.uuid4().hex}.json')
+                _write_values(self._path, values)
+            except OSError:
+                # written by the next flush
+                self._dirty = True
+
+    def _collect(self):
+        """Return the sum of the values written by all the processes sharing the directory.
+
+        The files of the processes which have exited are merged into the aggregate file, then removed.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        aggregate_path = os.path.join(self.directory, AGGREGATE_FILENAME)
+
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            # concurrent scrapes must not merge the same files twice
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            values = {}
+            _merge_values(values, _read_values(aggregate_path))
+            exited_paths = []
+            for path in glob.glob(os.path.join(self.directory, '*-*.json')):
+                pid = os.path.basename(path).split('-', 1)[0]
+                if pid.isdigit() and not _is_process_alive(int(pid)):
+                    _merge_values(values, _read_values(path))
+                    exited_paths.append(path)
+
+            if exited_paths:
+                _write_values(aggregate_path, _dump_values(values))
+                for path in exited_paths:
+                    os.remove(path)
+
+            for path in glob.glob(os.path.join(self.directory, '*-*.json')):
+                if path not in exited_paths:
+                    _merge_values(values, _read_values(path))
+
+        return values
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+
+        if not self.directory:
+            return ''.join(f'{metric.render()}\n' for metric in metrics)
+
+        self.flush()
+        values = self._collect()
+        return ''.join(f'{metric.render(values.get(metric.name, (None, {}))[1])}\n' for metric in metrics)
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_http_server(port, registry=None):
+    """Serve the metrics of `registry` on `port` from a daemon thread, for the processes which are not web servers."""
+    registry = registry or REGISTRY
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            content = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = _ThreadingHTTPServer(('', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-exporter', daemon=True).start()
+    return server
+
+
+REGISTRY = Registry(directory=os.environ.get('METRICS_MULTIPROC_DIR'))
@@ -1,9 +1,66 @@
 # encoding: utf-8
 
 from __future__ import unicode_literals, absolute_import
-from rest_framework.pagination import PageNumberPagination
+
+import base64
+import binascii
+import json
+
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class LimitedPagination(PageNumberPagination):
     page_size = 30
     max_page_size = 10000
+
+
+class LedgerPagination(BasePagination):
+    """Cursor pagination of ledger asset lists.
+
+    Pagination is enabled when the client requests a page size, so that existing clients keep
+    receiving the full list. The cursor is opaque to clients and defined by the view, which
+    returns the cursor of the next page along with the page results.
+    """
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    max_page_size = LimitedPagination.max_page_size
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        """Return the requested page size, None if the list is not paginated."""
+        self.request = request
+        if self.page_size_query_param not in request.query_params:
+            return None
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param], strict=True,
+                                 cutoff=self.max_page_size)
+        except ValueError:
+            raise ValidationError('Invalid page size')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return {}
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(cursor, dict):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def encode_cursor(self, cursor):
+        return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+    def get_paginated_response(self, data, next_cursor=None):
+        next_link = None
+        if next_cursor is not None:
+            next_link = replace_query_param(
+                self.request.build_absolute_uri(), self.cursor_query_param, self.encode_cursor(next_cursor))
+        return Response({
+            'next': next_link,
+            'results': data,
+        })
@@ -1,12 +1,19 @@
+import asyncio
+import concurrent.futures
 import functools
 import json
 import logging
+import threading
 import time
 
 from uuid import UUID
 from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
 from grpc import RpcError
-from substrapp.ledger.connection import get_hfc
+from libs.metrics import REGISTRY
+from substrapp.ledger.connection import get_async_hfc, record_peer_response, run_sync, submit
+from substrapp.ledger.retry import RetryPolicy
 from substrapp.ledger.exceptions import (raise_for_status, LedgerForbidden, LedgerTimeout, LedgerMVCCError,
                                          LedgerInvalidResponse, LedgerUnavailable, LedgerPhantomReadConflictError,
                                          LedgerEndorsementPolicyFailure, LedgerStatusError, LedgerError,
@@ -14,8 +21,42 @@ from substrapp.ledger.exceptions import (raise_for_status, LedgerForbidden, Ledg
 
 logger = logging.getLogger(__name__)
 
+# Assets served through the ledger cache
+CACHED_QUERIES = (
+    'queryAlgo',
+    'queryCompositeAlgo',
+    'queryAggregateAlgo',
+    'queryObjective',
+    'queryDataManager',
+)
+
+# Invokes modifying cached assets: for each one, the cached query and a function
+# returning the keys of the modified assets from the invoke args
+CACHE_INVALIDATING_INVOKES = {
+    'updateDataManager': ('queryDataManager', lambda args: [args['data_manager_key']]),
+    'registerObjective': ('queryDataManager', lambda args: [args['test_dataset']['data_manager_key']]
+                          if args.get('test_dataset') else []),
+}
+
+# Cached queries of assets which can be modified, cached for LEDGER_CACHE_MUTABLE_TIMEOUT_SECONDS only
+MUTABLE_CACHED_QUERIES = tuple({query for query, _ in CACHE_INVALIDATING_INVOKES.values()})
+
+LEDGER_CALLS = REGISTRY.counter(
+    'ledger_calls', 'Ledger calls by chaincode function and error class, empty if the call succeeded',
+    ('channel', 'call_type', 'fcn', 'error'))
+LEDGER_CALL_DURATION = REGISTRY.histogram(
+    'ledger_call_duration_seconds', 'Ledger call latency by chaincode function, including all the bookmark pages',
+    ('channel', 'call_type', 'fcn'))
+LEDGER_CALL_RETRIES = REGISTRY.counter(
+    'ledger_call_retries', 'Ledger calls retried after an error, by function and error class',
+    ('function', 'error'))
 
-def retry_on_error(delay=1, nbtries=15, backoff=2, exceptions=None):
+
+def retry_on_error(exceptions=None, policy=None):
+    """Retry ledger calls failing with transient errors.
+
+    Retries follow `policy`, by default the `RetryPolicy` configured by LEDGER_CALL_RETRY_POLICY.
+    """
     exceptions = exceptions or []
     exceptions_to_retry = [
         LedgerMVCCError,
@@ -31,26 +72,48 @@ def retry_on_error(delay=1, nbtries=15, backoff=2, exceptions=None):
     exceptions_to_retry.extend(exceptions)
     exceptions_to_retry = tuple(exceptions_to_retry)
 
+    def _get_retry_delay(fn, retries, e):
+        delay = retries.get_delay(e)
+        if delay is not None:
+            LEDGER_CALL_RETRIES.inc(function=fn.__name__, error=e.__class__.__name__)
+            logger.warning(f'Function {fn.__name__} failed ({type(e)}): {e} retrying in {delay:.2f}s')
+        return delay
+
     def _retry(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def _async_wrapper(*args, **kwargs):
+                if not settings.LEDGER_CALL_RETRY:
+                    return await fn(*args, **kwargs)
+
+                retries = (policy or RetryPolicy.from_settings()).start()
+
+                while True:
+                    try:
+                        return await fn(*args, **kwargs)
+                    except exceptions_to_retry as e:
+                        delay = _get_retry_delay(fn, retries, e)
+                        if delay is None:
+                            raise
+                        await asyncio.sleep(delay)
+
+            return _async_wrapper
+
         @functools.wraps(fn)
         def _wrapper(*args, **kwargs):
             if not settings.LEDGER_CALL_RETRY:
                 return fn(*args, **kwargs)
 
-            _delay = delay
-            _nbtries = nbtries
-            _backoff = backoff
+            retries = (policy or RetryPolicy.from_settings()).start()
 
             while True:
                 try:
                     return fn(*args, **kwargs)
                 except exceptions_to_retry as e:
-                    _nbtries -= 1
-                    if not _nbtries:
+                    delay = _get_retry_delay(fn, retries, e)
+                    if delay is None:
                         raise
-                    _delay += _backoff
-                    time.sleep(_delay)
-                    logger.warning(f'Function {fn.__name__} failed ({type(e)}): {e} retrying in {_delay}s')
+                    time.sleep(delay)
 
         return _wrapper
     return _retry
@@ -88,9 +151,9 @@ class UUIDEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
-def _call_ledger(channel_name, call_type, fcn, args=None, kwargs=None):
+async def _acall_ledger(channel_name, call_type, fcn, args=None, kwargs=None):
 
-    with get_hfc(channel_name) as (loop, client, user):
+    async with get_async_hfc(channel_name) as (client, user):
         if not args:
             args = []
         else:
@@ -121,7 +184,7 @@ def _call_ledger(channel_name, call_type, fcn, args=None, kwargs=None):
             params.update(kwargs)
 
         try:
-            response = loop.run_until_complete(chaincode_calls[call_type](**params))
+            response = await chaincode_calls[call_type](**params)
         except TimeoutError as e:
             raise LedgerTimeout(str(e))
         except Exception as e:
@@ -151,6 +214,8 @@ def _call_ledger(channel_name, call_type, fcn, args=None, kwargs=None):
             except Exception:
                 raise LedgerError(str(e))
 
+        record_peer_response(channel_name)
+
         # Deserialize the stringified json
         try:
             response = json.loads(response)
@@ -163,18 +228,18 @@ def _call_ledger(channel_name, call_type, fcn, args=None, kwargs=None):
         return response
 
 
-def call_ledger(channel_name, call_type, fcn, *args, **kwargs):
+async def acall_ledger(channel_name, call_type, fcn, *args, **kwargs):
     """Call ledger and log each request."""
     ts = time.time()
     error = None
     try:
-        response = _call_ledger(channel_name, call_type, fcn, *args, **kwargs)
+        response = await _acall_ledger(channel_name, call_type, fcn, *args, **kwargs)
 
         if isinstance(response, dict) and 'bookmark' in response:
             results = response['results']  # first results
             while response['results'] and len(response['bookmark']) > 0:
                 kwargs['args'] = {'bookmark': response['bookmark']}
-                response = _call_ledger(channel_name, call_type, fcn, *args, **kwargs)
+                response = await _acall_ledger(channel_name, call_type, fcn, *args, **kwargs)
                 results.extend(response['results'])  # following results
             else:
                 response = results
@@ -186,15 +251,25 @@ def call_ledger(channel_name, call_type, fcn, *args, **kwargs):
         raise
     finally:
         # add a log even if the function raises an exception
-        te = time.time()
-        elaps = (te - ts) * 1000
-        if error is None:
-            logger.info(f"(smartcontract) {call_type}:{fcn} took {elaps:.2f} ms")
-        else:
-            logger.info(f"(smartcontract) {call_type}:{fcn} took {elaps:.2f} ms. Error: {error}")
+        _record_call(channel_name, call_type, fcn, time.time() - ts, error)
+
+
+def _record_call(channel_name, call_type, fcn, duration, error=None):
+    elaps = duration * 1000
+    if error is None:
+        logger.info(f"(smartcontract) {call_type}:{fcn} took {elaps:.2f} ms")
+    else:
+        logger.info(f"(smartcontract) {call_type}:{fcn} took {elaps:.2f} ms. Error: {error}")
+
+    LEDGER_CALLS.inc(channel=channel_name, call_type=call_type, fcn=fcn, error=error or '')
+    LEDGER_CALL_DURATION.observe(duration, channel=channel_name, call_type=call_type, fcn=fcn)
 
 
-def _invoke_ledger(channel_name, fcn, args=None, cc_pattern=None, sync=False, only_key=True):
+def call_ledger(channel_name, call_type, fcn, *args, **kwargs):
+    return run_sync(acall_ledger(channel_name, call_type, fcn, *args, **kwargs))
+
+
+async def _ainvoke_ledger(channel_name, fcn, args=None, cc_pattern=None, sync=False, only_key=True):
     params = {
         'wait_for_event': sync,
         'grpc_broker_unavailable_retry': 5,
@@ -208,7 +283,7 @@ def _invoke_ledger(channel_name, fcn, args=None, cc_pattern=None, sync=False, on
     if cc_pattern:
         params['cc_pattern'] = cc_pattern
 
-    response = call_ledger(channel_name, 'invoke', fcn=fcn, args=args, kwargs=params)
+    response = await acall_ledger(channel_name, 'invoke', fcn=fcn, args=args, kwargs=params)
 
     if only_key:
         return {'key': response.get('key', response.get('keys'))}
@@ -217,19 +292,108 @@ def _invoke_ledger(channel_name, fcn, args=None, cc_pattern=None, sync=False, on
 
 
 @retry_on_error(exceptions=[LedgerTimeout])
-def query_ledger(channel_name, fcn, args=None):
+async def aquery_ledger(channel_name, fcn, args=None):
     # careful, passing invoke parameters to query_ledger will NOT fail
-    return call_ledger(channel_name, 'query', fcn=fcn, args=args)
+    return await acall_ledger(channel_name, 'query', fcn=fcn, args=args)
 
 
 @retry_on_error()
-def invoke_ledger(channel_name, *args, **kwargs):
-    return _invoke_ledger(channel_name, *args, **kwargs)
+async def ainvoke_ledger(channel_name, *args, **kwargs):
+    return await _ainvoke_ledger(channel_name, *args, **kwargs)
 
 
 @retry_on_error(exceptions=[LedgerTimeout, LedgerAssetNotFound])
+async def aupdate_ledger(channel_name, *args, **kwargs):
+    return await _ainvoke_ledger(channel_name, *args, **kwargs)
+
+
+@retry_on_error(exceptions=[LedgerTimeout])
+async def aquery_ledger_page(channel_name, fcn, bookmark=''):
+    """Query a single bookmark page of a ledger list.
+
+    Return the page results and the bookmark of the next page, empty if it is the last page.
+    """
+    args = {'bookmark': bookmark} if bookmark else None
+    ts = time.time()
+    error = None
+    try:
+        response = await _acall_ledger(channel_name, 'query', fcn=fcn, args=args)
+    except Exception as e:
+        error = e.__class__.__name__
+        raise
+    finally:
+        _record_call(channel_name, 'query', fcn, time.time() - ts, error)
+
+    if isinstance(response, dict) and 'bookmark' in response:
+        results = response['results'] or []
+        return results, response['bookmark'] if results else ''
+
+    # the query is not paginated by the chaincode
+    return response or [], ''
+
+
+async def aiter_query_ledger_pages(channel_name, fcn, bookmark=''):
+    """Query a ledger list and yield its results page by page, following the chaincode bookmarks.
+
+    Only one bookmark page is held in memory at a time, unlike `aquery_ledger` which
+    accumulates the whole list.
+    """
+    while True:
+        results, bookmark = await aquery_ledger_page(channel_name, fcn, bookmark=bookmark)
+        if results:
+            yield results
+        if not bookmark:
+            return
+
+
+def query_ledger(channel_name, fcn, args=None):
+    return run_sync(aquery_ledger(channel_name, fcn, args=args))
+
+
+def query_ledger_page(channel_name, fcn, bookmark=''):
+    return run_sync(aquery_ledger_page(channel_name, fcn, bookmark=bookmark))
+
+
+def iter_query_ledger_pages(channel_name, fcn, bookmark=''):
+    """Synchronous counterpart of `aiter_query_ledger_pages`.
+
+    Each page is queried on the shared event loop when the generator is advanced.
+    """
+    while True:
+        results, bookmark = query_ledger_page(channel_name, fcn, bookmark=bookmark)
+        if results:
+            yield results
+        if not bookmark:
+            return
+
+
+def iter_query_ledger(channel_name, fcn):
+    """Query a ledger list and yield its results one by one."""
+    for results in iter_query_ledger_pages(channel_name, fcn):
+        yield from results
+
+
+def invoke_ledger(channel_name, *args, **kwargs):
+    response = run_sync(ainvoke_ledger(channel_name, *args, **kwargs))
+    invalidate_cached_objects(channel_name, kwargs.get('fcn'), kwargs.get('args'))
+    return response
+
+
 def update_ledger(channel_name, *args, **kwargs):
-    return _invoke_ledger(channel_name, *args, **kwargs)
+    response = run_sync(aupdate_ledger(channel_name, *args, **kwargs))
+    invalidate_cached_objects(channel_name, kwargs.get('fcn'), kwargs.get('args'))
+    return response
+
+
+async def aget_ledger_height(channel_name):
+    async with get_async_hfc(channel_name) as (client, user):
+        info = await client.query_info(user, channel_name, [settings.LEDGER_PEER_NAME], decode=True)
+        record_peer_response(channel_name)
+        return info.height
+
+
+def get_ledger_height(channel_name):
+    return run_sync(aget_ledger_height(channel_name))
 
 
 def query_tuples(channel_name, tuple_type, data_owner):
@@ -249,8 +413,77 @@ def query_tuples(channel_name, tuple_type, data_owner):
     return data
 
 
+def _get_cache_key(channel_name, key, query):
+    return f'{channel_name}:{query}:{key}'
+
+
 def get_object_from_ledger(channel_name, key, query):
-    return query_ledger(channel_name, fcn=query, args={'key': key})
+    if query not in CACHED_QUERIES:
+        return query_ledger(channel_name, fcn=query, args={'key': key})
+
+    cache = caches['ledger']
+    cache_key = _get_cache_key(channel_name, key, query)
+
+    data = cache.get(cache_key)
+    if data is None:
+        data = query_ledger(channel_name, fcn=query, args={'key': key})
+        cache.set(cache_key, data, timeout=_get_cache_timeout(query))
+    return data
+
+
+def _get_cache_timeout(query):
+    if query in MUTABLE_CACHED_QUERIES:
+        return settings.LEDGER_CACHE_MUTABLE_TIMEOUT_SECONDS
+    return DEFAULT_TIMEOUT
+
+
+def invalidate_cached_objects(channel_name, fcn, args):
+    """Remove from the ledger cache the assets modified by a successful invoke."""
+    if fcn not in CACHE_INVALIDATING_INVOKES or not args:
+        return
+
+    query, get_keys = CACHE_INVALIDATING_INVOKES[fcn]
+    caches['ledger'].delete_many([
+        _get_cache_key(channel_name, key, query)
+        for key in get_keys(args)
+    ])
+
+
+async def aget_objects_from_ledger(channel_name, queries):
+    """Query several objects from the ledger concurrently.
+
+    `queries` is a list of (key, query) pairs, results are returned in the same order.
+    """
+    return await asyncio.gather(*[
+        aquery_ledger(channel_name, fcn=query, args={'key': key})
+        for key, query in queries
+    ])
+
+
+def get_objects_from_ledger(channel_name, queries):
+    cache = caches['ledger']
+    cache_keys = {
+        (key, query): _get_cache_key(channel_name, key, query)
+        for key, query in queries
+        if query in CACHED_QUERIES
+    }
+    cached_objects = cache.get_many(list(cache_keys.values()))
+
+    objects = {
+        (key, query): cached_objects[cache_keys[(key, query)]]
+        for key, query in cache_keys
+        if cache_keys[(key, query)] in cached_objects
+    }
+
+    missing_queries = [(key, query) for key, query in queries if (key, query) not in objects]
+    if missing_queries:
+        results = run_sync(aget_objects_from_ledger(channel_name, missing_queries))
+        objects.update(zip(missing_queries, results))
+        for (key, query), data in zip(missing_queries, results):
+            if query in CACHED_QUERIES:
+                cache.set(cache_keys[(key, query)], data, timeout=_get_cache_timeout(query))
+
+    return [objects[(key, query)] for key, query in queries]
 
 
 LOG_TUPLE_INVOKE_FCNS = {
@@ -275,10 +508,19 @@ LOG_TUPLE_INVOKE_FCNS = {
 }
 
 
-def _update_tuple_status(channel_name, tuple_type, tuple_key, status, extra_kwargs=None):
+# Final tuple status updates of this process waiting for their block to be committed
+_pending_status_updates = set()
+_pending_status_updates_lock = threading.Lock()
+
+
+def _update_tuple_status(channel_name, tuple_type, tuple_key, status, extra_kwargs=None, wait=True):
     """Update tuple status to doing, done or failed.
 
     In case of ledger timeout, query the ledger until the status has been updated.
+
+    Unless `wait` is set, the update is sent in the background and the block commit is awaited on the ledger
+    event loop: the worker moves on to its next task, and the status updates of successive tasks are committed
+    in the same blocks. Its errors are logged.
     """
     try:
         invoke_fcn = LOG_TUPLE_INVOKE_FCNS[status][tuple_type]
@@ -291,7 +533,31 @@ def _update_tuple_status(channel_name, tuple_type, tuple_key, status, extra_kwar
     if extra_kwargs:
         invoke_args.update(extra_kwargs)
 
-    update_ledger(channel_name, fcn=invoke_fcn, args=invoke_args, sync=True)
+    if wait:
+        update_ledger(channel_name, fcn=invoke_fcn, args=invoke_args, sync=True)
+        return
+
+    future = submit(aupdate_ledger(channel_name, fcn=invoke_fcn, args=invoke_args, sync=True))
+    with _pending_status_updates_lock:
+        _pending_status_updates.add(future)
+
+    def on_done(future):
+        with _pending_status_updates_lock:
+            _pending_status_updates.discard(future)
+        try:
+            future.result()
+        except Exception as e:
+            logger.error(f'Failed to update the status of {tuple_type} {tuple_key} to {status} ({type(e)}): {e}')
+
+    future.add_done_callback(on_done)
+
+
+def wait_for_tuple_status_updates(timeout=None):
+    """Wait for the status updates sent in the background by this process, before it exits."""
+    with _pending_status_updates_lock:
+        futures = list(_pending_status_updates)
+    if futures:
+        concurrent.futures.wait(futures, timeout=timeout)
 
 
 def log_start_tuple(channel_name, tuple_type, tuple_key):
@@ -303,7 +569,7 @@ def log_fail_tuple(channel_name, tuple_type, tuple_key, err_msg):
     extra_kwargs = {
         'log': err_msg,
     }
-    _update_tuple_status(channel_name, tuple_type, tuple_key, 'failed', extra_kwargs=extra_kwargs)
+    _update_tuple_status(channel_name, tuple_type, tuple_key, 'failed', extra_kwargs=extra_kwargs, wait=False)
 
 
 def log_success_tuple(channel_name, tuple_type, tuple_key, res):
@@ -338,4 +604,4 @@ def log_success_tuple(channel_name, tuple_type, tuple_key, res):
             'perf': float(res["global_perf"]),
         })
 
-    _update_tuple_status(channel_name, tuple_type, tuple_key, 'done', extra_kwargs=extra_kwargs)
+    _update_tuple_status(channel_name, tuple_type, tuple_key, 'done', extra_kwargs=extra_kwargs, wait=False)
@@ -7,6 +7,7 @@ from django.core.exceptions import ObjectDoesNotExist
 from substrapp import models
 from substrapp.ledger.api import invoke_ledger
 from substrapp.ledger.exceptions import LedgerError, LedgerTimeout
+from substrapp.ledger.projection import invalidate_projections
 
 
 _MESSAGE = (
@@ -16,6 +17,14 @@ _MESSAGE = (
 )
 
 
+def _invoke_ledger(channel_name, fcn, args, **kwargs):
+    try:
+        return invoke_ledger(channel_name, fcn=fcn, args=args, **kwargs)
+    finally:
+        # the transaction may have been committed even if the call failed
+        invalidate_projections(channel_name, fcn)
+
+
 def __create_db_asset(channel_name, model, fcn, args, key, sync=False):
     try:
         instance = model.objects.get(key=key)
@@ -23,7 +32,7 @@ def __create_db_asset(channel_name, model, fcn, args, key, sync=False):
         instance = None
 
     try:
-        data = invoke_ledger(channel_name, fcn=fcn, args=args, sync=sync)
+        data = _invoke_ledger(channel_name, fcn, args, sync=sync)
     except LedgerTimeout:
         # LedgerTimeout herits from LedgerError do not delete
         # In case of timeout we keep the instance if it exists
@@ -57,7 +66,7 @@ def __create_db_assets(channel_name, model, fcn, args, keys, sync=False):
         instances = None
 
     try:
-        data = invoke_ledger(channel_name, fcn=fcn, args=args, sync=sync)
+        data = _invoke_ledger(channel_name, fcn, args, sync=sync)
     except LedgerTimeout:
         # LedgerTimeout herits from LedgerError do not delete
         # In case of timeout we keep the instances if it exists
@@ -86,7 +95,7 @@ def _create_db_assets(channel_name, fcn, model, args, keys):
 def __create_asset(channel_name, fcn, args, sync=False, **extra_kwargs):
     # create a wrapper as it seems the shared_task decorator from celery is not
     # compatible with our retry decorator on the invoke_ledger function
-    return invoke_ledger(channel_name, fcn=fcn, args=args, sync=sync, **extra_kwargs)
+    return _invoke_ledger(channel_name, fcn, args, sync=sync, **extra_kwargs)
 
 
 def _create_asset(channel_name, fcn, args, **extra_kwargs):
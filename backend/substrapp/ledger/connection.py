@@ -1,11 +1,15 @@
 import base64
+import collections
 import contextlib
 import asyncio
 import glob
-import tempfile
+import logging
+import os
 import threading
+import time
 
 from django.conf import settings
+from grpc import RpcError
 from hfc.fabric import Client
 from hfc.fabric.peer import Peer
 from hfc.fabric.user import create_user
@@ -13,9 +17,18 @@ from hfc.fabric.orderer import Orderer
 from hfc.util.keyvaluestore import FileKeyValueStore
 from hfc.fabric.block_decoder import decode_fabric_MSP_config, decode_fabric_peers_info, decode_fabric_endpoints
 
+from substrapp.ledger.exceptions import (LedgerUnavailable, LedgerEndorsementPolicyFailure, LedgerCircuitOpen,
+                                         LedgerError, LedgerTimeout)
+
+logger = logging.getLogger(__name__)
+
 user = None
 user_lock = threading.Lock()
 
+# Errors after which a pooled connection is considered broken: it is closed instead
+# of being released to the pool, and a new one is created on the next call.
+CONNECTION_ERRORS = (RpcError, LedgerUnavailable)
+
 
 def ledger_grpc_options(hostname):
     return {
@@ -28,24 +41,444 @@ def ledger_grpc_options(hostname):
     }
 
 
+class EventLoopThread(object):
+    """Event loop running forever in a daemon thread.
+
+    All the ledger connections of a process are bound to this loop, so that many
+    concurrent chaincode calls can share it.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name='ledger-event-loop', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(self, coro):
+        """Run a coroutine on the loop and wait for its result."""
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError('Cannot wait for a coroutine from the ledger event loop thread, await it instead')
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+
+class ClientPool(object):
+    """Pool of warm ledger connections, keyed by channel name.
+
+    A connection is a `(client, user)` tuple bound to the shared ledger event loop. A connection
+    is used by a single coroutine at a time: it is checked out with `acquire` and given back
+    with `release`. All methods must be called from the shared ledger event loop.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._condition = None
+        self._idle = collections.defaultdict(list)
+        self._size = collections.defaultdict(int)
+        # Connections (identified by their client) created before the last `invalidate` call of their
+        # channel are not reused
+        self._generation = collections.defaultdict(int)
+        self._connection_generation = {}
+
+    def _check_pid(self):
+        # gRPC channels are not fork safe: a forked process (celery prefork, billiard, multiprocessing)
+        # must not reuse the connections of its parent. Drop them without closing them.
+        if self._pid != os.getpid():
+            self._reset()
+
+    @property
+    def condition(self):
+        # Created lazily to be bound to the running loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self, channel_name):
+        self._check_pid()
+        async with self.condition:
+            while not self._idle[channel_name] and self._size[channel_name] >= self.max_size:
+                await self.condition.wait()
+
+            if self._idle[channel_name]:
+                return self._idle[channel_name].pop()
+
+            self._size[channel_name] += 1
+            generation = self._generation[channel_name]
+
+        try:
+            connection = await _get_hfc(channel_name)
+        except BaseException:
+            async with self.condition:
+                self._size[channel_name] -= 1
+                self.condition.notify()
+            raise
+
+        self._connection_generation[id(connection[0])] = generation
+        return connection
+
+    async def release(self, channel_name, connection, discard=False):
+        if self._pid != os.getpid():
+            return
+
+        async with self.condition:
+            generation = self._connection_generation.get(id(connection[0]))
+            if generation != self._generation[channel_name]:
+                discard = True
+
+            if discard:
+                self._connection_generation.pop(id(connection[0]), None)
+                self._size[channel_name] -= 1
+            else:
+                self._idle[channel_name].append(connection)
+            self.condition.notify()
+
+        if discard:
+            await _close_hfc(connection)
+
+    async def invalidate(self, channel_name):
+        """Close the idle connections of a channel and renew the checked out ones when released."""
+        self._check_pid()
+        async with self.condition:
+            self._generation[channel_name] += 1
+            idle, self._idle[channel_name] = self._idle[channel_name], []
+            for connection in idle:
+                self._connection_generation.pop(id(connection[0]), None)
+            self._size[channel_name] -= len(idle)
+            self.condition.notify_all()
+
+        for connection in idle:
+            await _close_hfc(connection)
+
+    async def clear(self):
+        """Close all the idle connections."""
+        for channel_name in list(self._idle):
+            await self.invalidate(channel_name)
+
+
+class DiscoveryCache(object):
+    """Channel discovery results, shared by all the connections of the process.
+
+    Results older than `refresh_interval` seconds are still returned, but are refreshed in a
+    background task. Results older than `ttl` seconds are discovered again before being returned.
+    """
+
+    def __init__(self, ttl, refresh_interval):
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._refreshing = set()
+        self._pid = os.getpid()
+
+    async def get(self, channel_name, discover):
+        """Return the discovery results of a channel, awaiting `discover()` if they are expired."""
+        with self._lock:
+            entry = self._entries.get(channel_name)
+
+        age = time.time() - entry[0] if entry else None
+
+        if entry is None or age > self.ttl:
+            results = await discover()
+            self.set(channel_name, results)
+            return results
+
+        if age > self.refresh_interval:
+            self._refresh_in_background(channel_name)
+
+        return entry[1]
+
+    def set(self, channel_name, results):
+        """Store discovery results and return True if they differ from the previous ones."""
+        with self._lock:
+            previous = self._entries.get(channel_name)
+            self._entries[channel_name] = (time.time(), results)
+        return previous is not None and previous[1] != results
+
+    def invalidate(self, channel_name):
+        with self._lock:
+            self._entries.pop(channel_name, None)
+
+    def _refresh_in_background(self, channel_name):
+        with self._lock:
+            if self._pid != os.getpid():
+                # refresh tasks are not inherited by forked processes
+                self._pid = os.getpid()
+                self._refreshing = set()
+
+            if channel_name in self._refreshing:
+                return
+            self._refreshing.add(channel_name)
+
+        asyncio.ensure_future(self._refresh(channel_name))
+
+    async def _refresh(self, channel_name):
+        try:
+            async with get_async_hfc(channel_name) as (client, user):
+                results = await _discover(
+                    client.get_channel(channel_name),
+                    user,
+                    client._peers[settings.LEDGER_PEER_NAME]
+                )
+                record_peer_response(channel_name)
+            _validate_channels(channel_name, results)
+        except Exception as e:
+            logger.warning(f'Failed to refresh discovery results of channel {channel_name} ({type(e)}): {e}')
+            self.invalidate(channel_name)
+        else:
+            if self.set(channel_name, results):
+                logger.info(f'Discovery results of channel {channel_name} changed, renewing connections')
+                await get_pool().invalidate(channel_name)
+        finally:
+            with self._lock:
+                self._refreshing.discard(channel_name)
+
+
+class CircuitBreaker(object):
+    """Circuit breaker of the ledger calls to a channel.
+
+    The circuit opens after `failure_threshold` consecutive connection errors: calls then fail fast
+    with `LedgerCircuitOpen` instead of waiting for the unreachable peer. After `reset_timeout`
+    seconds, the circuit is half-open and a single probe call goes through: the circuit closes if
+    the probe reaches the peer and opens again otherwise.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, channel_name, failure_threshold, reset_timeout):
+        self.channel_name = channel_name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def _get_state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.time() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._get_state()
+
+    def before_call(self):
+        """Raise `LedgerCircuitOpen` if the call must fail fast."""
+        with self._lock:
+            state = self._get_state()
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+        raise LedgerCircuitOpen(f'Ledger calls to channel {self.channel_name} are suspended after connection errors')
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f'Ledger circuit of channel {self.channel_name} is closed')
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(f'Ledger circuit of channel {self.channel_name} is open after '
+                                   f'{self._failures} consecutive connection errors')
+                self._opened_at = time.time()
+            self._probing = False
+
+    def record_abort(self):
+        """Record a call which ended before reaching the peer."""
+        with self._lock:
+            self._probing = False
+
+
+_event_loop_thread = None
+_pool = None
+_discovery_cache = None
+_circuit_breakers = {}
+_lock = threading.Lock()
+
+
+def get_event_loop_thread():
+    global _event_loop_thread
+
+    # Threads are not inherited by forked processes: start a new loop in the child process
+    if _event_loop_thread is None or _event_loop_thread.pid != os.getpid():
+        with _lock:
+            if _event_loop_thread is None or _event_loop_thread.pid != os.getpid():
+                _event_loop_thread = EventLoopThread()
+    return _event_loop_thread
+
+
+def run_sync(coro):
+    """Run a coroutine on the shared ledger event loop and wait for its result."""
+    return get_event_loop_thread().run(coro)
+
+
+def submit(coro):
+    """Schedule a coroutine on the shared ledger event loop without waiting for it.
+
+    Return a `concurrent.futures.Future` of its result.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop_thread().loop)
+
+
+def run_async(coro):
+    """Run a coroutine on the shared ledger event loop and return a future of its result for the current loop."""
+    return asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, get_event_loop_thread().loop))
+
+
+def get_pool():
+    global _pool
+
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                _pool = ClientPool(max_size=settings.LEDGER_CLIENT_POOL_MAX_SIZE)
+    return _pool
+
+
+def get_discovery_cache():
+    global _discovery_cache
+
+    if _discovery_cache is None:
+        with _lock:
+            if _discovery_cache is None:
+                _discovery_cache = DiscoveryCache(
+                    ttl=settings.LEDGER_DISCOVERY_CACHE_TTL_SECONDS,
+                    refresh_interval=settings.LEDGER_DISCOVERY_REFRESH_INTERVAL_SECONDS
+                )
+    return _discovery_cache
+
+
+def get_circuit_breaker(channel_name):
+    circuit_breaker = _circuit_breakers.get(channel_name)
+
+    if circuit_breaker is None:
+        with _lock:
+            circuit_breaker = _circuit_breakers.get(channel_name)
+            if circuit_breaker is None:
+                circuit_breaker = CircuitBreaker(
+                    channel_name,
+                    failure_threshold=settings.LEDGER_CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                    reset_timeout=settings.LEDGER_CIRCUIT_BREAKER_RESET_TIMEOUT_SECONDS,
+                )
+                _circuit_breakers[channel_name] = circuit_breaker
+    return circuit_breaker
+
+
+def record_peer_response(channel_name):
+    """Record that a call to the peer of a channel got a response, closing its circuit.
+
+    Must be called by the body of `get_async_hfc` once the peer answered: checking out a pooled
+    connection does not reach the peer.
+    """
+    get_circuit_breaker(channel_name).record_success()
+
+
+def get_circuit_breaker_states():
+    """Return the state of the circuit breaker of each channel."""
+    return {
+        channel_name: get_circuit_breaker(channel_name).state
+        for channel_name in settings.LEDGER_CHANNELS
+    }
+
+
+class get_async_hfc(object):
+    """Asynchronous context manager checking out a pooled `(client, user)` connection to a channel.
+
+    Must be used from the shared ledger event loop. Raise `LedgerCircuitOpen` if the circuit
+    breaker of the channel is open. The body must call `record_peer_response` once the peer answered.
+    """
+
+    def __init__(self, channel_name):
+        self.channel_name = channel_name
+        self.pool = get_pool()
+        self.circuit_breaker = get_circuit_breaker(channel_name)
+        self.connection = None
+
+    async def __aenter__(self):
+        self.circuit_breaker.before_call()
+        try:
+            self.connection = await self.pool.acquire(self.channel_name)
+        except CONNECTION_ERRORS:
+            self.circuit_breaker.record_failure()
+            raise
+        except BaseException:
+            self.circuit_breaker.record_abort()
+            raise
+        return self.connection
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        discard = False
+
+        if exc_type is not None and issubclass(exc_type, CONNECTION_ERRORS):
+            logger.warning(f'Ledger connection to channel {self.channel_name} is broken '
+                           f'({exc_type}): {exc_value}, discarding it')
+            discard = True
+            get_discovery_cache().invalidate(self.channel_name)
+            self.circuit_breaker.record_failure()
+        elif exc_type is not None and issubclass(exc_type, LedgerError) and not issubclass(exc_type, LedgerTimeout):
+            # the peer answered, even if with an error
+            self.circuit_breaker.record_success()
+        else:
+            # either the body recorded the response of the peer, or it did not reach the peer
+            self.circuit_breaker.record_abort()
+
+        if exc_type is not None and issubclass(exc_type, LedgerEndorsementPolicyFailure):
+            # Endorsing peers may have changed: discover them again
+            get_discovery_cache().invalidate(self.channel_name)
+            await self.pool.invalidate(self.channel_name)
+
+        await self.pool.release(self.channel_name, self.connection, discard=discard)
+        return False
+
+
 @contextlib.contextmanager
 def get_hfc(channel_name):
-    loop, client, user = _get_hfc(channel_name)
+    """Check out a pooled `(client, user)` connection to a channel from a synchronous caller.
+
+    Coroutines of the client must be run with `run_sync`.
+    """
+    hfc = get_async_hfc(channel_name)
+    connection = run_sync(hfc.__aenter__())
     try:
-        yield (loop, client, user)
-    finally:
-        loop.run_until_complete(
-            client.close_grpc_channels()
-        )
-        del client
-        loop.close()
+        yield connection
+    except BaseException as e:
+        run_sync(hfc.__aexit__(type(e), e, e.__traceback__))
+        raise
+    else:
+        run_sync(hfc.__aexit__(None, None, None))
 
 
-def _get_hfc(channel_name):
-    global user
+async def _close_hfc(connection):
+    client, _ = connection
+    try:
+        await client.close_grpc_channels()
+    except Exception as e:
+        logger.warning(f'Failed to close ledger connection: {e}')
+
 
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+async def _get_hfc(channel_name):
+    global user
 
     if not user:
         with user_lock:
@@ -75,17 +508,16 @@ def _get_hfc(channel_name):
 
     # Check peer has joined channel
 
-    response = loop.run_until_complete(
-        client.query_channels(
-            requestor=user,
-            peers=[peer],
-            decode=True
-        )
+    response = await client.query_channels(
+        requestor=user,
+        peers=[peer],
+        decode=True
     )
 
     channels = [ch.channel_id for ch in response.channels]
 
     if channel_name not in channels:
+        await client.close_grpc_channels()
         raise Exception(f'Peer has not joined channel: {channel_name}')
 
     channel = client.new_channel(channel_name)
@@ -98,13 +530,11 @@ def _get_hfc(channel_name):
     # /!\ New chaincode lifecycle.
 
     # Check chaincode is committed in the channel
-    # responses = loop.run_until_complete(
-    #     client.query_committed_chaincodes(
-    #         requestor=user,
-    #         channel_name=channel_name,
-    #         peers=[peer],
-    #         decode=True
-    #     )
+    # responses = await client.query_committed_chaincodes(
+    #     requestor=user,
+    #     channel_name=channel_name,
+    #     peers=[peer],
+    #     decode=True
     # )
     # chaincodes = [cc.name
     #               for resp in responses
@@ -114,22 +544,32 @@ def _get_hfc(channel_name):
     #                     f' is not committed in the channel :  {channel_name}')
 
     # Discover orderers and peers from channel discovery
-    results = loop.run_until_complete(
-        channel._discovery(
-            user,
-            peer,
-            config=True,
-            local=False,
-            interests=[{'chaincodes': [{'name': "_lifecycle"}]}]
-        )
+    results = await get_discovery_cache().get(
+        channel_name,
+        lambda: _discover(channel, user, peer)
     )
 
-    results = _deserialize_discovery(results)
+    try:
+        _validate_channels(channel_name, results)
+    except Exception:
+        await client.close_grpc_channels()
+        raise
 
-    _validate_channels(channel_name, results)
     _update_client_with_discovery(client, results)
 
-    return loop, client, user
+    return client, user
+
+
+async def _discover(channel, user, peer):
+    results = await channel._discovery(
+        user,
+        peer,
+        config=True,
+        local=False,
+        interests=[{'chaincodes': [{'name': "_lifecycle"}]}]
+    )
+
+    return _deserialize_discovery(results)
 
 
 def _validate_channels(channel_name, discovery_results):
@@ -147,12 +587,13 @@ def _validate_channels(channel_name, discovery_results):
 
 def _update_client_with_discovery(client, discovery_results):
 
-    # Get all msp tls root cert files
+    # Get all msp tls root certs, they are given to grpc as bytes
+    # Discovery results are cached and shared between clients: they must not be modified
     tls_root_certs = {}
 
     for mspid, msp_info in discovery_results['config']['msps'].items():
         tls_root_certs[mspid] = base64.decodebytes(
-            msp_info['tls_root_certs'].pop().encode()
+            msp_info['tls_root_certs'][-1].encode()
         )
 
     # Load one peer per msp for endorsing transaction
@@ -165,18 +606,14 @@ def _update_client_with_discovery(client, discovery_results):
         if peer_info['mspid'] != settings.LEDGER_MSP_ID:
             peer = Peer(name=peer_info['mspid'])
 
-            with tempfile.NamedTemporaryFile() as tls_root_cert:
-                tls_root_cert.write(tls_root_certs[peer_info['mspid']])
-                tls_root_cert.flush()
-
-                url = peer_info['endpoint']
-                peer.init_with_bundle({
-                    'url': url,
-                    'grpcOptions': ledger_grpc_options(peer_info['endpoint'].split(':')[0]),
-                    'tlsCACerts': {'path': tls_root_cert.name},
-                    'clientKey': {'path': settings.LEDGER_PEER_TLS_CLIENT_KEY},
-                    'clientCert': {'path': settings.LEDGER_PEER_TLS_CLIENT_CERT}
-                })
+            url = peer_info['endpoint']
+            peer.init_with_bundle({
+                'url': url,
+                'grpcOptions': ledger_grpc_options(peer_info['endpoint'].split(':')[0]),
+                'tlsCACerts': {'path': tls_root_certs[peer_info['mspid']]},
+                'clientKey': {'path': settings.LEDGER_PEER_TLS_CLIENT_KEY},
+                'clientCert': {'path': settings.LEDGER_PEER_TLS_CLIENT_CERT}
+            })
 
             client._peers[peer_info['mspid']] = peer
 
@@ -185,18 +622,14 @@ def _update_client_with_discovery(client, discovery_results):
 
     orderer = Orderer(name=orderer_mspid)
 
-    with tempfile.NamedTemporaryFile() as tls_root_cert:
-        tls_root_cert.write(tls_root_certs[orderer_mspid])
-        tls_root_cert.flush()
-
-        # Need loop
-        orderer.init_with_bundle({
-            'url': f"{orderer_info[0]['host']}:{orderer_info[0]['port']}",
-            'grpcOptions': ledger_grpc_options(orderer_info[0]['host']),
-            'tlsCACerts': {'path': tls_root_cert.name},
-            'clientKey': {'path': settings.LEDGER_PEER_TLS_CLIENT_KEY},
-            'clientCert': {'path': settings.LEDGER_PEER_TLS_CLIENT_CERT}
-        })
+    # Need loop
+    orderer.init_with_bundle({
+        'url': f"{orderer_info[0]['host']}:{orderer_info[0]['port']}",
+        'grpcOptions': ledger_grpc_options(orderer_info[0]['host']),
+        'tlsCACerts': {'path': tls_root_certs[orderer_mspid]},
+        'clientKey': {'path': settings.LEDGER_PEER_TLS_CLIENT_KEY},
+        'clientCert': {'path': settings.LEDGER_PEER_TLS_CLIENT_CERT}
+    })
 
     client._orderers[orderer_mspid] = orderer
 
@@ -1,5 +1,6 @@
 import json
-from substrapp.ledger.connection import get_hfc
+from substrapp.ledger.api import get_ledger_height  # noqa: F401
+from substrapp.ledger.connection import get_hfc, record_peer_response, run_sync
 from pathlib import Path
 from django.conf import settings
 from typing import Generator, Dict, List
@@ -44,17 +45,6 @@ def get_mvcc_transactions(channel_name: str, start_block: int, end_block: int) -
     return res
 
 
-def get_ledger_height(channel_name: str) -> int:
-    """Return the highest block number in the ledger (aka ledger height)"""
-    with get_hfc(channel_name) as (loop, client, user):
-        info = loop.run_until_complete(client.query_info(
-            user,
-            channel_name,
-            [settings.LEDGER_PEER_NAME],
-            decode=True))
-        return info.height
-
-
 def get_transactions(channel_name: str, start_block: int, end_block: int) -> Generator:
     for block_number in range(start_block, end_block + 1):
         block = get_block(channel_name, block_number)
@@ -69,24 +59,26 @@ def get_transactions(channel_name: str, start_block: int, end_block: int) -> Gen
 
 
 def get_block(channel_name: str, block_number: int) -> Dict:
-    with get_hfc(channel_name) as (loop, client, user):
-        block = loop.run_until_complete(client.query_block(
+    with get_hfc(channel_name) as (client, user):
+        block = run_sync(client.query_block(
             user,
             channel_name,
             [settings.LEDGER_PEER_NAME],
             str(block_number),
             decode=True))
+        record_peer_response(channel_name)
         return block
 
 
 def get_transaction(channel_name: str, tx_id: str) -> Dict:
-    with get_hfc(channel_name) as (loop, client, user):
-        transaction = loop.run_until_complete(client.query_transaction(
+    with get_hfc(channel_name) as (client, user):
+        transaction = run_sync(client.query_transaction(
             user,
             channel_name,
             [settings.LEDGER_PEER_NAME],
             tx_id=tx_id,
             decode=True))
+        record_peer_response(channel_name)
         return transaction
 
 
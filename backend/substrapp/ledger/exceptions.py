@@ -65,6 +65,11 @@ class LedgerUnavailable(LedgerError):
     status = status.HTTP_503_SERVICE_UNAVAILABLE
 
 
+class LedgerCircuitOpen(LedgerError):
+    """Ledger calls are failing fast after consecutive connection errors."""
+    status = status.HTTP_503_SERVICE_UNAVAILABLE
+
+
 class LedgerBadRequest(LedgerError):
     """Invalid request."""
     status = status.HTTP_400_BAD_REQUEST
@@ -0,0 +1,233 @@
+"""Local projection of the ledger assets in the database.
+
+The projection is maintained by the events app: assets are synchronized periodically from the ledger
+and tuples are updated in between from the chaincode events. Reads fall back to the ledger when the
+projection of an asset type is not up to date.
+"""
+import json
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from substrapp.ledger.api import iter_query_ledger_pages, get_ledger_height
+from substrapp.models import LedgerAsset, LedgerProjection
+
+logger = logging.getLogger(__name__)
+
+TUPLE_TYPES = ('traintuple', 'testtuple', 'composite_traintuple', 'aggregatetuple')
+
+# Ledger list queries which can be served from the projection, mapped to the projected asset type
+LIST_QUERIES = {
+    'queryAlgos': 'algo',
+    'queryCompositeAlgos': 'composite_algo',
+    'queryAggregateAlgos': 'aggregate_algo',
+    'queryObjectives': 'objective',
+    'queryDataManagers': 'data_manager',
+    'queryDataSamples': 'data_sample',
+    'queryTraintuples': 'traintuple',
+    'queryTesttuples': 'testtuple',
+    'queryCompositeTraintuples': 'composite_traintuple',
+    'queryAggregatetuples': 'aggregatetuple',
+}
+
+# Ledger queries of a single asset which can be served from the projection.
+# Limited to the tuples as they are kept up to date by the chaincode events.
+OBJECT_QUERIES = {
+    'queryTraintuple': 'traintuple',
+    'queryTesttuple': 'testtuple',
+    'queryCompositeTraintuple': 'composite_traintuple',
+    'queryAggregatetuple': 'aggregatetuple',
+}
+
+# Invokes adding or modifying assets which are not notified through chaincode events:
+# the projections of these asset types are out of date until the next synchronization.
+INVALIDATING_INVOKES = {
+    'registerAlgo': ('algo',),
+    'registerCompositeAlgo': ('composite_algo',),
+    'registerAggregateAlgo': ('aggregate_algo',),
+    'registerObjective': ('objective', 'data_manager'),
+    'registerDataManager': ('data_manager',),
+    'updateDataManager': ('data_manager',),
+    'registerDataSample': ('data_sample',),
+    'updateDataSample': ('data_sample',),
+    'createTraintuple': ('traintuple',),
+    'createTesttuple': ('testtuple',),
+    'createCompositeTraintuple': ('composite_traintuple',),
+    'createAggregatetuple': ('aggregatetuple',),
+    'createComputePlan': TUPLE_TYPES,
+    'updateComputePlan': TUPLE_TYPES,
+    'cancelComputePlan': TUPLE_TYPES,
+}
+
+
+def _is_up_to_date(channel_name, asset_type):
+    max_age = settings.LEDGER_PROJECTION_MAX_AGE_SECONDS
+    if not max_age:
+        return False
+
+    projection = LedgerProjection.objects.filter(channel=channel_name, asset_type=asset_type).first()
+    if projection is None or projection.synced_at is None:
+        return False
+
+    if projection.invalidated_at is not None and projection.invalidated_at >= projection.synced_at:
+        return False
+
+    return projection.synced_at >= timezone.now() - timedelta(seconds=max_age)
+
+
+def get_projected_assets(channel_name, fcn):
+    """Return the assets listed by a ledger query from the projection.
+
+    Return None if the query cannot be served from the projection.
+    """
+    asset_type = LIST_QUERIES.get(fcn)
+    if asset_type is None or not _is_up_to_date(channel_name, asset_type):
+        return None
+
+    assets = LedgerAsset.objects.filter(channel=channel_name, asset_type=asset_type).order_by('key')
+    return [json.loads(data) for data in assets.values_list('data', flat=True)]
+
+
+def get_projected_assets_page(channel_name, fcn, page_size, after_key=None):
+    """Return a page of the assets listed by a ledger query from the projection, ordered by key.
+
+    Return the page results and whether there is a next page, or None if the query cannot
+    be served from the projection.
+    """
+    asset_type = LIST_QUERIES.get(fcn)
+    if asset_type is None or not _is_up_to_date(channel_name, asset_type):
+        return None
+
+    assets = LedgerAsset.objects.filter(channel=channel_name, asset_type=asset_type).order_by('key')
+    if after_key is not None:
+        assets = assets.filter(key__gt=after_key)
+
+    page = [json.loads(data) for data in assets.values_list('data', flat=True)[:page_size + 1]]
+    return page[:page_size], len(page) > page_size
+
+
+def get_projected_asset(channel_name, key, query):
+    """Return the asset returned by a ledger query from the projection.
+
+    Return None if the query cannot be served from the projection.
+    """
+    asset_type = OBJECT_QUERIES.get(query)
+    if asset_type is None or not _is_up_to_date(channel_name, asset_type):
+        return None
+
+    data = LedgerAsset.objects.filter(
+        channel=channel_name, asset_type=asset_type, key=str(key)).values_list('data', flat=True).first()
+    return json.loads(data) if data is not None else None
+
+
+def _build_asset(channel_name, asset_type, asset, block_number):
+    return LedgerAsset(
+        channel=channel_name,
+        asset_type=asset_type,
+        key=asset['key'],
+        status=asset.get('status', ''),
+        data=json.dumps(asset),
+        block_number=block_number,
+    )
+
+
+def apply_event(channel_name, event_type, asset, block_number):
+    """Update the projection from a chaincode event asset."""
+    if event_type not in TUPLE_TYPES:
+        return
+
+    # events are replayed when the listener reconnects: never overwrite a more recent state
+    updated = LedgerAsset.objects.filter(
+        channel=channel_name,
+        asset_type=event_type,
+        key=asset['key'],
+        block_number__lte=block_number,
+    ).update(
+        status=asset.get('status', ''),
+        data=json.dumps(asset),
+        block_number=block_number,
+    )
+
+    if not updated:
+        LedgerAsset.objects.bulk_create(
+            [_build_asset(channel_name, event_type, asset, block_number)], ignore_conflicts=True)
+
+
+def _sync_assets(channel_name, asset_type, data, block_number):
+    existing_assets = dict(LedgerAsset.objects.filter(
+        channel=channel_name, asset_type=asset_type, key__in=[asset['key'] for asset in data]
+    ).values_list('key', 'data'))
+
+    new_assets = []
+    for asset in data:
+        if asset['key'] not in existing_assets:
+            new_assets.append(_build_asset(channel_name, asset_type, asset, block_number))
+            continue
+
+        asset_data = json.dumps(asset)
+        if asset_data == existing_assets[asset['key']]:
+            continue
+
+        # rows are not locked: never overwrite a more recent state applied from the events meanwhile
+        LedgerAsset.objects.filter(
+            channel=channel_name,
+            asset_type=asset_type,
+            key=asset['key'],
+            block_number__lte=block_number,
+        ).update(
+            status=asset.get('status', ''),
+            data=asset_data,
+            block_number=block_number,
+        )
+
+    # assets cannot be removed from the ledger: there is nothing to delete
+    LedgerAsset.objects.bulk_create(new_assets, ignore_conflicts=True)
+
+
+def sync_projection(channel_name, fcn):
+    """Synchronize the projection of the assets listed by a ledger query.
+
+    Assets are synchronized bookmark page by bookmark page so that the whole list is never held in memory,
+    each page in its own transaction. The ledger is not queried again if no block has been committed since
+    the last synchronization.
+    """
+    asset_type = LIST_QUERIES[fcn]
+    synced_at = timezone.now()
+
+    # assets returned by the query reflect at least the state of the last block
+    block_number = get_ledger_height(channel_name) - 1
+
+    projection = LedgerProjection.objects.filter(channel=channel_name, asset_type=asset_type).first()
+    if (projection is not None and projection.block_number == block_number and
+            (projection.invalidated_at is None or projection.invalidated_at < projection.synced_at)):
+        LedgerProjection.objects.filter(pk=projection.pk).update(synced_at=synced_at)
+        return
+
+    for data in iter_query_ledger_pages(channel_name, fcn):
+        with transaction.atomic():
+            _sync_assets(channel_name, asset_type, data, block_number)
+
+    LedgerProjection.objects.update_or_create(
+        channel=channel_name, asset_type=asset_type,
+        defaults={'synced_at': synced_at, 'block_number': block_number})
+
+
+def sync_projections(channel_name):
+    for fcn in LIST_QUERIES:
+        try:
+            sync_projection(channel_name, fcn)
+        except Exception as e:
+            logger.exception(f'Failed to synchronize {fcn} projection on channel {channel_name}: {e}')
+
+
+def invalidate_projections(channel_name, fcn):
+    """Mark as out of date the projections of the assets modified by an invoke."""
+    asset_types = INVALIDATING_INVOKES.get(fcn)
+    if not asset_types:
+        return
+
+    LedgerProjection.objects.filter(
+        channel=channel_name, asset_type__in=asset_types).update(invalidated_at=timezone.now())
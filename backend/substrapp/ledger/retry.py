@@ -0,0 +1,70 @@
+import random
+import time
+
+from django.conf import settings
+
+
+class RetryPolicy:
+    """Retry policy of the ledger calls.
+
+    Delays grow exponentially from `base_delay` up to `max_delay`. With `jitter`, the actual delay
+    is drawn uniformly between 0 and this value (full jitter) so that concurrent callers failing
+    on the same conflict do not retry in lockstep.
+
+    A call is given up after `max_attempts` attempts, after the attempts allowed for its error
+    class in `max_attempts_per_error` (by exception class name), or when the next attempt would
+    start after `deadline` seconds from the first one.
+    """
+
+    def __init__(self, max_attempts=15, base_delay=1, max_delay=30, multiplier=2, jitter=True,
+                 deadline=None, max_attempts_per_error=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.deadline = deadline
+        self.max_attempts_per_error = max_attempts_per_error or {}
+
+    @classmethod
+    def from_settings(cls):
+        return cls(**settings.LEDGER_CALL_RETRY_POLICY)
+
+    def get_backoff(self, retry_number):
+        """Return the delay before the nth retry of a call, starting from 1."""
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** (retry_number - 1))
+        if self.jitter:
+            return random.uniform(0, delay)
+        return delay
+
+    def start(self):
+        return RetryState(self)
+
+
+class RetryState:
+    """Retries of a single call."""
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.started_at = time.monotonic()
+        self.attempts = 1
+        self.attempts_per_error = {}
+
+    def get_delay(self, error):
+        """Return the delay before retrying a call which failed with `error`, None to give up."""
+        policy = self.policy
+        error_name = error.__class__.__name__
+        error_attempts = self.attempts_per_error.get(error_name, 0) + 1
+
+        if self.attempts >= policy.max_attempts:
+            return None
+        if error_name in policy.max_attempts_per_error and error_attempts >= policy.max_attempts_per_error[error_name]:
+            return None
+
+        delay = policy.get_backoff(self.attempts)
+        if policy.deadline is not None and time.monotonic() - self.started_at + delay > policy.deadline:
+            return None
+
+        self.attempts += 1
+        self.attempts_per_error[error_name] = error_attempts
+        return delay
@@ -0,0 +1,46 @@
+# Generated by Django 2.2.20 on 2026-10-18 02:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substrapp', '0005_auto_20210119_1103'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerAsset',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel', models.CharField(max_length=100)),
+                ('asset_type', models.CharField(max_length=100)),
+                ('key', models.CharField(max_length=100)),
+                ('status', models.CharField(blank=True, max_length=100)),
+                ('data', models.TextField()),
+                ('block_number', models.BigIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerProjection',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel', models.CharField(max_length=100)),
+                ('asset_type', models.CharField(max_length=100)),
+                ('synced_at', models.DateTimeField(null=True)),
+                ('invalidated_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'unique_together': {('channel', 'asset_type')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='ledgerasset',
+            index=models.Index(fields=['channel', 'asset_type', 'status'], name='substrapp_l_channel_0323b1_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ledgerasset',
+            unique_together={('channel', 'asset_type', 'key')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.20 on 2026-10-18 04:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('substrapp', '0007_ledger_event_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ledgerprojection',
+            name='block_number',
+            field=models.BigIntegerField(null=True),
+        ),
+    ]
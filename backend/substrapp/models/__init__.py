@@ -7,5 +7,7 @@ from .algo import Algo
 from .model import Model
 from .compositealgo import CompositeAlgo
 from .aggregatealgo import AggregateAlgo
+from .ledgerasset import LedgerAsset, LedgerProjection, LedgerEventCheckpoint
 
-__all__ = ['DataSample', 'Objective', 'DataManager', 'Algo', 'Model', 'CompositeAlgo', 'AggregateAlgo']
+__all__ = ['DataSample', 'Objective', 'DataManager', 'Algo', 'Model', 'CompositeAlgo', 'AggregateAlgo',
+           'LedgerAsset', 'LedgerProjection', 'LedgerEventCheckpoint']
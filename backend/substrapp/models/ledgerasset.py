@@ -0,0 +1,46 @@
+from django.db import models
+
+
+class LedgerAsset(models.Model):
+    """Local projection of a ledger asset"""
+    channel = models.CharField(max_length=100)
+    asset_type = models.CharField(max_length=100)
+    key = models.CharField(max_length=100)
+    status = models.CharField(max_length=100, blank=True)
+    data = models.TextField()  # json serialized ledger asset
+    block_number = models.BigIntegerField()  # last ledger block reflected in data
+
+    class Meta:
+        unique_together = (('channel', 'asset_type', 'key'),)
+        indexes = [
+            models.Index(fields=['channel', 'asset_type', 'status']),
+        ]
+
+    def __str__(self):
+        return f'LedgerAsset {self.asset_type} with key {self.key} on channel {self.channel}'
+
+
+class LedgerProjection(models.Model):
+    """Synchronization state of the projection of a ledger asset type"""
+    channel = models.CharField(max_length=100)
+    asset_type = models.CharField(max_length=100)
+    synced_at = models.DateTimeField(null=True)
+    invalidated_at = models.DateTimeField(null=True)
+    # last block reflected by the synchronization
+    block_number = models.BigIntegerField(null=True)
+
+    class Meta:
+        unique_together = (('channel', 'asset_type'),)
+
+    def __str__(self):
+        return f'LedgerProjection {self.asset_type} on channel {self.channel} synced at {self.synced_at}'
+
+
+class LedgerEventCheckpoint(models.Model):
+    """Last block of a channel processed by the events listener"""
+    channel = models.CharField(max_length=100, unique=True)
+    block_number = models.BigIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'LedgerEventCheckpoint of channel {self.channel} at block {self.block_number}'
@@ -0,0 +1,273 @@
+import logging
+import os
+import shutil
+import tempfile
+from os import path
+
+from django.conf import settings
+
+from substrapp.utils import uncompress_content, get_worker_cache_directory, CHECKSUM_PATTERN
+
+logger = logging.getLogger(__name__)
+
+
+class _Cache(object):
+    """Entries keyed by checksum, the least recently used of which are evicted above `max_size` bytes.
+
+    Reading an entry updates its modification time. A `max_size` of 0 disables the cache.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+
+    def _get_path(self, checksum):
+        if not self.max_size or not isinstance(checksum, str) or not CHECKSUM_PATTERN.match(checksum):
+            return None
+        return path.join(self.directory, checksum[:2], checksum)
+
+    def _touch(self, entry_path):
+        try:
+            os.utime(entry_path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _get_entries(self):
+        """Yield the (modification time, size, path) of the entries."""
+        raise NotImplementedError
+
+    def _remove_entry(self, entry_path):
+        raise NotImplementedError
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in `max_size` bytes."""
+        entries = list(self._get_entries())
+
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, entry_path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                self._remove_entry(entry_path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+            logger.info(f'Asset {path.basename(entry_path)} evicted from cache')
+
+
+class AssetCache(_Cache):
+    """Content addressed store of the asset files fetched by the worker, keyed by checksum.
+
+    Entries are written to a temporary file then renamed, so that concurrent workers never read
+    a partial entry.
+    """
+
+    def get(self, checksum):
+        """Return the content of an entry, None if it is not cached."""
+        entry_path = self._get_path(checksum)
+        if entry_path is None or not self._touch(entry_path):
+            return None
+
+        try:
+            with open(entry_path, 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            # evicted meanwhile
+            return None
+
+        logger.info(f'Asset {checksum} found in cache')
+        return content
+
+    def get_file(self, checksum, dst_path):
+        """Link the file of an entry to `dst_path` and return True, False if it is not cached."""
+        entry_path = self._get_path(checksum)
+        if entry_path is None or not self._touch(entry_path):
+            return False
+
+        try:
+            _replace_with_link(entry_path, dst_path)
+        except FileNotFoundError:
+            # evicted meanwhile
+            return False
+
+        logger.info(f'Asset {checksum} found in cache')
+        return True
+
+    def put(self, checksum, content):
+        entry_path = self._get_path(checksum)
+        if entry_path is None:
+            return
+
+        try:
+            os.makedirs(path.dirname(entry_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path.dirname(entry_path), prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(content)
+                os.replace(tmp_path, entry_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            logger.warning(f'Failed to cache asset {checksum} ({type(e)}): {e}')
+            return
+
+        self.evict()
+
+    def put_file(self, checksum, src_path):
+        entry_path = self._get_path(checksum)
+        if entry_path is None:
+            return
+
+        try:
+            os.makedirs(path.dirname(entry_path), exist_ok=True)
+            _replace_with_link(src_path, entry_path)
+        except OSError as e:
+            logger.warning(f'Failed to cache asset {checksum} ({type(e)}): {e}')
+            return
+
+        self.evict()
+
+    def _get_entries(self):
+        for root, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.startswith('.tmp-'):
+                    continue
+                entry_path = path.join(root, filename)
+                try:
+                    stat = os.stat(entry_path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, entry_path
+
+    def _remove_entry(self, entry_path):
+        os.remove(entry_path)
+
+
+class ArchiveCache(_Cache):
+    """Uncompressed algo and metrics archives, keyed by the checksum of the archive.
+
+    Archives are uncompressed once to a temporary directory then renamed. The files of an entry
+    are hard linked to the subtuple folders instead of uncompressing the archive again.
+    """
+
+    def uncompress(self, checksum, get_content, dst_directory):
+        """Uncompress the archive `checksum` to `dst_directory`. `get_content()` is only called on misses."""
+        entry_path = self._get_path(checksum)
+
+        if entry_path is not None and self._touch(entry_path):
+            try:
+                _link_tree(entry_path, dst_directory)
+            except FileNotFoundError:
+                pass
+            else:
+                # the entry may have been evicted while being linked
+                if path.exists(entry_path):
+                    logger.info(f'Asset {checksum} found in cache')
+                    return
+
+        content = get_content()
+        if entry_path is None:
+            uncompress_content(content, dst_directory)
+            return
+
+        try:
+            os.makedirs(path.dirname(entry_path), exist_ok=True)
+            tmp_path = tempfile.mkdtemp(dir=path.dirname(entry_path), prefix='.tmp-')
+            try:
+                uncompress_content(content, tmp_path)
+                try:
+                    os.rename(tmp_path, entry_path)
+                except OSError:
+                    # uncompressed by another worker meanwhile
+                    shutil.rmtree(tmp_path)
+            except BaseException:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                raise
+            os.utime(entry_path)
+            _link_tree(entry_path, dst_directory)
+        except OSError as e:
+            logger.warning(f'Failed to cache asset {checksum} ({type(e)}): {e}')
+            uncompress_content(content, dst_directory)
+            return
+
+        self.evict()
+
+    def _get_entries(self):
+        for shard in _listdir(self.directory):
+            for name in _listdir(path.join(self.directory, shard)):
+                if name.startswith('.tmp-'):
+                    continue
+                entry_path = path.join(self.directory, shard, name)
+                try:
+                    mtime = os.stat(entry_path).st_mtime
+                except FileNotFoundError:
+                    continue
+                yield mtime, _get_tree_size(entry_path), entry_path
+
+    def _remove_entry(self, entry_path):
+        shutil.rmtree(entry_path)
+
+
+def _listdir(directory):
+    try:
+        return os.listdir(directory)
+    except FileNotFoundError:
+        return []
+
+
+def _get_tree_size(directory):
+    size = 0
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            try:
+                size += os.lstat(path.join(root, filename)).st_size
+            except FileNotFoundError:
+                pass
+    return size
+
+
+def _link_tree(src_directory, dst_directory):
+    """Reproduce the tree of `src_directory` in `dst_directory` with hard links to its files."""
+    for root, dirnames, filenames in os.walk(src_directory):
+        dst_root = path.join(dst_directory, path.relpath(root, src_directory))
+        os.makedirs(dst_root, exist_ok=True)
+        for name in dirnames + filenames:
+            src_path = path.join(root, name)
+            dst_path = path.join(dst_root, name)
+            if path.islink(src_path):
+                if path.lexists(dst_path):
+                    os.remove(dst_path)
+                os.symlink(os.readlink(src_path), dst_path)
+            elif name in filenames:
+                _replace_with_link(src_path, dst_path)
+
+
+def _replace_with_link(src_path, dst_path):
+    """Atomically replace `dst_path` with a hard link to `src_path`, or a copy across filesystems."""
+    tmp_path = path.join(path.dirname(dst_path), f'.tmp-{path.basename(dst_path)}-{os.getpid()}')
+    if path.lexists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(src_path, tmp_path)
+    except FileNotFoundError:
+        raise
+    except OSError as e:
+        logger.warning(f'Copying {src_path} to {dst_path} instead of linking it ({type(e)}): {e}')
+        shutil.copyfile(src_path, tmp_path)
+    os.replace(tmp_path, dst_path)
+
+
+def get_asset_cache():
+    return AssetCache(
+        get_worker_cache_directory('assets'),
+        settings.TASK['ASSET_CACHE_MAX_SIZE'],
+    )
+
+
+def get_archive_cache():
+    return ArchiveCache(
+        get_worker_cache_directory('archives'),
+        settings.TASK['ARCHIVE_CACHE_MAX_SIZE'],
+    )
@@ -21,12 +21,13 @@ from celery.task import Task
 import boto3
 
 from backend.celery import app
-from substrapp.utils import (get_hash, get_owner, create_directory, uncompress_content, raise_if_path_traversal,
+from substrapp.utils import (get_hash, get_owner, create_directory, raise_if_path_traversal,
                              get_dir_hash, get_subtuple_directory, get_chainkeys_directory,
                              get_cp_local_folder, timeit)
 from substrapp.ledger.api import (log_start_tuple, log_success_tuple, log_fail_tuple,
-                                  query_tuples, get_object_from_ledger)
+                                  query_tuples, get_object_from_ledger, get_objects_from_ledger)
 from substrapp.ledger.exceptions import LedgerError, LedgerStatusError
+from substrapp.tasks.cache import get_archive_cache
 from substrapp.tasks.utils import (compute_job, get_asset_content, get_and_put_asset_content,
                                    list_files, do_not_raise, remove_image)
 from substrapp.tasks.k8s_backend import (fetch_old_algo_image_names_from_docker_registry,
@@ -68,15 +69,74 @@ S3_REGION_NAME = os.getenv('BUCKET_TRANSFER_REGION', 'eu-west-1')
 
 CELERY_TASK_MAX_RETRIES = int(getattr(settings, 'CELERY_TASK_MAX_RETRIES'))
 
+ALGO_QUERY_METHOD_NAMES = {
+    TRAINTUPLE_TYPE: 'queryAlgo',
+    COMPOSITE_TRAINTUPLE_TYPE: 'queryCompositeAlgo',
+    AGGREGATETUPLE_TYPE: 'queryAggregateAlgo',
+}
+
+TESTTUPLE_TRAINTUPLE_QUERY_METHOD_NAMES = {
+    TRAINTUPLE_TYPE: 'queryTraintuple',
+    COMPOSITE_TRAINTUPLE_TYPE: 'queryCompositeTraintuple',
+}
+
 
 class TasksError(Exception):
     pass
 
 
-def get_objective(channel_name, tuple_):
+def get_tuple_ledger_queries(tuple_type, tuple_):
+    """List the (key, query) pairs needed to prepare and execute a tuple."""
+    queries = []
+
+    if tuple_type == TESTTUPLE_TYPE:
+        queries.append((tuple_['objective']['key'], 'queryObjective'))
+
+    traintuple_type = tuple_['traintuple_type'] if tuple_type == TESTTUPLE_TYPE else tuple_type
+    if traintuple_type in ALGO_QUERY_METHOD_NAMES:
+        queries.append((tuple_['algo']['key'], ALGO_QUERY_METHOD_NAMES[traintuple_type]))
+
+    if tuple_type == TESTTUPLE_TYPE:
+        if traintuple_type in TESTTUPLE_TRAINTUPLE_QUERY_METHOD_NAMES:
+            queries.append((tuple_['traintuple_key'], TESTTUPLE_TRAINTUPLE_QUERY_METHOD_NAMES[traintuple_type]))
+    elif tuple_type == COMPOSITE_TRAINTUPLE_TYPE:
+        head_model = tuple_.get('in_head_model')
+        trunk_model = tuple_.get('in_trunk_model')
+        if head_model and trunk_model:
+            queries.append((head_model['traintuple_key'], 'queryModelDetails'))
+            queries.append((trunk_model['traintuple_key'], 'queryModelDetails'))
+    else:
+        for input_model in tuple_.get('in_models') or []:
+            queries.append((input_model['traintuple_key'], 'queryModelDetails'))
+
+    if tuple_.get('compute_plan_key'):
+        queries.append((tuple_['compute_plan_key'], 'queryComputePlan'))
+
+    # the same model may be used several times as input
+    return list(dict.fromkeys(queries))
+
+
+@timeit
+def get_tuple_ledger_objects(channel_name, tuple_type, tuple_):
+    """Fetch all the ledger objects needed by a tuple in a single concurrent batch.
+
+    Returns a dict mapping (key, query) pairs to ledger objects.
+    """
+    queries = get_tuple_ledger_queries(tuple_type, tuple_)
+    return dict(zip(queries, get_objects_from_ledger(channel_name, queries)))
+
+
+def get_ledger_object(channel_name, key, query, ledger_objects=None):
+    """Get object from prefetched ledger objects, fallback to the ledger if missing."""
+    if ledger_objects and (key, query) in ledger_objects:
+        return ledger_objects[(key, query)]
+    return get_object_from_ledger(channel_name, key, query)
+
+
+def get_objective(channel_name, tuple_, ledger_objects=None):
 
     objective_key = tuple_['objective']['key']
-    objective_metadata = get_object_from_ledger(channel_name, objective_key, 'queryObjective')
+    objective_metadata = get_ledger_object(channel_name, objective_key, 'queryObjective', ledger_objects)
 
     objective_content = get_asset_content(
         channel_name,
@@ -89,27 +149,24 @@ def get_objective(channel_name, tuple_):
 
 
 @timeit
-def prepare_objective(channel_name, directory, tuple_):
+def prepare_objective(channel_name, directory, tuple_, ledger_objects=None):
     """Prepare objective for tuple execution."""
-    metrics_content = get_objective(channel_name, tuple_)
     dst_path = path.join(directory, 'metrics/')
-    uncompress_content(metrics_content, dst_path)
+    get_archive_cache().uncompress(
+        tuple_['objective']['metrics']['checksum'],
+        lambda: get_objective(channel_name, tuple_, ledger_objects),
+        dst_path,
+    )
 
 
-def get_algo(channel_name, tuple_type, tuple_):
+def get_algo(channel_name, tuple_type, tuple_, ledger_objects=None):
     """Get algo from ledger."""
-    query_method_names_mapper = {
-        TRAINTUPLE_TYPE: 'queryAlgo',
-        COMPOSITE_TRAINTUPLE_TYPE: 'queryCompositeAlgo',
-        AGGREGATETUPLE_TYPE: 'queryAggregateAlgo',
-    }
-
-    if tuple_type not in query_method_names_mapper:
+    if tuple_type not in ALGO_QUERY_METHOD_NAMES:
         raise TasksError(f'Cannot find algo from tuple type {tuple_type}: {tuple_}')
-    method_name = query_method_names_mapper[tuple_type]
+    method_name = ALGO_QUERY_METHOD_NAMES[tuple_type]
 
     key = tuple_['algo']['key']
-    metadata = get_object_from_ledger(channel_name, key, method_name)
+    metadata = get_ledger_object(channel_name, key, method_name, ledger_objects)
 
     content = get_asset_content(
         channel_name,
@@ -121,10 +178,13 @@ def get_algo(channel_name, tuple_type, tuple_):
 
 
 @timeit
-def prepare_algo(channel_name, directory, tuple_type, tuple_):
+def prepare_algo(channel_name, directory, tuple_type, tuple_, ledger_objects=None):
     """Prepare algo for tuple execution."""
-    content = get_algo(channel_name, tuple_type, tuple_)
-    uncompress_content(content, directory)
+    get_archive_cache().uncompress(
+        tuple_['algo']['checksum'],
+        lambda: get_algo(channel_name, tuple_type, tuple_, ledger_objects),
+        directory,
+    )
 
 
 def tuple_get_owner(tuple_type, tuple_):
@@ -137,12 +197,12 @@ def tuple_get_owner(tuple_type, tuple_):
     return tuple_['dataset']['worker']
 
 
-def find_training_step_tuple_from_key(channel_name, tuple_key):
+def find_training_step_tuple_from_key(channel_name, tuple_key, ledger_objects=None):
     """Get tuple type and tuple metadata from tuple key.
 
     Applies to traintuple, composite traintuple and aggregatetuple.
     """
-    metadata = get_object_from_ledger(channel_name, tuple_key, 'queryModelDetails')
+    metadata = get_ledger_object(channel_name, tuple_key, 'queryModelDetails', ledger_objects)
     if metadata.get('aggregatetuple'):
         return AGGREGATETUPLE_TYPE, metadata['aggregatetuple']
     if metadata.get('composite_traintuple'):
@@ -196,9 +256,10 @@ def get_and_put_local_model_content(hash_key, out_model, model_dst_path):
 
 
 @timeit
-def fetch_model(channel_name, parent_tuple_type, authorized_types, input_model, directory):
+def fetch_model(channel_name, parent_tuple_type, authorized_types, input_model, directory, ledger_objects=None):
 
-    tuple_type, metadata = find_training_step_tuple_from_key(channel_name, input_model['traintuple_key'])
+    tuple_type, metadata = find_training_step_tuple_from_key(
+        channel_name, input_model['traintuple_key'], ledger_objects)
 
     if tuple_type not in authorized_types:
         raise TasksError(f'{parent_tuple_type.capitalize()}: invalid input model: type={tuple_type}')
@@ -224,7 +285,7 @@ def fetch_model(channel_name, parent_tuple_type, authorized_types, input_model,
         raise TasksError(f'Traintuple: invalid input model: type={tuple_type}')
 
 
-def fetch_models(channel_name, tuple_type, authorized_types, input_models, directory):
+def fetch_models(channel_name, tuple_type, authorized_types, input_models, directory, ledger_objects=None):
 
     models = []
     exceptions = []
@@ -235,7 +296,7 @@ def fetch_models(channel_name, tuple_type, authorized_types, input_models, direc
     db.connections.close_all()
 
     for input_model in input_models:
-        args = (channel_name, tuple_type, authorized_types, input_model, directory)
+        args = (channel_name, tuple_type, authorized_types, input_model, directory, ledger_objects)
         proc = Process(target=fetch_model, args=args)
         models.append((proc, args))
         proc.start()
@@ -252,7 +313,7 @@ def fetch_models(channel_name, tuple_type, authorized_types, input_models, direc
         raise Exception(exceptions)
 
 
-def prepare_traintuple_input_models(channel_name, directory, tuple_):
+def prepare_traintuple_input_models(channel_name, directory, tuple_, ledger_objects=None):
     """Get traintuple input models content."""
     input_models = tuple_.get('in_models')
     if not input_models:
@@ -260,10 +321,10 @@ def prepare_traintuple_input_models(channel_name, directory, tuple_):
 
     authorized_types = (AGGREGATETUPLE_TYPE, TRAINTUPLE_TYPE)
 
-    fetch_models(channel_name, TRAINTUPLE_TYPE, authorized_types, input_models, directory)
+    fetch_models(channel_name, TRAINTUPLE_TYPE, authorized_types, input_models, directory, ledger_objects)
 
 
-def prepare_aggregatetuple_input_models(channel_name, directory, tuple_):
+def prepare_aggregatetuple_input_models(channel_name, directory, tuple_, ledger_objects=None):
     """Get aggregatetuple input models content."""
     input_models = tuple_.get('in_models')
     if not input_models:
@@ -271,10 +332,10 @@ def prepare_aggregatetuple_input_models(channel_name, directory, tuple_):
 
     authorized_types = (AGGREGATETUPLE_TYPE, TRAINTUPLE_TYPE, COMPOSITE_TRAINTUPLE_TYPE)
 
-    fetch_models(channel_name, AGGREGATETUPLE_TYPE, authorized_types, input_models, directory)
+    fetch_models(channel_name, AGGREGATETUPLE_TYPE, authorized_types, input_models, directory, ledger_objects)
 
 
-def prepare_composite_traintuple_input_models(channel_name, directory, tuple_):
+def prepare_composite_traintuple_input_models(channel_name, directory, tuple_, ledger_objects=None):
     """Get composite traintuple input models content."""
     head_model = tuple_.get('in_head_model')
     trunk_model = tuple_.get('in_trunk_model')
@@ -283,7 +344,7 @@ def prepare_composite_traintuple_input_models(channel_name, directory, tuple_):
 
     # get head model
     head_model_key = head_model['traintuple_key']
-    tuple_type, metadata = find_training_step_tuple_from_key(channel_name, head_model_key)
+    tuple_type, metadata = find_training_step_tuple_from_key(channel_name, head_model_key, ledger_objects)
     # head model must refer to a composite traintuple
     if tuple_type != COMPOSITE_TRAINTUPLE_TYPE:
         raise TasksError(f'CompositeTraintuple: invalid head input model: type={tuple_type}')
@@ -294,7 +355,7 @@ def prepare_composite_traintuple_input_models(channel_name, directory, tuple_):
 
     # get trunk model
     trunk_model_key = trunk_model['traintuple_key']
-    tuple_type, metadata = find_training_step_tuple_from_key(channel_name, trunk_model_key)
+    tuple_type, metadata = find_training_step_tuple_from_key(channel_name, trunk_model_key, ledger_objects)
     trunk_model_dst_path = path.join(directory, f'model/{PREFIX_TRUNK_FILENAME}{trunk_model_key}')
     raise_if_path_traversal([trunk_model_dst_path], path.join(directory, 'model/'))
     # trunk model must refer to a composite traintuple or an aggregatetuple
@@ -315,7 +376,7 @@ def prepare_composite_traintuple_input_models(channel_name, directory, tuple_):
         raise TasksError(f'CompositeTraintuple: invalid trunk input model: type={tuple_type}')
 
 
-def prepare_testtuple_input_models(channel_name, directory, tuple_):
+def prepare_testtuple_input_models(channel_name, directory, tuple_, ledger_objects=None):
     """Get testtuple input models content."""
     traintuple_type = tuple_['traintuple_type']
     traintuple_key = tuple_['traintuple_key']
@@ -323,7 +384,7 @@ def prepare_testtuple_input_models(channel_name, directory, tuple_):
     # TODO we should use the find method to be consistent with the traintuple
 
     if traintuple_type == TRAINTUPLE_TYPE:
-        metadata = get_object_from_ledger(channel_name, traintuple_key, 'queryTraintuple')
+        metadata = get_ledger_object(channel_name, traintuple_key, 'queryTraintuple', ledger_objects)
         model_dst_path = path.join(directory, f'model/{traintuple_key}')
         raise_if_path_traversal([model_dst_path], path.join(directory, 'model/'))
         get_and_put_model_content(
@@ -331,7 +392,7 @@ def prepare_testtuple_input_models(channel_name, directory, tuple_):
         )
 
     elif traintuple_type == COMPOSITE_TRAINTUPLE_TYPE:
-        metadata = get_object_from_ledger(channel_name, traintuple_key, 'queryCompositeTraintuple')
+        metadata = get_ledger_object(channel_name, traintuple_key, 'queryCompositeTraintuple', ledger_objects)
         head_model_dst_path = path.join(directory, f'model/{PREFIX_HEAD_FILENAME}{traintuple_key}')
         raise_if_path_traversal([head_model_dst_path], path.join(directory, 'model/'))
         get_and_put_local_model_content(traintuple_key, metadata['out_head_model']['out_model'], head_model_dst_path)
@@ -351,22 +412,22 @@ def prepare_testtuple_input_models(channel_name, directory, tuple_):
         raise TasksError(f"Testtuple from type '{traintuple_type}' not supported")
 
 
-def prepare_models(channel_name, directory, tuple_type, tuple_):
+def prepare_models(channel_name, directory, tuple_type, tuple_, ledger_objects=None):
     """Prepare models for tuple execution.
 
     Checks that all input models are compatible with the current tuple to execute.
     """
     if tuple_type == TESTTUPLE_TYPE:
-        prepare_testtuple_input_models(channel_name, directory, tuple_)
+        prepare_testtuple_input_models(channel_name, directory, tuple_, ledger_objects)
 
     elif tuple_type == TRAINTUPLE_TYPE:
-        prepare_traintuple_input_models(channel_name, directory, tuple_)
+        prepare_traintuple_input_models(channel_name, directory, tuple_, ledger_objects)
 
     elif tuple_type == COMPOSITE_TRAINTUPLE_TYPE:
-        prepare_composite_traintuple_input_models(channel_name, directory, tuple_)
+        prepare_composite_traintuple_input_models(channel_name, directory, tuple_, ledger_objects)
 
     elif tuple_type == AGGREGATETUPLE_TYPE:
-        prepare_aggregatetuple_input_models(channel_name, directory, tuple_)
+        prepare_aggregatetuple_input_models(channel_name, directory, tuple_, ledger_objects)
 
     else:
         raise TasksError(f"task of type : {tuple_type} not implemented")
@@ -619,8 +680,9 @@ def compute_task(self, channel_name, tuple_type, subtuple, compute_plan_key):
     result = {'worker': worker, 'queue': queue, 'compute_plan_key': compute_plan_key}
 
     try:
-        prepare_materials(channel_name, subtuple, tuple_type)
-        res = do_task(channel_name, subtuple, tuple_type)
+        ledger_objects = get_tuple_ledger_objects(channel_name, tuple_type, subtuple)
+        prepare_materials(channel_name, subtuple, tuple_type, ledger_objects)
+        res = do_task(channel_name, subtuple, tuple_type, ledger_objects)
         result['result'] = res
     except Exception as e:
         raise self.retry(
@@ -640,7 +702,7 @@ def compute_task(self, channel_name, tuple_type, subtuple, compute_plan_key):
 
 
 @timeit
-def prepare_materials(channel_name, subtuple, tuple_type):
+def prepare_materials(channel_name, subtuple, tuple_type, ledger_objects=None):
     logger.info(f'Prepare materials for task [{tuple_type}:{subtuple["key"]}]: Started.')
 
     # clean directory if exists (on retry)
@@ -653,12 +715,12 @@ def prepare_materials(channel_name, subtuple, tuple_type):
 
     # metrics
     if tuple_type == TESTTUPLE_TYPE:
-        prepare_objective(channel_name, directory, subtuple)
+        prepare_objective(channel_name, directory, subtuple, ledger_objects)
 
     # algo
     traintuple_type = (subtuple['traintuple_type'] if tuple_type == TESTTUPLE_TYPE else
                        tuple_type)
-    prepare_algo(channel_name, directory, traintuple_type, subtuple)
+    prepare_algo(channel_name, directory, traintuple_type, subtuple, ledger_objects)
 
     # opener
     if tuple_type in (TESTTUPLE_TYPE, TRAINTUPLE_TYPE, COMPOSITE_TRAINTUPLE_TYPE):
@@ -666,13 +728,13 @@ def prepare_materials(channel_name, subtuple, tuple_type):
         prepare_data_sample(directory, subtuple)
 
     # input models
-    prepare_models(channel_name, directory, tuple_type, subtuple)
+    prepare_models(channel_name, directory, tuple_type, subtuple, ledger_objects)
 
     logger.info(f'Prepare materials for task [{tuple_type}:{subtuple["key"]}]: Success. {list_files(directory)}')
 
 
 @timeit
-def do_task(channel_name, subtuple, tuple_type):
+def do_task(channel_name, subtuple, tuple_type, ledger_objects=None):
     subtuple_directory = get_subtuple_directory(subtuple['key'])
 
     # compute plan / federated learning variables
@@ -683,7 +745,7 @@ def do_task(channel_name, subtuple, tuple_type):
     if 'compute_plan_key' in subtuple and subtuple['compute_plan_key']:
         compute_plan_key = subtuple['compute_plan_key']
         rank = int(subtuple['rank'])
-        compute_plan = get_object_from_ledger(channel_name, compute_plan_key, 'queryComputePlan')
+        compute_plan = get_ledger_object(channel_name, compute_plan_key, 'queryComputePlan', ledger_objects)
         compute_plan_tag = compute_plan['tag']
 
     common_volumes, compute_volumes = prepare_volumes(
@@ -6,6 +6,7 @@ import functools
 from django.conf import settings
 from requests.auth import HTTPBasicAuth
 from substrapp.utils import get_owner, get_remote_file_content, get_and_put_remote_file_content, NodeError, timeit
+from substrapp.tasks.cache import get_asset_cache
 
 from substrapp.tasks.k8s_backend import (
     k8s_get_image, k8s_build_image, k8s_remove_image, k8s_compute, ImageNotFound, BuildError)
@@ -40,12 +41,25 @@ def authenticate_worker(node_id):
 
 
 def get_asset_content(channel_name, url, node_id, content_checksum, salt=None):
-    return get_remote_file_content(channel_name, url, authenticate_worker(node_id), content_checksum, salt=salt)
+    # the same algos and metrics are used by the successive tuples of a compute plan
+    cache = get_asset_cache()
+    content = cache.get(content_checksum)
+    if content is not None:
+        return content
+
+    content = get_remote_file_content(channel_name, url, authenticate_worker(node_id), content_checksum, salt=salt)
+    cache.put(content_checksum, content)
+    return content
 
 
 def get_and_put_asset_content(channel_name, url, node_id, content_checksum, content_dst_path, hash_key):
-    return get_and_put_remote_file_content(channel_name, url, authenticate_worker(node_id), content_checksum,
-                                           content_dst_path=content_dst_path, hash_key=hash_key)
+    cache = get_asset_cache()
+    if cache.get_file(content_checksum, content_dst_path):
+        return
+
+    get_and_put_remote_file_content(channel_name, url, authenticate_worker(node_id), content_checksum,
+                                    content_dst_path=content_dst_path, hash_key=hash_key)
+    cache.put_file(content_checksum, content_dst_path)
 
 
 def path_to_dict(path):
@@ -6,6 +6,7 @@ import base64
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import InMemoryUploadedFile
 from rest_framework.test import APIClient
+from mock import MagicMock
 
 
 # This function helper generate a basic authentication header with given credentials
@@ -290,6 +291,13 @@ class FakeAsyncResult(object):
         return self.success
 
 
+class AsyncMock(MagicMock):
+    """MagicMock whose calls return awaitables (AsyncMock is not available in mock 3.0.5)."""
+
+    async def __call__(self, *args, **kwargs):
+        return super().__call__(*args, **kwargs)
+
+
 class FakeRequest(object):
     def __init__(self, status, content):
         self.status_code = status
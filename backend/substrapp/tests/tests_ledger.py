@@ -0,0 +1,483 @@
+import asyncio
+import time
+from datetime import timedelta
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from mock import patch, Mock, MagicMock
+
+from libs.health_check_middleware import ChannelsChecker
+from substrapp.ledger.api import retry_on_error
+from substrapp.ledger.connection import (ClientPool, DiscoveryCache, CircuitBreaker, get_circuit_breaker, get_hfc,
+                                         record_peer_response, run_sync)
+from substrapp.ledger.exceptions import LedgerUnavailable, LedgerMVCCError, LedgerTimeout, LedgerCircuitOpen
+from substrapp.ledger.projection import (apply_event, get_projected_asset, get_projected_assets,
+                                         invalidate_projections, sync_projection)
+from substrapp.ledger.retry import RetryPolicy
+
+from .common import AsyncMock
+
+
+CHANNEL = 'mychannel'
+
+
+async def fake_connection(*args, **kwargs):
+    return MagicMock(), MagicMock()
+
+
+class ClientPoolTests(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_reuse_connection(self):
+        pool = ClientPool(max_size=2)
+
+        with patch('substrapp.ledger.connection._get_hfc', side_effect=fake_connection) as m_get_hfc:
+            connection = self.run_async(pool.acquire(CHANNEL))
+            self.run_async(pool.release(CHANNEL, connection))
+            self.assertIs(self.run_async(pool.acquire(CHANNEL)), connection)
+
+            # one connection is checked out, a new one is created
+            other_connection = self.run_async(pool.acquire(CHANNEL))
+            self.assertIsNot(other_connection, connection)
+
+            # pools are keyed by channel
+            self.run_async(pool.acquire('otherchannel'))
+
+        self.assertEqual(m_get_hfc.call_count, 3)
+
+    def test_wait_for_connection(self):
+        pool = ClientPool(max_size=1)
+
+        async def use_connection(delay):
+            connection = await pool.acquire(CHANNEL)
+            await asyncio.sleep(delay)
+            await pool.release(CHANNEL, connection)
+            return connection
+
+        async def use_connections():
+            return await asyncio.gather(use_connection(0.01), use_connection(0))
+
+        with patch('substrapp.ledger.connection._get_hfc', side_effect=fake_connection) as m_get_hfc:
+            connections = self.run_async(use_connections())
+
+        self.assertIs(connections[0], connections[1])
+        self.assertEqual(m_get_hfc.call_count, 1)
+
+    def test_discard_connection(self):
+        pool = ClientPool(max_size=1)
+
+        with patch('substrapp.ledger.connection._get_hfc', side_effect=fake_connection), \
+                patch('substrapp.ledger.connection._close_hfc', new_callable=AsyncMock) as m_close_hfc:
+            connection = self.run_async(pool.acquire(CHANNEL))
+            self.run_async(pool.release(CHANNEL, connection, discard=True))
+            m_close_hfc.assert_called_once_with(connection)
+
+            # the slot has been freed
+            self.assertIsNot(self.run_async(pool.acquire(CHANNEL)), connection)
+
+    def test_connection_not_shared_after_fork(self):
+        pool = ClientPool(max_size=1)
+
+        with patch('substrapp.ledger.connection._get_hfc', side_effect=fake_connection):
+            connection = self.run_async(pool.acquire(CHANNEL))
+            self.run_async(pool.release(CHANNEL, connection))
+
+            with patch('substrapp.ledger.connection.os.getpid', return_value=-1):
+                self.assertIsNot(self.run_async(pool.acquire(CHANNEL)), connection)
+
+    def test_invalidate(self):
+        pool = ClientPool(max_size=2)
+
+        with patch('substrapp.ledger.connection._get_hfc', side_effect=fake_connection), \
+                patch('substrapp.ledger.connection._close_hfc', new_callable=AsyncMock) as m_close_hfc:
+            idle_connection = self.run_async(pool.acquire(CHANNEL))
+            checked_out_connection = self.run_async(pool.acquire(CHANNEL))
+            self.run_async(pool.release(CHANNEL, idle_connection))
+
+            self.run_async(pool.invalidate(CHANNEL))
+            m_close_hfc.assert_called_once_with(idle_connection)
+
+            # connections created before the invalidation are closed when released
+            self.run_async(pool.release(CHANNEL, checked_out_connection))
+            m_close_hfc.assert_called_with(checked_out_connection)
+            self.assertEqual(pool._idle[CHANNEL], [])
+
+
+class GetHfcTests(TestCase):
+
+    def test_get_hfc_discard_on_connection_error(self):
+        pool = ClientPool(max_size=1)
+
+        with patch('substrapp.ledger.connection.get_pool', return_value=pool), \
+                patch('substrapp.ledger.connection.get_discovery_cache') as m_get_discovery_cache, \
+                patch('substrapp.ledger.connection._get_hfc', side_effect=fake_connection), \
+                patch('substrapp.ledger.connection._close_hfc', new_callable=AsyncMock) as m_close_hfc:
+
+            with get_hfc(CHANNEL) as connection:
+                pass
+            self.assertEqual(pool._idle[CHANNEL], [connection])
+
+            with self.assertRaises(LedgerUnavailable):
+                with get_hfc(CHANNEL) as connection:
+                    raise LedgerUnavailable('unavailable')
+
+            m_close_hfc.assert_called_once_with(connection)
+            self.assertEqual(pool._idle[CHANNEL], [])
+            m_get_discovery_cache.return_value.invalidate.assert_called_once_with(CHANNEL)
+
+    def test_run_sync(self):
+        async def add(a, b):
+            await asyncio.sleep(0)
+            return a + b
+
+        self.assertEqual(run_sync(add(1, 2)), 3)
+
+
+class DiscoveryCacheTests(TestCase):
+
+    def test_get(self):
+        cache = DiscoveryCache(ttl=60, refresh_interval=30)
+        discover = AsyncMock(return_value={'members': []})
+
+        with patch.object(cache, '_refresh_in_background') as m_refresh:
+            self.assertEqual(run_sync(cache.get(CHANNEL, discover)), {'members': []})
+            self.assertEqual(run_sync(cache.get(CHANNEL, discover)), {'members': []})
+            self.assertEqual(discover.call_count, 1)
+            m_refresh.assert_not_called()
+
+            # stale results are returned and refreshed in background
+            with patch('substrapp.ledger.connection.time.time', return_value=time.time() + 45):
+                self.assertEqual(run_sync(cache.get(CHANNEL, discover)), {'members': []})
+            self.assertEqual(discover.call_count, 1)
+            m_refresh.assert_called_once_with(CHANNEL)
+
+            # expired results are discovered again
+            with patch('substrapp.ledger.connection.time.time', return_value=time.time() + 90):
+                run_sync(cache.get(CHANNEL, discover))
+            self.assertEqual(discover.call_count, 2)
+
+            cache.invalidate(CHANNEL)
+            run_sync(cache.get(CHANNEL, discover))
+            self.assertEqual(discover.call_count, 3)
+
+    def test_set(self):
+        cache = DiscoveryCache(ttl=60, refresh_interval=30)
+
+        self.assertFalse(cache.set(CHANNEL, {'members': []}))
+        self.assertFalse(cache.set(CHANNEL, {'members': []}))
+        self.assertTrue(cache.set(CHANNEL, {'members': [[{'mspid': 'MyOrg2MSP'}]]}))
+
+
+class CircuitBreakerTests(TestCase):
+
+    def test_state(self):
+        circuit_breaker = CircuitBreaker(CHANNEL, failure_threshold=2, reset_timeout=30)
+
+        circuit_breaker.before_call()
+        circuit_breaker.record_failure()
+        circuit_breaker.record_success()
+        circuit_breaker.record_failure()
+        # failures must be consecutive
+        self.assertEqual(circuit_breaker.state, CircuitBreaker.CLOSED)
+
+        circuit_breaker.record_failure()
+        self.assertEqual(circuit_breaker.state, CircuitBreaker.OPEN)
+        self.assertRaises(LedgerCircuitOpen, circuit_breaker.before_call)
+
+        with patch('substrapp.ledger.connection.time.time', return_value=time.time() + 31):
+            self.assertEqual(circuit_breaker.state, CircuitBreaker.HALF_OPEN)
+            # a single probe call is let through
+            circuit_breaker.before_call()
+            self.assertRaises(LedgerCircuitOpen, circuit_breaker.before_call)
+
+            # a failed probe opens the circuit again
+            circuit_breaker.record_failure()
+            self.assertEqual(circuit_breaker.state, CircuitBreaker.OPEN)
+
+        with patch('substrapp.ledger.connection.time.time', return_value=time.time() + 62):
+            circuit_breaker.before_call()
+            circuit_breaker.record_success()
+            self.assertEqual(circuit_breaker.state, CircuitBreaker.CLOSED)
+
+    @override_settings(LEDGER_CIRCUIT_BREAKER_FAILURE_THRESHOLD=2)
+    def test_get_hfc(self):
+        pool = ClientPool(max_size=1)
+
+        with patch('substrapp.ledger.connection._circuit_breakers', {}), \
+                patch('substrapp.ledger.connection.get_pool', return_value=pool), \
+                patch('substrapp.ledger.connection.get_discovery_cache'), \
+                patch('substrapp.ledger.connection._get_hfc', side_effect=fake_connection) as m_get_hfc, \
+                patch('substrapp.ledger.connection._close_hfc', new_callable=AsyncMock):
+
+            for _ in range(2):
+                with self.assertRaises(LedgerUnavailable):
+                    with get_hfc(CHANNEL):
+                        raise LedgerUnavailable('unavailable')
+            self.assertEqual(get_circuit_breaker(CHANNEL).state, CircuitBreaker.OPEN)
+
+            # calls fail fast without connecting to the peer
+            m_get_hfc.reset_mock()
+            with self.assertRaises(LedgerCircuitOpen):
+                with get_hfc(CHANNEL):
+                    pass
+            m_get_hfc.assert_not_called()
+
+            # errors returned by the peer do not open the circuit
+            get_circuit_breaker(CHANNEL).record_success()
+            for _ in range(2):
+                with self.assertRaises(LedgerMVCCError):
+                    with get_hfc(CHANNEL):
+                        raise LedgerMVCCError('conflict')
+            self.assertEqual(get_circuit_breaker(CHANNEL).state, CircuitBreaker.CLOSED)
+
+    @override_settings(LEDGER_CIRCUIT_BREAKER_FAILURE_THRESHOLD=1)
+    def test_get_hfc_probe_without_peer_call(self):
+        pool = ClientPool(max_size=1)
+
+        with patch('substrapp.ledger.connection._circuit_breakers', {}), \
+                patch('substrapp.ledger.connection.get_pool', return_value=pool), \
+                patch('substrapp.ledger.connection.get_discovery_cache'), \
+                patch('substrapp.ledger.connection._get_hfc', side_effect=fake_connection), \
+                patch('substrapp.ledger.connection._close_hfc', new_callable=AsyncMock):
+
+            # a pooled connection is checked out before the circuit opens
+            with get_hfc(CHANNEL):
+                pass
+            get_circuit_breaker(CHANNEL).record_failure()
+
+            with patch('substrapp.ledger.connection.time.time', return_value=time.time() + 31):
+                self.assertEqual(get_circuit_breaker(CHANNEL).state, CircuitBreaker.HALF_OPEN)
+
+                # checking out the idle connection does not reach the peer: the circuit is not closed
+                with get_hfc(CHANNEL):
+                    pass
+                self.assertEqual(get_circuit_breaker(CHANNEL).state, CircuitBreaker.HALF_OPEN)
+
+                # the probe is given back, and closes the circuit once the peer answered
+                with get_hfc(CHANNEL):
+                    record_peer_response(CHANNEL)
+                self.assertEqual(get_circuit_breaker(CHANNEL).state, CircuitBreaker.CLOSED)
+
+    @override_settings(LEDGER_CHANNELS={CHANNEL: {}})
+    def test_readiness(self):
+        checker = ChannelsChecker(interval=30, max_age=60)
+
+        with patch('substrapp.ledger.connection._circuit_breakers', {}), \
+                patch('libs.health_check_middleware.get_channels_checker', return_value=checker), \
+                patch.object(checker, 'start'), \
+                patch('libs.health_check_middleware.validate_channel') as m_validate_channel:
+
+            # channels are not ready until they have been checked
+            response = self.client.get('/readiness')
+            self.assertEqual(response.status_code, 503)
+
+            # probes read the state of the last check, without connecting to the ledger
+            checker.check()
+            m_validate_channel.reset_mock()
+            response = self.client.get('/readiness')
+            self.assertEqual(response.status_code, 200)
+            response = self.client.get('/liveness')
+            self.assertEqual(response.status_code, 200)
+            m_validate_channel.assert_not_called()
+
+            # stale checks
+            with patch('libs.health_check_middleware.time.time', return_value=time.time() + 61):
+                response = self.client.get('/readiness')
+                self.assertEqual(response.status_code, 503)
+
+            m_validate_channel.side_effect = LedgerUnavailable('unavailable')
+            checker.check()
+            response = self.client.get('/readiness')
+            self.assertEqual(response.status_code, 503)
+
+            m_validate_channel.side_effect = None
+            checker.check()
+            for _ in range(5):
+                get_circuit_breaker(CHANNEL).record_failure()
+            response = self.client.get('/readiness')
+            self.assertEqual(response.status_code, 503)
+
+    @override_settings(LEDGER_CHANNELS={CHANNEL: {}}, LEDGER_PEER_NAME='peer',
+                       LEDGER_CIRCUIT_BREAKER_FAILURE_THRESHOLD=1, LEDGER_HEALTH_CHECK_TIMEOUT_SECONDS=0.1)
+    def test_check_channels(self):
+        checker = ChannelsChecker(interval=30, max_age=60)
+        pool = ClientPool(max_size=1)
+        client = MagicMock()
+        client.query_info = AsyncMock(return_value=MagicMock(height=10))
+
+        async def connection(*args, **kwargs):
+            return client, MagicMock()
+
+        async def hang(*args, **kwargs):
+            await asyncio.sleep(1)
+
+        with patch('substrapp.ledger.connection._circuit_breakers', {}), \
+                patch('substrapp.ledger.connection.get_pool', return_value=pool), \
+                patch('substrapp.ledger.connection.get_discovery_cache'), \
+                patch('substrapp.ledger.connection._get_hfc', side_effect=connection), \
+                patch('substrapp.ledger.connection._close_hfc', new_callable=AsyncMock), \
+                patch.object(checker, 'start'):
+
+            # the check queries the peer, even with a pooled connection
+            checker.check()
+            checker.check()
+            self.assertEqual(client.query_info.call_count, 2)
+            self.assertEqual(checker.get_unavailable_channels(), [])
+
+            # an unreachable peer makes the channel unavailable and keeps the circuit open
+            client.query_info.side_effect = LedgerUnavailable('unavailable')
+            checker.check()
+            self.assertEqual(checker.get_unavailable_channels(), [CHANNEL])
+            self.assertEqual(get_circuit_breaker(CHANNEL).state, CircuitBreaker.OPEN)
+
+            with patch('substrapp.ledger.connection.time.time', return_value=time.time() + 31):
+                checker.check()
+                self.assertEqual(get_circuit_breaker(CHANNEL).state, CircuitBreaker.OPEN)
+
+            with patch('substrapp.ledger.connection.time.time', return_value=time.time() + 62):
+                # a successful check closes the circuit
+                client.query_info.side_effect = None
+                checker.check()
+                self.assertEqual(checker.get_unavailable_channels(), [])
+                self.assertEqual(get_circuit_breaker(CHANNEL).state, CircuitBreaker.CLOSED)
+
+                # a peer which does not answer fails the check
+                client.query_info.side_effect = hang
+                checker.check()
+                self.assertEqual(checker.get_unavailable_channels(), [CHANNEL])
+
+
+class RetryPolicyTests(TestCase):
+
+    def test_backoff(self):
+        policy = RetryPolicy(base_delay=1, max_delay=10, jitter=False)
+        self.assertEqual([policy.get_backoff(n) for n in range(1, 7)], [1, 2, 4, 8, 10, 10])
+
+        policy = RetryPolicy(base_delay=1, max_delay=10)
+        for n in range(1, 10):
+            self.assertTrue(0 <= policy.get_backoff(n) <= min(10, 2 ** (n - 1)))
+
+    def test_max_attempts(self):
+        retries = RetryPolicy(max_attempts=3, jitter=False).start()
+        self.assertEqual(retries.get_delay(LedgerMVCCError('')), 1)
+        self.assertEqual(retries.get_delay(LedgerMVCCError('')), 2)
+        self.assertIsNone(retries.get_delay(LedgerMVCCError('')))
+
+    def test_max_attempts_per_error(self):
+        retries = RetryPolicy(max_attempts_per_error={'LedgerTimeout': 2}, jitter=False).start()
+        self.assertIsNotNone(retries.get_delay(LedgerTimeout('')))
+        self.assertIsNotNone(retries.get_delay(LedgerMVCCError('')))
+        self.assertIsNone(retries.get_delay(LedgerTimeout('')))
+        self.assertIsNotNone(retries.get_delay(LedgerMVCCError('')))
+
+    def test_deadline(self):
+        retries = RetryPolicy(base_delay=10, deadline=30, jitter=False).start()
+        self.assertEqual(retries.get_delay(LedgerMVCCError('')), 10)
+        self.assertEqual(retries.get_delay(LedgerMVCCError('')), 20)
+
+        retries = RetryPolicy(base_delay=10, deadline=30, jitter=False).start()
+        with patch('substrapp.ledger.retry.time.monotonic', return_value=time.monotonic() + 25):
+            self.assertIsNone(retries.get_delay(LedgerMVCCError('')))
+
+    @override_settings(LEDGER_CALL_RETRY=True)
+    def test_retry_on_error(self):
+        fn = Mock(side_effect=[LedgerMVCCError(''), LedgerMVCCError(''), 'ok'], __name__='fn')
+        retried_fn = retry_on_error(policy=RetryPolicy(base_delay=0))(fn)
+        with patch('substrapp.ledger.api.time.sleep') as m_sleep:
+            self.assertEqual(retried_fn(), 'ok')
+        self.assertEqual(fn.call_count, 3)
+        self.assertEqual(m_sleep.call_count, 2)
+
+        fn = Mock(side_effect=LedgerMVCCError(''), __name__='fn')
+        retried_fn = retry_on_error(policy=RetryPolicy(max_attempts=2, base_delay=0))(fn)
+        with patch('substrapp.ledger.api.time.sleep'):
+            self.assertRaises(LedgerMVCCError, retried_fn)
+        self.assertEqual(fn.call_count, 2)
+
+        # errors which are not transient are not retried
+        fn = Mock(side_effect=LedgerTimeout(''), __name__='fn')
+        self.assertRaises(LedgerTimeout, retry_on_error(policy=RetryPolicy(base_delay=0))(fn))
+        self.assertEqual(fn.call_count, 1)
+
+
+@override_settings(LEDGER_PROJECTION_MAX_AGE_SECONDS=60)
+class ProjectionTests(TestCase):
+
+    def sync(self, fcn, data, height):
+        with patch('substrapp.ledger.projection.iter_query_ledger_pages', return_value=iter([data])), \
+                patch('substrapp.ledger.projection.get_ledger_height', return_value=height):
+            sync_projection(CHANNEL, fcn)
+
+    def test_sync_projection(self):
+        self.assertIsNone(get_projected_assets(CHANNEL, 'queryTraintuples'))
+
+        traintuples = [{'key': 'key2', 'status': 'todo'}, {'key': 'key1', 'status': 'waiting'}]
+        self.sync('queryTraintuples', traintuples, height=10)
+        self.assertEqual(get_projected_assets(CHANNEL, 'queryTraintuples'), traintuples[::-1])
+        self.assertEqual(get_projected_asset(CHANNEL, 'key1', 'queryTraintuple'), traintuples[1])
+        self.assertIsNone(get_projected_asset(CHANNEL, 'unknown', 'queryTraintuple'))
+
+        # other asset types and channels are not synchronized
+        self.assertIsNone(get_projected_assets(CHANNEL, 'queryTesttuples'))
+        self.assertIsNone(get_projected_assets('otherchannel', 'queryTraintuples'))
+        self.assertIsNone(get_projected_assets(CHANNEL, 'queryModels'))
+
+        with patch('substrapp.ledger.projection.timezone.now', return_value=timezone.now() + timedelta(seconds=90)):
+            self.assertIsNone(get_projected_assets(CHANNEL, 'queryTraintuples'))
+
+    def test_apply_event(self):
+        self.sync('queryTraintuples', [{'key': 'key1', 'status': 'todo'}], height=10)
+
+        # events already reflected in the projection are ignored
+        apply_event(CHANNEL, 'traintuple', {'key': 'key1', 'status': 'waiting'}, block_number=5)
+        self.assertEqual(get_projected_asset(CHANNEL, 'key1', 'queryTraintuple')['status'], 'todo')
+
+        apply_event(CHANNEL, 'traintuple', {'key': 'key1', 'status': 'doing'}, block_number=12)
+        apply_event(CHANNEL, 'traintuple', {'key': 'key2', 'status': 'todo'}, block_number=12)
+        self.assertEqual(get_projected_assets(CHANNEL, 'queryTraintuples'), [
+            {'key': 'key1', 'status': 'doing'},
+            {'key': 'key2', 'status': 'todo'},
+        ])
+
+        # a synchronization does not overwrite more recent events
+        self.sync('queryTraintuples', [{'key': 'key1', 'status': 'todo'}, {'key': 'key2', 'status': 'todo'}],
+                  height=11)
+        self.assertEqual(get_projected_asset(CHANNEL, 'key1', 'queryTraintuple')['status'], 'doing')
+
+    def test_invalidate_projections(self):
+        self.sync('queryAlgos', [{'key': 'key1'}], height=10)
+        self.sync('queryTraintuples', [], height=10)
+
+        invalidate_projections(CHANNEL, 'registerAlgo')
+        self.assertIsNone(get_projected_assets(CHANNEL, 'queryAlgos'))
+        self.assertEqual(get_projected_assets(CHANNEL, 'queryTraintuples'), [])
+
+        self.sync('queryAlgos', [{'key': 'key1'}, {'key': 'key2'}], height=11)
+        self.assertEqual(len(get_projected_assets(CHANNEL, 'queryAlgos')), 2)
+
+    def test_sync_projection_unchanged_ledger(self):
+        self.sync('queryAlgos', [{'key': 'key1'}], height=10)
+
+        # no block has been committed since the last synchronization: the ledger is not listed again
+        with patch('substrapp.ledger.projection.iter_query_ledger_pages') as m_iter_query_ledger_pages, \
+                patch('substrapp.ledger.projection.get_ledger_height', return_value=10):
+            sync_projection(CHANNEL, 'queryAlgos')
+        m_iter_query_ledger_pages.assert_not_called()
+        self.assertEqual(get_projected_assets(CHANNEL, 'queryAlgos'), [{'key': 'key1'}])
+
+        # unless the projection has been invalidated
+        invalidate_projections(CHANNEL, 'registerAlgo')
+        self.sync('queryAlgos', [{'key': 'key1'}, {'key': 'key2'}], height=10)
+        self.assertEqual(len(get_projected_assets(CHANNEL, 'queryAlgos')), 2)
+
+        self.sync('queryAlgos', [{'key': 'key1'}, {'key': 'key2'}, {'key': 'key3'}], height=11)
+        self.assertEqual(len(get_projected_assets(CHANNEL, 'queryAlgos')), 3)
@@ -1,15 +1,26 @@
-from django.test import TestCase
+import hashlib
+import tempfile
+import time
+import tracemalloc
+
+from django.test import TestCase, override_settings
 
 from mock import patch
 
-from substrapp.utils import raise_if_path_traversal, uncompress_path
+from substrapp.utils import (raise_if_path_traversal, uncompress_path, get_hash, compute_hash, get_session,
+                             HASH_CHUNK_SIZE)
+
+from substrapp.ledger.exceptions import LedgerAssetNotFound, LedgerInvalidResponse, LedgerStatusError, LedgerTimeout
 
-from substrapp.ledger.exceptions import LedgerAssetNotFound, LedgerInvalidResponse
+from substrapp.ledger.api import get_object_from_ledger, get_objects_from_ledger, log_fail_tuple, \
+    log_start_tuple, log_success_tuple, query_tuples, call_ledger, invoke_ledger, query_ledger, \
+    iter_query_ledger_pages, iter_query_ledger, wait_for_tuple_status_updates, LEDGER_CALLS, LEDGER_CALL_DURATION, \
+    LEDGER_CALL_RETRIES
 
-from substrapp.ledger.api import get_object_from_ledger, log_fail_tuple, log_start_tuple, \
-    log_success_tuple, query_tuples, call_ledger
+from libs.metrics import Registry
 
 from .assets import traintuple
+from .common import AsyncMock
 
 import os
 
@@ -67,27 +78,123 @@ class MiscTests(TestCase):
             data = get_object_from_ledger(CHANNEL, 'key', 'good_query')
             self.assertEqual(data['key'], 'key')
 
+    @override_settings(CACHES={'ledger': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_get_object_from_ledger_cache(self):
+        with patch('substrapp.ledger.api.query_ledger') as mquery_ledger:
+            mquery_ledger.return_value = {'key': 'key', 'objective_key': 'objective_key'}
+
+            # immutable assets are only queried once
+            get_object_from_ledger(CHANNEL, 'key', 'queryAlgo')
+            data = get_object_from_ledger(CHANNEL, 'key', 'queryAlgo')
+            self.assertEqual(data['key'], 'key')
+            self.assertEqual(mquery_ledger.call_count, 1)
+
+            get_object_from_ledger(CHANNEL, 'key', 'queryTraintuple')
+            get_object_from_ledger(CHANNEL, 'key', 'queryTraintuple')
+            self.assertEqual(mquery_ledger.call_count, 3)
+
+            get_object_from_ledger(CHANNEL, 'key', 'queryDataManager')
+            self.assertEqual(mquery_ledger.call_count, 4)
+
+            # data manager objective is updated
+            with patch('substrapp.ledger.api.ainvoke_ledger', new_callable=AsyncMock):
+                invoke_ledger(CHANNEL, fcn='updateDataManager',
+                              args={'data_manager_key': 'key', 'objective_key': 'objective_key'})
+            get_object_from_ledger(CHANNEL, 'key', 'queryDataManager')
+            self.assertEqual(mquery_ledger.call_count, 5)
+
+            # failed invokes do not invalidate the cache and raise their own error
+            with patch('substrapp.ledger.api.ainvoke_ledger', new_callable=AsyncMock) as mainvoke_ledger:
+                mainvoke_ledger.side_effect = LedgerInvalidResponse('Bad Response')
+                self.assertRaises(LedgerInvalidResponse, invoke_ledger, CHANNEL, fcn='updateDataManager',
+                                  args={'data_manager_key': 'key', 'objective_key': 'objective_key'})
+                self.assertRaises(LedgerInvalidResponse, invoke_ledger, CHANNEL, fcn='updateDataManager', args=None)
+            get_object_from_ledger(CHANNEL, 'key', 'queryDataManager')
+            self.assertEqual(mquery_ledger.call_count, 5)
+
+            # data managers modified from another pod expire quickly, unlike immutable assets
+            with patch('django.core.cache.backends.locmem.time.time', return_value=time.time() + 60):
+                get_object_from_ledger(CHANNEL, 'key', 'queryDataManager')
+                get_object_from_ledger(CHANNEL, 'key', 'queryAlgo')
+            self.assertEqual(mquery_ledger.call_count, 6)
+
+        with patch('substrapp.ledger.api.aquery_ledger', new_callable=AsyncMock) as maquery_ledger:
+            maquery_ledger.return_value = {'key': 'key2'}
+            data = get_objects_from_ledger(CHANNEL, [('key', 'queryAlgo'), ('key2', 'queryAlgo')])
+            self.assertEqual(data, [{'key': 'key', 'objective_key': 'objective_key'}, {'key': 'key2'}])
+            maquery_ledger.assert_called_once_with(CHANNEL, fcn='queryAlgo', args={'key': 'key2'})
+
+    def test_get_objects_from_ledger(self):
+        async def query_ledger(channel_name, fcn, args=None):
+            return {'key': args['key'], 'fcn': fcn}
+
+        with patch('substrapp.ledger.api.aquery_ledger', side_effect=query_ledger):
+            data = get_objects_from_ledger(CHANNEL, [('key1', 'queryAlgo'), ('key2', 'queryObjective')])
+            self.assertEqual(data, [{'key': 'key1', 'fcn': 'queryAlgo'}, {'key': 'key2', 'fcn': 'queryObjective'}])
+
+        with patch('substrapp.ledger.api.aquery_ledger', new_callable=AsyncMock) as maquery_ledger:
+            maquery_ledger.side_effect = LedgerAssetNotFound('Not Found')
+            self.assertRaises(LedgerAssetNotFound, get_objects_from_ledger, CHANNEL, [('key', 'fake_query')])
+
+    @override_settings(LEDGER_CALL_RETRY=False)
+    def test_iter_query_ledger_pages(self):
+        bookmark_pages = {
+            '': {'results': [{'key': 'key1'}, {'key': 'key2'}], 'bookmark': 'bookmark1'},
+            'bookmark1': {'results': [{'key': 'key3'}], 'bookmark': 'bookmark2'},
+            'bookmark2': {'results': [], 'bookmark': 'bookmark2'},
+        }
+
+        async def acall_ledger(channel_name, call_type, fcn, args=None):
+            return bookmark_pages[args['bookmark'] if args else '']
+
+        with patch('substrapp.ledger.api._acall_ledger', side_effect=acall_ledger) as macall_ledger:
+            pages = iter_query_ledger_pages(CHANNEL, 'queryTraintuples')
+            # pages are queried lazily
+            self.assertEqual(macall_ledger.call_count, 0)
+            self.assertEqual(next(pages), [{'key': 'key1'}, {'key': 'key2'}])
+            self.assertEqual(macall_ledger.call_count, 1)
+            self.assertEqual(list(pages), [[{'key': 'key3'}]])
+            self.assertEqual(macall_ledger.call_count, 3)
+
+            self.assertEqual(list(iter_query_ledger(CHANNEL, 'queryTraintuples')),
+                             [{'key': 'key1'}, {'key': 'key2'}, {'key': 'key3'}])
+
+        # queries which are not paginated by the chaincode are returned as a single page
+        with patch('substrapp.ledger.api._acall_ledger', new_callable=AsyncMock) as macall_ledger:
+            macall_ledger.return_value = [{'key': 'key1'}]
+            self.assertEqual(list(iter_query_ledger_pages(CHANNEL, 'queryModels')), [[{'key': 'key1'}]])
+
+            macall_ledger.return_value = None
+            self.assertEqual(list(iter_query_ledger_pages(CHANNEL, 'queryModels')), [])
+
     def test_log_fail_tuple(self):
-        with patch('substrapp.ledger.api.update_ledger') as mupdate_ledger:
-            mupdate_ledger.return_value = None
+        with patch('substrapp.ledger.api.aupdate_ledger', new_callable=AsyncMock) as maupdate_ledger:
             log_fail_tuple(CHANNEL, 'traintuple', 'key', 'error_msg')
-
-        with patch('substrapp.ledger.api.update_ledger') as mupdate_ledger:
-            mupdate_ledger.return_value = None
+            wait_for_tuple_status_updates()
+            maupdate_ledger.assert_called_once_with(
+                CHANNEL, fcn='logFailTrain', args={'key': 'key', 'log': 'error_msg'}, sync=True)
+
+        # the errors of the updates sent in the background are logged
+        with patch('substrapp.ledger.api.aupdate_ledger', new_callable=AsyncMock) as maupdate_ledger, \
+                patch('substrapp.ledger.api.logger') as mlogger:
+            maupdate_ledger.side_effect = LedgerTimeout('timeout')
             log_fail_tuple(CHANNEL, 'testtuple', 'key', 'error_msg')
+            wait_for_tuple_status_updates()
+            self.assertTrue(mlogger.error.called)
 
     def test_log_start_tuple(self):
         with patch('substrapp.ledger.api.update_ledger') as mupdate_ledger:
             mupdate_ledger.return_value = None
             log_start_tuple(CHANNEL, 'traintuple', 'key')
 
+        # the start of a tuple is committed before it is computed
         with patch('substrapp.ledger.api.update_ledger') as mupdate_ledger:
-            mupdate_ledger.return_value = None
-            log_start_tuple(CHANNEL, 'testtuple', 'key')
+            mupdate_ledger.side_effect = LedgerStatusError('status')
+            self.assertRaises(LedgerStatusError, log_start_tuple, CHANNEL, 'testtuple', 'key')
+            mupdate_ledger.assert_called_once_with(CHANNEL, fcn='logStartTest', args={'key': 'key'}, sync=True)
 
     def test_log_success_tuple(self):
-        with patch('substrapp.ledger.api.update_ledger') as mupdate_ledger:
-            mupdate_ledger.return_value = None
+        with patch('substrapp.ledger.api.aupdate_ledger', new_callable=AsyncMock) as maupdate_ledger:
             res = {
                 'end_model_key': '<some_key>',
                 'end_model_checksum': 'hash',
@@ -95,14 +202,18 @@ class MiscTests(TestCase):
                 'job_task_log': 'log',
             }
             log_success_tuple(CHANNEL, 'traintuple', 'key', res)
+            wait_for_tuple_status_updates()
+            maupdate_ledger.assert_called_once()
 
-        with patch('substrapp.ledger.api.update_ledger') as mupdate_ledger:
-            mupdate_ledger.return_value = None
+        with patch('substrapp.ledger.api.aupdate_ledger', new_callable=AsyncMock) as maupdate_ledger:
             res = {
                 'global_perf': '0.99',
                 'job_task_log': 'log',
             }
             log_success_tuple(CHANNEL, 'testtuple', 'key', res)
+            wait_for_tuple_status_updates()
+            maupdate_ledger.assert_called_once_with(
+                CHANNEL, fcn='logSuccessTest', args={'key': 'key', 'log': '', 'perf': 0.99}, sync=True)
 
     def test_query_tuples(self):
         with patch('substrapp.ledger.api.query_ledger') as mquery_ledger:
@@ -139,12 +250,113 @@ class MiscTests(TestCase):
             model_dst_path = os.path.join(DIRECTORY, 'model/../../hackermodel')
             raise_if_path_traversal([model_dst_path], os.path.join(DIRECTORY, 'model/'))
 
+    def test_call_ledger_metrics(self):
+        with patch('substrapp.ledger.api._acall_ledger', new_callable=AsyncMock) as m_call_ledger:
+            m_call_ledger.return_value = {'key': 'key'}
+            call_ledger(CHANNEL, 'query', 'queryMetricsTest')
+
+            m_call_ledger.side_effect = LedgerInvalidResponse('Invalid')
+            self.assertRaises(LedgerInvalidResponse, call_ledger, CHANNEL, 'query', 'queryMetricsTest')
+
+        labels = {'channel': CHANNEL, 'call_type': 'query', 'fcn': 'queryMetricsTest'}
+        self.assertEqual(LEDGER_CALLS.get(error='', **labels), 1)
+        self.assertEqual(LEDGER_CALLS.get(error='LedgerInvalidResponse', **labels), 1)
+        self.assertEqual(LEDGER_CALL_DURATION.get_count(**labels), 2)
+
+    @override_settings(LEDGER_CALL_RETRY=True, LEDGER_CALL_RETRY_POLICY={'base_delay': 0})
+    def test_query_ledger_retry_metrics(self):
+        retries = LEDGER_CALL_RETRIES.get(function='aquery_ledger', error='LedgerInvalidResponse')
+
+        with patch('substrapp.ledger.api._acall_ledger', new_callable=AsyncMock) as m_call_ledger:
+            m_call_ledger.side_effect = [LedgerInvalidResponse('Invalid'), {'key': 'key'}]
+            self.assertEqual(query_ledger(CHANNEL, 'queryMetricsTest'), {'key': 'key'})
+
+        self.assertEqual(LEDGER_CALL_RETRIES.get(function='aquery_ledger', error='LedgerInvalidResponse'),
+                         retries + 1)
+
     def test_call_ledger_with_bookmark(self):
 
-        with patch('substrapp.ledger.api._call_ledger') as m_call_ledger:
+        with patch('substrapp.ledger.api._acall_ledger', new_callable=AsyncMock) as m_call_ledger:
             m_call_ledger.side_effect = [
                 {'results': traintuple[i:i + 2], 'bookmark': f'bookmark_{i}'}
                 for i in range(0, len(traintuple), 2)
             ] + [{'results': "", 'bookmark': 'bookmark_end'}]
             response = call_ledger(CHANNEL, 'query', 'queryTraintuples')
             self.assertEqual(response, traintuple)
+
+    def test_get_hash(self):
+        content = os.urandom(8 * HASH_CHUNK_SIZE + 1)
+
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(content)
+            f.flush()
+
+            tracemalloc.start()
+            try:
+                checksum = get_hash(f.name, 'key')
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+        self.assertEqual(checksum, hashlib.sha256(content + b'key').hexdigest())
+        self.assertEqual(checksum, compute_hash(content, 'key'))
+        # the file is not loaded in memory at once
+        self.assertLess(peak, 3 * HASH_CHUNK_SIZE)
+
+    @override_settings(HTTP_CLIENT_POOL_MAXSIZE=4, HTTP_CLIENT_RETRIES=2)
+    def test_get_session(self):
+        with patch('substrapp.utils._sessions_pid', None):
+            session = get_session('http://node-1.com:8000/algo/key/file/')
+            self.assertIs(get_session('http://node-1.com:8000/model/key/file/'), session)
+            self.assertIsNot(get_session('http://node-2.com:8000/algo/key/file/'), session)
+
+            adapter = session.get_adapter('http://node-1.com:8000/')
+            self.assertEqual(adapter._pool_maxsize, 4)
+            self.assertEqual(adapter.max_retries.total, 2)
+
+            # sessions are not shared with forked processes
+            with patch('substrapp.utils.os.getpid', return_value=-1):
+                self.assertIsNot(get_session('http://node-1.com:8000/algo/key/file/'), session)
+
+    def test_metrics_registry_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # processes of a pod sharing the directory
+            registries = [Registry(directory, flush_interval=3600), Registry(directory, flush_interval=3600)]
+            counters = [registry.counter('calls', 'Calls', ['fcn']) for registry in registries]
+            histograms = [registry.histogram('duration', 'Duration', buckets=[1]) for registry in registries]
+
+            counters[0].inc(fcn='query')
+            counters[1].inc(2, fcn='query')
+            counters[1].inc(fcn='invoke')
+            histograms[0].observe(0.5)
+            histograms[1].observe(2)
+
+            # the values are written periodically, not on each update
+            self.assertEqual(os.listdir(directory), [])
+            for registry in registries:
+                registry.flush()
+
+            for registry in registries:
+                content = registry.render()
+                self.assertIn('calls_total{fcn="query"} 3.0', content)
+                self.assertIn('calls_total{fcn="invoke"} 1.0', content)
+                self.assertIn('duration_bucket{le="1.0"} 1.0', content)
+                self.assertIn('duration_count 2.0', content)
+                self.assertIn('duration_sum 2.5', content)
+
+            # a forked process does not count the values inherited from its parent again
+            forked_pid = os.getpid() + 1
+            with patch('libs.metrics.os.getpid', return_value=forked_pid):
+                counters[0].inc(fcn='invoke')
+                self.assertEqual(counters[0].get(fcn='query'), 0)
+                content = registries[0].render()
+                self.assertIn('calls_total{fcn="query"} 3.0', content)
+                self.assertIn('calls_total{fcn="invoke"} 2.0', content)
+
+            # the files of the processes which have exited are merged into the aggregate file
+            with patch('libs.metrics._is_process_alive', side_effect=lambda pid: pid != forked_pid):
+                content = registries[1].render()
+            self.assertIn('calls_total{fcn="query"} 3.0', content)
+            self.assertIn('calls_total{fcn="invoke"} 2.0', content)
+            self.assertEqual(len([name for name in os.listdir(directory) if name.endswith('.json')]), 3)
+            self.assertIn('aggregate.json', os.listdir(directory))
@@ -1,6 +1,8 @@
+import errno
 import os
 import shutil
 import mock
+import requests
 import uuid
 from unittest.mock import MagicMock
 
@@ -12,10 +14,14 @@ from django_celery_results.models import TaskResult
 from substrapp.models import DataSample
 from substrapp.ledger.api import LedgerStatusError
 from substrapp.utils import store_datasamples_archive
-from substrapp.utils import compute_hash, get_remote_file_content, get_hash, create_directory
+from substrapp.utils import (compute_hash, get_remote_file_content, get_and_put_remote_file_content, get_hash,
+                             create_directory, uncompress_content, get_partial_download_directory, NodeError)
+from substrapp.tasks.cache import AssetCache, ArchiveCache, get_archive_cache
+from substrapp.tasks.utils import get_asset_content, get_and_put_asset_content
 from substrapp.tasks.tasks import (build_subtuple_folders, get_algo, get_objective, prepare_opener,
-                                   uncompress_content, prepare_data_sample, prepare_task, do_task,
-                                   compute_task, remove_subtuple_materials, prepare_materials)
+                                   prepare_data_sample, prepare_task, do_task,
+                                   compute_task, remove_subtuple_materials, prepare_materials,
+                                   get_tuple_ledger_queries, get_tuple_ledger_objects)
 
 from .common import (get_sample_algo, get_sample_script, get_sample_zip_data_sample, get_sample_tar_data_sample,
                      get_sample_model)
@@ -94,21 +100,150 @@ class TasksTests(APITestCase):
                        }
 
         with mock.patch('substrapp.utils.get_owner') as get_owner,\
-                mock.patch('substrapp.utils.requests.get') as request_get:
+                mock.patch('substrapp.utils.requests.Session.get') as request_get:
             get_owner.return_value = 'external_node_id'
             request_get.return_value = FakeRequest(content=content, status=status.HTTP_200_OK)
 
-            content_remote = get_remote_file_content('mychannel', remote_file, 'external_node_id', checksum)
+            content_remote = get_remote_file_content('mychannel', remote_file['storage_address'], 'external_node_id',
+                                                     checksum)
             self.assertEqual(content_remote, content)
 
         with mock.patch('substrapp.utils.get_owner') as get_owner,\
-                mock.patch('substrapp.utils.requests.get') as request_get:
+                mock.patch('substrapp.utils.requests.Session.get') as request_get:
             get_owner.return_value = 'external_node_id'
             request_get.return_value = FakeRequest(content=content, status=status.HTTP_200_OK)
 
             with self.assertRaises(Exception):
                 # contents (by hash) are different
-                get_remote_file_content('mychannel', remote_file, 'external_node_id', 'fake_hash')
+                get_remote_file_content('mychannel', remote_file['storage_address'], 'external_node_id', 'fake_hash')
+
+    def test_get_and_put_remote_file_content(self):
+        content = b'model' * 1000
+        checksum = compute_hash(content, 'traintuple_key')
+        content_dst_path = os.path.join(MEDIA_ROOT, 'model')
+        partial_directory = get_partial_download_directory()
+
+        response = MagicMock(status_code=status.HTTP_200_OK)
+        response.__enter__.return_value = response
+        response.iter_content.return_value = [content[:2000], content[2000:]]
+
+        with mock.patch('substrapp.utils.requests.Session.get', return_value=response):
+            with self.assertRaises(NodeError):
+                get_and_put_remote_file_content('mychannel', 'url', None, 'fake_hash', content_dst_path,
+                                                'traintuple_key')
+            self.assertFalse(os.path.exists(content_dst_path))
+            self.assertEqual(os.listdir(partial_directory), [])
+
+            get_and_put_remote_file_content('mychannel', 'url', None, checksum, content_dst_path, 'traintuple_key')
+            with open(content_dst_path, 'rb') as f:
+                self.assertEqual(f.read(), content)
+            self.assertEqual(os.listdir(partial_directory), [])
+
+    def test_get_and_put_remote_file_content_cross_device(self):
+        content = b'model' * 1000
+        checksum = compute_hash(content, 'traintuple_key')
+        content_dst_path = os.path.join(MEDIA_ROOT, 'model')
+        replace = os.replace
+
+        def replace_cross_device(src, dst):
+            if os.path.dirname(src) == get_partial_download_directory():
+                raise OSError(errno.EXDEV, 'Invalid cross-device link')
+            replace(src, dst)
+
+        response = MagicMock(status_code=status.HTTP_200_OK)
+        response.__enter__.return_value = response
+        response.iter_content.return_value = [content]
+
+        with mock.patch('substrapp.utils.requests.Session.get', return_value=response), \
+                mock.patch('substrapp.utils.os.replace', side_effect=replace_cross_device):
+            # the partial file is copied when it is not on the filesystem of the destination
+            get_and_put_remote_file_content('mychannel', 'url', None, checksum, content_dst_path, 'traintuple_key')
+
+        with open(content_dst_path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(os.listdir(get_partial_download_directory()), [])
+
+    def test_get_and_put_remote_file_content_resume(self):
+        content = b'model' * 1000
+        checksum = compute_hash(content, 'traintuple_key')
+        content_dst_path = os.path.join(MEDIA_ROOT, 'model')
+
+        def iter_content_interrupted(chunk_size):
+            yield content[:2000]
+            raise requests.exceptions.ConnectionError()
+
+        response = MagicMock(status_code=status.HTTP_200_OK)
+        response.__enter__.return_value = response
+        response.iter_content.side_effect = iter_content_interrupted
+
+        with mock.patch('substrapp.utils.requests.Session.get', return_value=response) as mget:
+            with self.assertRaises(NodeError):
+                get_and_put_remote_file_content('mychannel', 'url', None, checksum, content_dst_path,
+                                                'traintuple_key')
+            self.assertFalse(os.path.exists(content_dst_path))
+
+            # the download is resumed from the last byte received
+            response.status_code = status.HTTP_206_PARTIAL_CONTENT
+            response.headers = {'Content-Range': f'bytes 2000-{len(content) - 1}/{len(content)}'}
+            response.iter_content.side_effect = None
+            response.iter_content.return_value = [content[2000:]]
+            get_and_put_remote_file_content('mychannel', 'url', None, checksum, content_dst_path, 'traintuple_key')
+
+            self.assertEqual(mget.call_args[1]['headers']['Range'], 'bytes=2000-')
+            with open(content_dst_path, 'rb') as f:
+                self.assertEqual(f.read(), content)
+
+    @override_settings(HTTP_CLIENT_SEGMENTED_DOWNLOAD_THRESHOLD=1000, HTTP_CLIENT_SEGMENTED_DOWNLOAD_SEGMENTS=4)
+    def test_get_and_put_remote_file_content_segmented(self):
+        content = os.urandom(10000)
+        checksum = compute_hash(content, 'traintuple_key')
+        content_dst_path = os.path.join(MEDIA_ROOT, 'model')
+        failing_ranges = {'bytes=5126-7563'}
+
+        def fake_get(url, headers, **kwargs):
+            if 'Range' not in headers:
+                raise AssertionError('the whole file must not be requested')
+
+            response = MagicMock()
+            response.__enter__.return_value = response
+            start, end = headers['Range'][len('bytes='):].split('-')
+            start, end = int(start), min(int(end) if end else len(content) - 1, len(content) - 1)
+            response.status_code = status.HTTP_206_PARTIAL_CONTENT
+            response.headers = {'Content-Range': f'bytes {start}-{end}/{len(content)}'}
+
+            def iter_content(chunk_size):
+                yield content[start:min(start + 1000, end + 1)]
+                if headers['Range'] in failing_ranges:
+                    raise requests.exceptions.ConnectionError()
+                yield content[start + 1000:end + 1]
+            response.iter_content.side_effect = iter_content
+            return response
+
+        with mock.patch('substrapp.utils.requests.Session.get', side_effect=fake_get) as mget:
+            # the bytes downloaded before the failed segment are kept
+            with self.assertRaises(NodeError):
+                get_and_put_remote_file_content('mychannel', 'url', None, checksum, content_dst_path,
+                                                'traintuple_key')
+            self.assertFalse(os.path.exists(content_dst_path))
+            # the first request is the first segment, which gives the size of the file
+            self.assertEqual([call[1]['headers']['Range'] for call in mget.call_args_list],
+                             ['bytes=0-249', 'bytes=250-2687', 'bytes=2688-5125', 'bytes=5126-7563',
+                              'bytes=7564-9999'])
+
+            get_and_put_remote_file_content('mychannel', 'url', None, checksum, content_dst_path, 'traintuple_key')
+            self.assertEqual(mget.call_args[1]['headers']['Range'], 'bytes=6126-')
+            with open(content_dst_path, 'rb') as f:
+                self.assertEqual(f.read(), content)
+
+            # small files are downloaded with a single request
+            mget.reset_mock()
+            os.remove(content_dst_path)
+            content = content[:200]
+            checksum = compute_hash(content, 'traintuple_key')
+            get_and_put_remote_file_content('mychannel', 'url', None, checksum, content_dst_path, 'traintuple_key')
+            self.assertEqual(mget.call_count, 1)
+            with open(content_dst_path, 'rb') as f:
+                self.assertEqual(f.read(), content)
 
     def test_uncompress_content_tar(self):
         algo_content = self.algo.read()
@@ -317,6 +452,53 @@ class TasksTests(APITestCase):
             self.assertTrue(isinstance(objective, bytes))
             self.assertEqual(objective, metrics_content)
 
+    def test_get_tuple_ledger_queries(self):
+        subtuple = {
+            'algo': {'key': 'algo_key'},
+            'in_models': [{'traintuple_key': 'model_1'}, {'traintuple_key': 'model_2'},
+                          {'traintuple_key': 'model_1'}],
+            'compute_plan_key': 'cp_key',
+        }
+        self.assertEqual(get_tuple_ledger_queries('aggregatetuple', subtuple), [
+            ('algo_key', 'queryAggregateAlgo'),
+            ('model_1', 'queryModelDetails'),
+            ('model_2', 'queryModelDetails'),
+            ('cp_key', 'queryComputePlan'),
+        ])
+
+        subtuple = {
+            'objective': {'key': 'objective_key'},
+            'algo': {'key': 'algo_key'},
+            'traintuple_type': 'composite_traintuple',
+            'traintuple_key': 'traintuple_key',
+        }
+        self.assertEqual(get_tuple_ledger_queries('testtuple', subtuple), [
+            ('objective_key', 'queryObjective'),
+            ('algo_key', 'queryCompositeAlgo'),
+            ('traintuple_key', 'queryCompositeTraintuple'),
+        ])
+
+    def test_get_tuple_ledger_objects(self):
+        subtuple = {
+            'algo': {'key': 'algo_key'},
+            'in_models': [{'traintuple_key': 'model_key'}],
+        }
+
+        with mock.patch('substrapp.tasks.tasks.get_objects_from_ledger') as mget_objects_from_ledger, \
+                mock.patch('substrapp.tasks.tasks.get_object_from_ledger') as mget_object_from_ledger:
+            mget_objects_from_ledger.return_value = [assets.algo[0], {'traintuple': assets.traintuple[0]}]
+            ledger_objects = get_tuple_ledger_objects(CHANNEL, 'traintuple', subtuple)
+
+            mget_objects_from_ledger.assert_called_once_with(
+                CHANNEL, [('algo_key', 'queryAlgo'), ('model_key', 'queryModelDetails')])
+            self.assertEqual(ledger_objects[('algo_key', 'queryAlgo')], assets.algo[0])
+
+            # prefetched objects are not queried again
+            with mock.patch('substrapp.tasks.tasks.get_asset_content') as mget_asset_content:
+                mget_asset_content.return_value = b'algo'
+                self.assertEqual(get_algo(CHANNEL, 'traintuple', subtuple, ledger_objects), b'algo')
+            mget_object_from_ledger.assert_not_called()
+
     def test_build_subtuple_folders(self):
         with mock.patch('substrapp.tasks.tasks.getattr') as getattr:
             getattr.return_value = self.subtuple_path
@@ -357,7 +539,7 @@ class TasksTests(APITestCase):
                 mock.patch('substrapp.tasks.tasks.build_subtuple_folders') as mbuild_subtuple_folders, \
                 mock.patch('substrapp.tasks.tasks.prepare_opener') as mprepare_opener, \
                 mock.patch('substrapp.tasks.tasks.prepare_data_sample') as mprepare_data_sample, \
-                mock.patch('substrapp.tasks.tasks.uncompress_content'), \
+                mock.patch('substrapp.tasks.cache.uncompress_content'), \
                 mock.patch('substrapp.tasks.tasks.json.loads') as mjson_loads, \
                 mock.patch('substrapp.tasks.tasks.AsyncResult') as masyncres, \
                 mock.patch('substrapp.tasks.tasks.get_owner') as get_owner,\
@@ -448,6 +630,7 @@ class TasksTests(APITestCase):
                 f.write("MODEL")
 
             with mock.patch('substrapp.tasks.tasks.compute_job') as mcompute_job, \
+                    mock.patch('substrapp.tasks.tasks.get_tuple_ledger_objects'), \
                     mock.patch('substrapp.tasks.tasks.do_task') as mdo_task,\
                     mock.patch('substrapp.tasks.tasks.prepare_materials') as mprepare_materials, \
                     mock.patch('substrapp.tasks.tasks.log_success_tuple') as mlog_success_tuple:
@@ -479,7 +662,9 @@ class TasksTests(APITestCase):
             'key': 'subtuple_test',
             'compute_plan_key': 'flkey',
             'traintuple_key': 'subtuple_test',
-            'traintuple_type': 'traintuple'
+            'traintuple_type': 'traintuple',
+            'algo': {'checksum': 'algo_checksum'},
+            'objective': {'metrics': {'checksum': 'metrics_checksum'}},
         }]
 
         with mock.patch('substrapp.tasks.tasks.settings') as msettings, \
@@ -491,7 +676,7 @@ class TasksTests(APITestCase):
                 mock.patch('substrapp.tasks.tasks.build_subtuple_folders') as mbuild_subtuple_folders, \
                 mock.patch('substrapp.tasks.tasks.prepare_opener'), \
                 mock.patch('substrapp.tasks.tasks.prepare_data_sample'), \
-                mock.patch('substrapp.tasks.tasks.uncompress_content'):
+                mock.patch('substrapp.tasks.cache.uncompress_content'):
 
             msettings.return_value = FakeSettings()
             mget_hash.return_value = 'owkinhash'
@@ -502,3 +687,118 @@ class TasksTests(APITestCase):
 
             prepare_materials(CHANNEL, subtuple[0], 'traintuple')
             prepare_materials(CHANNEL, subtuple[0], 'testtuple')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class AssetCacheTests(APITestCase):
+
+    def setUp(self):
+        create_directory(MEDIA_ROOT)
+        self.cache_directory = os.path.join(MEDIA_ROOT, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def test_get_put(self):
+        cache = AssetCache(self.cache_directory, max_size=100)
+        checksum = compute_hash(b'content')
+
+        self.assertIsNone(cache.get(checksum))
+        cache.put(checksum, b'content')
+        self.assertEqual(cache.get(checksum), b'content')
+
+        # not a checksum
+        cache.put('../content', b'content')
+        self.assertIsNone(cache.get('../content'))
+
+        dst_path = os.path.join(MEDIA_ROOT, 'model')
+        self.assertTrue(cache.get_file(checksum, dst_path))
+        with open(dst_path, 'rb') as f:
+            self.assertEqual(f.read(), b'content')
+
+        # the entries of a disabled cache are ignored
+        self.assertIsNone(AssetCache(self.cache_directory, max_size=0).get(checksum))
+
+    def test_evict(self):
+        cache = AssetCache(self.cache_directory, max_size=10)
+        checksums = [compute_hash(content) for content in (b'aaaa', b'bbbb', b'cccc')]
+
+        cache.put(checksums[0], b'aaaa')
+        cache.put(checksums[1], b'bbbb')
+        # the least recently used entry is evicted
+        os.utime(cache._get_path(checksums[0]), (0, 0))
+        cache.get(checksums[1])
+        cache.put(checksums[2], b'cccc')
+
+        self.assertIsNone(cache.get(checksums[0]))
+        self.assertEqual(cache.get(checksums[1]), b'bbbb')
+        self.assertEqual(cache.get(checksums[2]), b'cccc')
+
+    def test_get_asset_content(self):
+        content = b'algo'
+        checksum = compute_hash(content)
+
+        with mock.patch('substrapp.tasks.utils.get_remote_file_content', return_value=content) as mget_remote_file, \
+                mock.patch('substrapp.tasks.utils.authenticate_worker'):
+            self.assertEqual(get_asset_content(CHANNEL, 'url', 'node_id', checksum), content)
+            self.assertEqual(get_asset_content(CHANNEL, 'url', 'node_id', checksum), content)
+            mget_remote_file.assert_called_once()
+
+    def test_get_and_put_asset_content(self):
+        checksum = compute_hash(b'model', 'traintuple_key')
+
+        def fake_download(*args, content_dst_path, **kwargs):
+            with open(content_dst_path, 'wb') as f:
+                f.write(b'model')
+
+        with mock.patch('substrapp.tasks.utils.get_and_put_remote_file_content',
+                        side_effect=fake_download) as mget_and_put_remote_file, \
+                mock.patch('substrapp.tasks.utils.authenticate_worker'):
+            for subtuple in ('subtuple_1', 'subtuple_2'):
+                create_directory(os.path.join(MEDIA_ROOT, subtuple))
+                dst_path = os.path.join(MEDIA_ROOT, subtuple, 'model')
+                get_and_put_asset_content(CHANNEL, 'url', 'node_id', checksum, dst_path, 'traintuple_key')
+                with open(dst_path, 'rb') as f:
+                    self.assertEqual(f.read(), b'model')
+            mget_and_put_remote_file.assert_called_once()
+
+    def test_archive_cache(self):
+        algo, _ = get_sample_algo()
+        content = algo.read()
+        checksum = compute_hash(content)
+        cache = ArchiveCache(self.cache_directory, max_size=10 * 1024 ** 2)
+        get_content = MagicMock(return_value=content)
+
+        for subtuple in ('subtuple_1', 'subtuple_2'):
+            cache.uncompress(checksum, get_content, os.path.join(MEDIA_ROOT, subtuple))
+        get_content.assert_called_once()
+
+        # the files of the uncompressed archive are shared
+        dockerfiles = [os.path.join(MEDIA_ROOT, subtuple, 'Dockerfile') for subtuple in ('subtuple_1', 'subtuple_2')]
+        self.assertTrue(os.path.samefile(*dockerfiles))
+
+        # entries above the cache size are evicted
+        cache.max_size = 1
+        cache.evict()
+        cache.uncompress(checksum, get_content, os.path.join(MEDIA_ROOT, 'subtuple_3'))
+        self.assertEqual(get_content.call_count, 2)
+        self.assertTrue(os.path.exists(os.path.join(MEDIA_ROOT, 'subtuple_3', 'Dockerfile')))
+
+    def test_archive_cache_copy(self):
+        algo, _ = get_sample_algo()
+        content = algo.read()
+        checksum = compute_hash(content)
+        cache = get_archive_cache()
+        dst_directory = os.path.join(MEDIA_ROOT, 'subtuple', 'subtuple_1')
+
+        # the cache is on the volume of the subtuple folders
+        self.assertEqual(os.path.dirname(cache.directory), os.path.dirname(get_partial_download_directory()))
+
+        # files of another filesystem are copied
+        cross_device_error = OSError(errno.EXDEV, 'Invalid cross-device link')
+        with mock.patch('substrapp.tasks.cache.os.link', side_effect=cross_device_error), \
+                mock.patch('substrapp.tasks.cache.logger') as mlogger:
+            cache.uncompress(checksum, MagicMock(return_value=content), dst_directory)
+        self.assertTrue(mlogger.warning.called)
+        self.assertFalse(os.path.samefile(os.path.join(dst_directory, 'Dockerfile'),
+                                          os.path.join(cache._get_path(checksum), 'Dockerfile')))
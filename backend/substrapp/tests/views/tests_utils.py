@@ -8,7 +8,7 @@ import requests
 from requests.auth import HTTPBasicAuth
 from rest_framework import status
 from rest_framework.test import APITestCase
-from substrapp.views.utils import PermissionMixin, PermissionError
+from substrapp.views.utils import PermissionMixin, PermissionError, get_byte_range
 
 
 class MockRequest:
@@ -16,6 +16,10 @@ class MockRequest:
     headers = {'Substra-Channel-Name': 'mychannel'}
 
 
+class MockRangeRequest(MockRequest):
+    headers = {'Substra-Channel-Name': 'mychannel', 'Range': 'bytes=4-'}
+
+
 def with_permission_mixin(remote, same_file_property, has_access):
     def inner(f):
         @functools.wraps(f)
@@ -82,7 +86,7 @@ def with_requests_mock(allowed):
 
             with mock.patch('substrapp.views.utils.authenticate_outgoing_request',
                             return_value=HTTPBasicAuth('foo', 'bar')), \
-                    mock.patch('substrapp.utils.requests.get', return_value=requests_response):
+                    mock.patch('substrapp.utils.requests.Session.get', return_value=requests_response):
                 f(*args, **kwargs)
         return wrapper
     return inner
@@ -99,6 +103,25 @@ class PermissionMixinDownloadFileTests(APITestCase):
         self.assertEqual(res['Content-Disposition'], f'attachment; filename="{filename}"')
         self.assertTrue(permission_mixin.get_object.called)
 
+    @with_permission_mixin(remote=False, same_file_property=False, has_access=True)
+    def test_download_file_local_range(self, permission_mixin, content, **kwargs):
+        res = permission_mixin.download_file(MockRangeRequest(),
+                                             'file_property',
+                                             'ledger_file_property')
+        self.assertEqual(res.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(list(res.streaming_content)), content[4:])
+        self.assertEqual(res['Content-Range'], f'bytes 4-{len(content) - 1}/{len(content)}')
+
+    def test_get_byte_range(self):
+        self.assertIsNone(get_byte_range(None, 10))
+        self.assertIsNone(get_byte_range('bytes=0-1,4-5', 10))
+        self.assertEqual(get_byte_range('bytes=4-', 10), (4, 9))
+        self.assertEqual(get_byte_range('bytes=4-5', 10), (4, 5))
+        self.assertEqual(get_byte_range('bytes=4-20', 10), (4, 9))
+        self.assertEqual(get_byte_range('bytes=-3', 10), (7, 9))
+        with self.assertRaises(ValueError):
+            get_byte_range('bytes=10-', 10)
+
     @with_permission_mixin(remote=False, same_file_property=True, has_access=False)
     def test_download_file_local_denied(self, permission_mixin, **kwargs):
         res = permission_mixin.download_file(MockRequest(), 'file_property')
@@ -1,9 +1,10 @@
 import mock
 
-from rest_framework.test import APITestCase
+from django.test import override_settings
+from rest_framework.test import APIClient, APITestCase
 
 from substrapp.views.datasample import path_leaf
-from substrapp.ledger.api import get_object_from_ledger
+from substrapp.ledger.api import get_object_from_ledger, LEDGER_CALLS, LEDGER_CALL_DURATION
 
 
 from ..assets import objective
@@ -26,3 +27,36 @@ class ViewTests(APITestCase):
             data = get_object_from_ledger('mychannel', '', 'queryObjective')
 
             self.assertEqual(data, objective)
+
+    @override_settings(METRICS_PORT=8001)
+    def test_metrics_view(self):
+        LEDGER_CALLS.inc(channel='mychannel', call_type='query', fcn='queryMetricsView', error='')
+        LEDGER_CALL_DURATION.observe(0.2, channel='mychannel', call_type='query', fcn='queryMetricsView')
+
+        # scraped without credentials
+        response = APIClient().get('/metrics/', SERVER_PORT='8001')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+
+        content = response.content.decode()
+        self.assertIn('# TYPE ledger_calls counter', content)
+        self.assertIn('ledger_calls_total{channel="mychannel",call_type="query",fcn="queryMetricsView",error=""} 1.0',
+                      content)
+        self.assertIn('ledger_call_duration_seconds_bucket'
+                      '{channel="mychannel",call_type="query",fcn="queryMetricsView",le="0.1"} 0.0', content)
+        self.assertIn('ledger_call_duration_seconds_bucket'
+                      '{channel="mychannel",call_type="query",fcn="queryMetricsView",le="0.25"} 1.0', content)
+        self.assertIn('ledger_call_duration_seconds_count'
+                      '{channel="mychannel",call_type="query",fcn="queryMetricsView"} 1.0', content)
+
+    def test_metrics_view_port(self):
+        # not served when there is no metrics port
+        response = APIClient().get('/metrics/')
+        self.assertEqual(response.status_code, 404)
+
+        with override_settings(METRICS_PORT=8001):
+            response = APIClient().get('/metrics/')
+            self.assertEqual(response.status_code, 404)
+
+            response = APIClient().get('/metrics/', SERVER_PORT='8001')
+            self.assertEqual(response.status_code, 200)
@@ -16,6 +16,7 @@ from rest_framework.test import APITestCase
 from substrapp.serializers import LedgerAlgoSerializer
 
 from substrapp.ledger.exceptions import LedgerError
+from substrapp.ledger.projection import sync_projection
 
 from ..common import get_sample_algo, AuthenticatedClient, encode_filter
 from ..assets import objective, datamanager, algo, model
@@ -65,6 +66,33 @@ class AlgoViewTests(APITestCase):
             r = response.json()
             self.assertEqual(r, algo)
 
+    @override_settings(LEDGER_PROJECTION_MAX_AGE_SECONDS=60)
+    def test_algo_list_paginated(self):
+        url = reverse('substrapp:algo-list')
+
+        with mock.patch('substrapp.ledger.projection.iter_query_ledger_pages') as miter_query_ledger_pages, \
+                mock.patch('substrapp.ledger.projection.get_ledger_height') as mget_ledger_height:
+            miter_query_ledger_pages.return_value = iter([algo])
+            mget_ledger_height.return_value = 1
+            sync_projection('mychannel', 'queryAlgos')
+
+        sorted_keys = sorted(a['key'] for a in algo)
+
+        response = self.client.get(url + '?page_size=2', **self.extra)
+        r = response.json()
+        self.assertEqual([a['key'] for a in r['results']], sorted_keys[0:2])
+        self.assertTrue(r['results'][0]['content']['storage_address'].startswith('http://testserver/'))
+
+        response = self.client.get(r['next'], **self.extra)
+        r = response.json()
+        self.assertEqual([a['key'] for a in r['results']], sorted_keys[2:4])
+
+        search_params = f'&search=algo%253Aname%253A{encode_filter(algo[0]["name"])}'
+        response = self.client.get(url + '?page_size=2' + search_params, **self.extra)
+        r = response.json()
+        self.assertEqual(r['results'][0]['key'], algo[0]['key'])
+        self.assertIsNone(r['next'])
+
     def test_algo_list_filter_fail(self):
         url = reverse('substrapp:algo-list')
         with mock.patch('substrapp.views.algo.query_ledger') as mquery_ledger:
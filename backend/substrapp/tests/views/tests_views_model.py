@@ -128,6 +128,24 @@ class ModelViewTests(APITestCase):
 
             self.assertEqual(len(r), 3)
 
+    def test_model_list_filter_algo_or(self):
+        url = reverse('substrapp:model-list')
+        with mock.patch('substrapp.views.model.query_ledger') as mquery_ledger, \
+                mock.patch('substrapp.views.filters_utils.query_ledger') as mquery_ledger2:
+            mquery_ledger.return_value = model
+            mquery_ledger2.return_value = algo
+
+            search_params = (f'?search=algo%253Aname%253A{encode_filter(algo[0]["name"])}'
+                             f'-OR-algo%253Aname%253A{encode_filter(algo[0]["name"])}'
+                             f'-OR-model%253Akey%253A{model[0]["traintuple"]["key"]}')
+            response = self.client.get(url + search_params, **self.extra)
+            r = response.json()
+
+            # the algos are queried once for all the filters, results are not duplicated
+            mquery_ledger2.assert_called_once()
+            self.assertEqual(len(r), 3)
+            self.assertEqual(len({m['traintuple']['key'] for m in r if 'traintuple' in m}), 3)
+
     def test_model_retrieve(self):
         done_model = [m for m in model if 'traintuple' in m and m['traintuple']['status'] == 'done'][0]
 
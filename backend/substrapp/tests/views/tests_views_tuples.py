@@ -65,6 +65,42 @@ class TraintupleViewTests(APITestCase):
             r = response.json()
             self.assertEqual(r, [])
 
+    def test_traintuple_list_paginated(self):
+        url = reverse('substrapp:traintuple-list')
+        bookmark_pages = {
+            '': (traintuple[0:3], 'bookmark_1'),
+            'bookmark_1': (traintuple[3:], 'bookmark_2'),
+            'bookmark_2': ([], ''),
+        }
+
+        with mock.patch('substrapp.views.utils.query_ledger_page') as mquery_ledger_page:
+            mquery_ledger_page.side_effect = lambda channel_name, fcn, bookmark: bookmark_pages[bookmark]
+
+            results = []
+            response = self.client.get(url + '?page_size=2', **self.extra)
+            while True:
+                r = response.json()
+                self.assertLessEqual(len(r['results']), 2)
+                results.extend(r['results'])
+                if r['next'] is None:
+                    break
+                response = self.client.get(r['next'], **self.extra)
+
+            self.assertEqual(results, traintuple)
+            # bookmark pages are only fetched when needed
+            first_response = self.client.get(url + '?page_size=2', **self.extra)
+            self.assertEqual(first_response.json()['results'], traintuple[0:2])
+            mquery_ledger_page.assert_called_with('mychannel', 'queryTraintuples', '')
+
+    def test_traintuple_list_paginated_invalid(self):
+        url = reverse('substrapp:traintuple-list')
+
+        response = self.client.get(url + '?page_size=0', **self.extra)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(url + '?page_size=2&cursor=invalid', **self.extra)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_traintuple_retrieve(self):
 
         with mock.patch('substrapp.views.traintuple.get_object_from_ledger') as mget_object_from_ledger:
@@ -1,17 +1,25 @@
+import errno
+import fcntl
 import io
 import hashlib
 import logging
 import os
+import re
 import tempfile
+import threading
 from os import path
 from os.path import isfile, isdir
 import shutil
+from urllib.parse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import tarfile
 import zipfile
 import uuid
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from checksumdir import dirhash
 
@@ -21,6 +29,11 @@ from rest_framework import status
 logger = logging.getLogger(__name__)
 
 HTTP_CLIENT_TIMEOUT_SECONDS = getattr(settings, 'HTTP_CLIENT_TIMEOUT_SECONDS')
+HASH_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Partial downloads are resumed by the next attempts to download the same file during this delay
+PARTIAL_DOWNLOAD_MAX_AGE_SECONDS = 24 * 3600
+CHECKSUM_PATTERN = re.compile(r'^[0-9a-f]{64}$')
 
 
 class JsonException(Exception):
@@ -80,33 +93,58 @@ def get_hash(file, key=None):
     if isinstance(file, (str, bytes, os.PathLike)):
         if isfile(file):
             with open(file, 'rb') as f:
-                data = f.read()
+                return compute_file_hash(f, key)
         elif isdir(file):
             return get_dir_hash(file)
         else:
             return ''
     else:
         openedfile = file.open()
-        data = openedfile.read()
-        openedfile.seek(0)
-
-    return compute_hash(data, key)
+        try:
+            return compute_file_hash(openedfile, key)
+        finally:
+            openedfile.seek(0)
 
 
 def get_owner():
     return settings.LEDGER_MSP_ID
 
 
-def compute_hash(bytes, key=None):
-    sha256_hash = hashlib.sha256()
-
+def _update_hash(sha256_hash, bytes):
     if isinstance(bytes, str):
         bytes = bytes.encode()
+    sha256_hash.update(bytes)
+
 
+def _update_hash_key(sha256_hash, key):
+    # the key is hashed as if it was appended to the content
     if key is not None and isinstance(key, str):
-        bytes += key.encode()
+        sha256_hash.update(key.encode())
 
-    sha256_hash.update(bytes)
+
+def compute_hash(bytes, key=None):
+    sha256_hash = hashlib.sha256()
+
+    _update_hash(sha256_hash, bytes)
+    _update_hash_key(sha256_hash, key)
+
+    return sha256_hash.hexdigest()
+
+
+def _update_file_hash(sha256_hash, file):
+    while True:
+        chunk = file.read(HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        _update_hash(sha256_hash, chunk)
+
+
+def compute_file_hash(file, key=None):
+    """Same as `compute_hash` on the content of a file object, read by chunks of HASH_CHUNK_SIZE bytes."""
+    sha256_hash = hashlib.sha256()
+
+    _update_file_hash(sha256_hash, file)
+    _update_hash_key(sha256_hash, key)
 
     return sha256_hash.hexdigest()
 
@@ -214,7 +252,45 @@ class NodeError(Exception):
     pass
 
 
-def get_remote_file(channel_name, url, auth, content_dst_path=None, **kwargs):
+_sessions = {}
+_sessions_pid = None
+_sessions_lock = threading.Lock()
+
+
+def _create_session():
+    retries = Retry(
+        total=settings.HTTP_CLIENT_RETRIES,
+        backoff_factor=settings.HTTP_CLIENT_RETRY_BACKOFF_FACTOR,
+        status_forcelist=(502, 503, 504),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_maxsize=settings.HTTP_CLIENT_POOL_MAXSIZE, max_retries=retries)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session(url):
+    """Return the HTTP session to the node serving `url`, which keeps its connections alive."""
+    global _sessions, _sessions_pid
+
+    parsed_url = urlparse(url)
+    origin = f'{parsed_url.scheme}://{parsed_url.netloc}'
+
+    with _sessions_lock:
+        # Connections must not be shared with forked processes
+        if _sessions_pid != os.getpid():
+            _sessions = {}
+            _sessions_pid = os.getpid()
+
+        if origin not in _sessions:
+            _sessions[origin] = _create_session()
+        return _sessions[origin]
+
+
+def get_remote_file(channel_name, url, auth, **kwargs):
 
     headers = {
         'Accept': 'application/json;version=0.0',
@@ -232,16 +308,7 @@ def get_remote_file(channel_name, url, auth, content_dst_path=None, **kwargs):
         kwargs['verify'] = False
 
     try:
-        if kwargs.get('stream', False) and content_dst_path is not None:
-            chunk_size = 1024 * 1024
-
-            with requests.get(url, **kwargs) as response:
-                response.raise_for_status()
-
-                with open(content_dst_path, 'wb') as fp:
-                    fp.writelines(response.iter_content(chunk_size))
-        else:
-            response = requests.get(url, **kwargs)
+        response = get_session(url).get(url, **kwargs)
     except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
         raise NodeError(f'Failed to fetch {url}') from e
 
@@ -262,17 +329,189 @@ def get_remote_file_content(channel_name, url, auth, content_checksum, salt=None
     return response.content
 
 
+def get_partial_download_directory():
+    return get_worker_cache_directory('partial')
+
+
+def _remove_stale_partial_downloads(directory):
+    now = time.time()
+    for filename in os.listdir(directory):
+        try:
+            if now - os.stat(path.join(directory, filename)).st_mtime > PARTIAL_DOWNLOAD_MAX_AGE_SECONDS:
+                os.remove(path.join(directory, filename))
+        except FileNotFoundError:
+            pass
+
+
+def _open_partial_download(content_checksum):
+    """Open the partial download of a file for appending, locked until it is closed."""
+    directory = get_partial_download_directory()
+    create_directory(directory)
+    _remove_stale_partial_downloads(directory)
+
+    if isinstance(content_checksum, str) and CHECKSUM_PATTERN.match(content_checksum):
+        partial_path = path.join(directory, content_checksum)
+    else:
+        partial_path = path.join(directory, uuid.uuid4().hex)
+
+    while True:
+        fp = open(partial_path, 'ab')
+        # concurrent downloads of the same file wait for each other
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        try:
+            if path.samestat(os.fstat(fp.fileno()), os.stat(partial_path)):
+                return fp, partial_path
+        except FileNotFoundError:
+            pass
+        # completed by another download meanwhile
+        fp.close()
+
+
+def _get_content_range_size(response):
+    """Return the size of the file of a range response, None if it is unknown."""
+    try:
+        return int(response.headers['Content-Range'].rsplit('/', 1)[1])
+    except (KeyError, IndexError, ValueError):
+        return None
+
+
+def _download_segments(channel_name, url, auth, partial_path, offset, size):
+    """Download the bytes of a file from `offset` to its `size` to `partial_path` with concurrent range requests.
+
+    On errors, the partial file is truncated to the bytes downloaded contiguously from its start,
+    so that the download can be resumed.
+    """
+    segments_count = 1
+    if size >= settings.HTTP_CLIENT_SEGMENTED_DOWNLOAD_THRESHOLD:
+        segments_count = settings.HTTP_CLIENT_SEGMENTED_DOWNLOAD_SEGMENTS
+    segment_size = -(-(size - offset) // segments_count)
+    segments = [(start, min(start + segment_size, size) - 1) for start in range(offset, size, segment_size)]
+    written = [0] * len(segments)
+
+    def download_segment(i):
+        start, end = segments[i]
+        headers = {'Range': f'bytes={start}-{end}'}
+        with get_remote_file(channel_name, url, auth, stream=True, headers=headers) as response:
+            if (response.status_code != status.HTTP_206_PARTIAL_CONTENT or
+                    not response.headers.get('Content-Range', '').startswith(f'bytes {start}-{end}/')):
+                raise NodeError(f'Url: {url} returned status code: {response.status_code} for range {start}-{end}')
+
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                if written[i] + len(chunk) > end - start + 1:
+                    raise NodeError(f'Url: {url} returned more bytes than requested for range {start}-{end}')
+                os.pwrite(fd, chunk, start + written[i])
+                written[i] += len(chunk)
+
+        if written[i] != end - start + 1:
+            raise NodeError(f'Url: {url} returned an incomplete range {start}-{end}')
+
+    logger.info(f'Downloading {url} ({size} bytes) in {len(segments)} segments')
+
+    # pwrite ignores the offset of files opened for appending
+    fd = os.open(partial_path, os.O_WRONLY)
+    try:
+        os.ftruncate(fd, size)
+        with ThreadPoolExecutor(max_workers=len(segments)) as executor:
+            futures = [executor.submit(download_segment, i) for i in range(len(segments))]
+        errors = [future.exception() for future in futures if future.exception() is not None]
+
+        if errors:
+            downloaded = offset
+            for (start, end), segment_written in zip(segments, written):
+                downloaded += segment_written
+                if segment_written != end - start + 1:
+                    break
+            os.ftruncate(fd, downloaded)
+            raise errors[0]
+    finally:
+        os.close(fd)
+
+
 def get_and_put_remote_file_content(channel_name, url, auth, content_checksum, content_dst_path, hash_key):
+    """Download a remote file to `content_dst_path`, computing its checksum while it is downloaded.
 
-    response = get_remote_file(channel_name, url, auth, content_dst_path, stream=True)
+    The file is downloaded to a partial file, renamed to `content_dst_path` once its checksum is verified.
+    Partial files are kept when the download is interrupted, so that the next attempt (for instance the
+    retry of the task) resumes it with a range request.
 
-    if response.status_code != status.HTTP_200_OK:
-        logger.error(f'Url: {url} returned status code: {response.status_code}: {response.text}')
-        raise NodeError(f'Url: {url} returned status code: {response.status_code}')
+    Files of HTTP_CLIENT_SEGMENTED_DOWNLOAD_THRESHOLD bytes or more are downloaded with concurrent range
+    requests of HTTP_CLIENT_SEGMENTED_DOWNLOAD_SEGMENTS segments. When it is enabled, the first request is
+    a range request of the first segment, which gives the size of the file.
+    """
+    fp, partial_path = _open_partial_download(content_checksum)
+
+    with fp:
+        offset = os.fstat(fp.fileno()).st_size
+        sha256_hash = hashlib.sha256()
+        headers = {}
+        first_segment_end = None
+        size = None
+        if offset:
+            with open(partial_path, 'rb') as f:
+                _update_file_hash(sha256_hash, f)
+            headers['Range'] = f'bytes={offset}-'
+        elif settings.HTTP_CLIENT_SEGMENTED_DOWNLOAD_THRESHOLD:
+            first_segment_end = -(-settings.HTTP_CLIENT_SEGMENTED_DOWNLOAD_THRESHOLD //
+                                  settings.HTTP_CLIENT_SEGMENTED_DOWNLOAD_SEGMENTS) - 1
+            headers['Range'] = f'bytes=0-{first_segment_end}'
 
-    computed_checksum = get_hash(content_dst_path, key=hash_key)
-    if computed_checksum != content_checksum:
-        raise NodeError(f"url {url}: checksum doesn't match {content_checksum} vs {computed_checksum}")
+        try:
+            with get_remote_file(channel_name, url, auth, stream=True, headers=headers) as response:
+                if ((offset or first_segment_end is not None) and
+                        response.status_code == status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE):
+                    # the partial file is complete, or the file is empty
+                    chunks = []
+                elif (offset and response.status_code == status.HTTP_206_PARTIAL_CONTENT and
+                        response.headers.get('Content-Range', '').startswith(f'bytes {offset}-')):
+                    logger.info(f'Resuming the download of {url} from byte {offset}')
+                    chunks = response.iter_content(DOWNLOAD_CHUNK_SIZE)
+                elif (first_segment_end is not None and response.status_code == status.HTTP_206_PARTIAL_CONTENT and
+                        response.headers.get('Content-Range', '').startswith('bytes 0-')):
+                    size = _get_content_range_size(response)
+                    if size is None:
+                        raise NodeError(f'Url: {url} returned an unknown file size')
+                    chunks = response.iter_content(DOWNLOAD_CHUNK_SIZE)
+                elif response.status_code == status.HTTP_200_OK:
+                    fp.truncate(0)
+                    sha256_hash = hashlib.sha256()
+                    chunks = response.iter_content(DOWNLOAD_CHUNK_SIZE)
+                else:
+                    logger.error(f'Url: {url} returned status code: {response.status_code}: {response.text}')
+                    raise NodeError(f'Url: {url} returned status code: {response.status_code}')
+
+                for chunk in chunks:
+                    sha256_hash.update(chunk)
+                    fp.write(chunk)
+
+            fp.flush()
+            first_segment_size = os.fstat(fp.fileno()).st_size
+            if size is not None and first_segment_size < size:
+                _download_segments(channel_name, url, auth, partial_path, first_segment_size, size)
+                # segments are received in any order: the checksum is computed once the file is complete
+                with open(partial_path, 'rb') as f:
+                    f.seek(first_segment_size)
+                    _update_file_hash(sha256_hash, f)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError) as e:
+            raise NodeError(f'Failed to fetch {url}') from e
+
+        _update_hash_key(sha256_hash, hash_key)
+        computed_checksum = sha256_hash.hexdigest()
+        if computed_checksum != content_checksum:
+            os.remove(partial_path)
+            raise NodeError(f"url {url}: checksum doesn't match {content_checksum} vs {computed_checksum}")
+
+        fp.flush()
+        try:
+            os.replace(partial_path, content_dst_path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            logger.warning(f'Copying {partial_path} to {content_dst_path}: they are not on the same filesystem')
+            tmp_path = f'{content_dst_path}.tmp-{os.getpid()}'
+            shutil.copyfile(partial_path, tmp_path)
+            os.replace(tmp_path, content_dst_path)
+            os.remove(partial_path)
 
 
 def get_cp_local_folder(compute_plan_key):
@@ -283,6 +522,14 @@ def get_subtuple_directory(subtuple_key):
     return path.join(getattr(settings, 'MEDIA_ROOT'), 'subtuple', subtuple_key)
 
 
+def get_worker_cache_directory(name):
+    """Return a directory of the worker kept across the retries of the tasks and the restarts of the worker.
+
+    It is on the volume of the subtuple directories, so that its files can be renamed or hard linked into them.
+    """
+    return path.join(getattr(settings, 'MEDIA_ROOT'), 'subtuple', '.cache', name)
+
+
 def get_chainkeys_directory(compute_plan_key):
     return path.join(getattr(settings, 'MEDIA_ROOT'), 'computeplan',
                      compute_plan_key, 'chainkeys')
@@ -12,8 +12,9 @@ from substrapp.models import AggregateAlgo
 from substrapp.serializers import LedgerAggregateAlgoSerializer, AggregateAlgoSerializer
 from substrapp.utils import get_hash
 from substrapp.ledger.api import query_ledger, get_object_from_ledger
+from substrapp.ledger.projection import get_projected_assets
 from substrapp.ledger.exceptions import LedgerError, LedgerTimeout, LedgerConflict
-from substrapp.views.utils import (PermissionMixin,
+from substrapp.views.utils import (LedgerListPaginationMixin, PermissionMixin,
                                    validate_key, get_success_create_code, LedgerException, ValidationException,
                                    get_remote_asset, node_has_process_permission, get_channel_name)
 from substrapp.views.filters_utils import filter_list
@@ -27,13 +28,16 @@ def replace_storage_addresses(request, aggregate_algo):
     )
 
 
-class AggregateAlgoViewSet(mixins.CreateModelMixin,
+class AggregateAlgoViewSet(LedgerListPaginationMixin,
+                           mixins.CreateModelMixin,
                            mixins.RetrieveModelMixin,
                            mixins.ListModelMixin,
                            GenericViewSet):
     queryset = AggregateAlgo.objects.all()
     serializer_class = AggregateAlgoSerializer
     ledger_query_call = 'queryAggregateAlgo'
+    ledger_list_call = 'queryAggregateAlgos'
+    list_object_type = 'aggregate_algo'
 
     def perform_create(self, serializer):
         return serializer.save()
@@ -169,8 +173,13 @@ class AggregateAlgoViewSet(mixins.CreateModelMixin,
             return Response(data, status=status.HTTP_200_OK)
 
     def list(self, request, *args, **kwargs):
+        if self.is_list_paginated(request):
+            return self.list_page(request, process_asset=lambda asset: replace_storage_addresses(request, asset))
+
         try:
-            data = query_ledger(get_channel_name(request), fcn='queryAggregateAlgos', args=[])
+            data = get_projected_assets(get_channel_name(request), 'queryAggregateAlgos')
+            if data is None:
+                data = query_ledger(get_channel_name(request), fcn='queryAggregateAlgos', args=[])
         except LedgerError as e:
             return Response({'message': str(e.msg)}, status=e.status)
 
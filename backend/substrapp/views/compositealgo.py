@@ -12,8 +12,9 @@ from substrapp.models import CompositeAlgo
 from substrapp.serializers import LedgerCompositeAlgoSerializer, CompositeAlgoSerializer
 from substrapp.utils import get_hash
 from substrapp.ledger.api import query_ledger, get_object_from_ledger
+from substrapp.ledger.projection import get_projected_assets
 from substrapp.ledger.exceptions import LedgerError, LedgerTimeout, LedgerConflict
-from substrapp.views.utils import (PermissionMixin,
+from substrapp.views.utils import (LedgerListPaginationMixin, PermissionMixin,
                                    validate_key, get_success_create_code, LedgerException, ValidationException,
                                    get_remote_asset, node_has_process_permission, get_channel_name)
 from substrapp.views.filters_utils import filter_list
@@ -27,13 +28,16 @@ def replace_storage_addresses(request, composite_algo):
     )
 
 
-class CompositeAlgoViewSet(mixins.CreateModelMixin,
+class CompositeAlgoViewSet(LedgerListPaginationMixin,
+                           mixins.CreateModelMixin,
                            mixins.RetrieveModelMixin,
                            mixins.ListModelMixin,
                            GenericViewSet):
     queryset = CompositeAlgo.objects.all()
     serializer_class = CompositeAlgoSerializer
     ledger_query_call = 'queryCompositeAlgo'
+    ledger_list_call = 'queryCompositeAlgos'
+    list_object_type = 'composite_algo'
 
     def perform_create(self, serializer):
         return serializer.save()
@@ -169,8 +173,13 @@ class CompositeAlgoViewSet(mixins.CreateModelMixin,
             return Response(data, status=status.HTTP_200_OK)
 
     def list(self, request, *args, **kwargs):
+        if self.is_list_paginated(request):
+            return self.list_page(request, process_asset=lambda asset: replace_storage_addresses(request, asset))
+
         try:
-            data = query_ledger(get_channel_name(request), fcn='queryCompositeAlgos', args=[])
+            data = get_projected_assets(get_channel_name(request), 'queryCompositeAlgos')
+            if data is None:
+                data = query_ledger(get_channel_name(request), fcn='queryCompositeAlgos', args=[])
         except LedgerError as e:
             return Response({'message': str(e.msg)}, status=e.status)
 
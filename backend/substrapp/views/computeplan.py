@@ -7,8 +7,9 @@ from rest_framework.decorators import action
 
 from substrapp.serializers import LedgerComputePlanSerializer
 from substrapp.ledger.api import invoke_ledger, query_ledger, get_object_from_ledger
+from substrapp.ledger.projection import invalidate_projections
 from substrapp.ledger.exceptions import LedgerError
-from substrapp.views.utils import get_success_create_code, validate_key, get_channel_name
+from substrapp.views.utils import LedgerListPaginationMixin, get_success_create_code, validate_key, get_channel_name
 from substrapp.views.filters_utils import filter_list
 
 
@@ -22,10 +23,13 @@ def create_compute_plan(channel_name, data):
     return serializer.create(channel_name, key, serializer.validated_data)
 
 
-class ComputePlanViewSet(mixins.CreateModelMixin,
+class ComputePlanViewSet(LedgerListPaginationMixin,
+                         mixins.CreateModelMixin,
                          GenericViewSet):
 
     serializer_class = LedgerComputePlanSerializer
+    ledger_list_call = 'queryComputePlans'
+    list_object_type = 'compute_plan'
 
     def get_queryset(self):
         return []
@@ -55,6 +59,9 @@ class ComputePlanViewSet(mixins.CreateModelMixin,
             return Response(data, status=status.HTTP_200_OK)
 
     def list(self, request, *args, **kwargs):
+        if self.is_list_paginated(request):
+            return self.list_page(request)
+
         try:
             data = query_ledger(get_channel_name(request), fcn='queryComputePlans', args=[])
         except LedgerError as e:
@@ -89,6 +96,8 @@ class ComputePlanViewSet(mixins.CreateModelMixin,
                 only_key=False)
         except LedgerError as e:
             return Response({'message': str(e.msg)}, status=e.status)
+        finally:
+            invalidate_projections(get_channel_name(request), 'cancelComputePlan')
         return Response(compute_plan, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['POST'])
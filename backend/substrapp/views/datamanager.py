@@ -13,8 +13,9 @@ from substrapp.models import DataManager
 from substrapp.serializers import DataManagerSerializer, LedgerDataManagerSerializer
 from substrapp.utils import get_hash
 from substrapp.ledger.api import query_ledger, get_object_from_ledger
+from substrapp.ledger.projection import get_projected_assets
 from substrapp.ledger.exceptions import LedgerError, LedgerTimeout, LedgerConflict
-from substrapp.views.utils import (PermissionMixin,
+from substrapp.views.utils import (LedgerListPaginationMixin, PermissionMixin,
                                    validate_key, get_success_create_code, ValidationException, LedgerException,
                                    get_remote_asset, node_has_process_permission, get_channel_name)
 from substrapp.views.filters_utils import filter_list
@@ -28,13 +29,16 @@ def replace_storage_addresses(request, data_manager):
     )
 
 
-class DataManagerViewSet(mixins.CreateModelMixin,
+class DataManagerViewSet(LedgerListPaginationMixin,
+                         mixins.CreateModelMixin,
                          mixins.RetrieveModelMixin,
                          mixins.ListModelMixin,
                          GenericViewSet):
     queryset = DataManager.objects.all()
     serializer_class = DataManagerSerializer
     ledger_query_call = 'queryDataManager'
+    ledger_list_call = 'queryDataManagers'
+    list_object_type = 'dataset'
 
     def perform_create(self, serializer):
         return serializer.save()
@@ -187,9 +191,13 @@ class DataManagerViewSet(mixins.CreateModelMixin,
             return Response(data, status=status.HTTP_200_OK)
 
     def list(self, request, *args, **kwargs):
+        if self.is_list_paginated(request):
+            return self.list_page(request, process_asset=lambda asset: replace_storage_addresses(request, asset))
 
         try:
-            data = query_ledger(get_channel_name(request), fcn='queryDataManagers', args=[])
+            data = get_projected_assets(get_channel_name(request), 'queryDataManagers')
+            if data is None:
+                data = query_ledger(get_channel_name(request), fcn='queryDataManagers', args=[])
         except LedgerError as e:
             return Response({'message': str(e.msg)}, status=e.status)
 
@@ -17,19 +17,23 @@ from rest_framework.viewsets import GenericViewSet
 from substrapp.models import DataSample, DataManager
 from substrapp.serializers import DataSampleSerializer, LedgerDataSampleSerializer, LedgerDataSampleUpdateSerializer
 from substrapp.utils import store_datasamples_archive, get_dir_hash
-from substrapp.views.utils import LedgerException, ValidationException, get_success_create_code, get_channel_name
+from substrapp.views.utils import (LedgerListPaginationMixin, LedgerException, ValidationException,
+                                   get_success_create_code, get_channel_name)
 from substrapp.ledger.api import query_ledger
+from substrapp.ledger.projection import get_projected_assets
 from substrapp.ledger.exceptions import LedgerError, LedgerTimeout, LedgerConflict
 
 logger = logging.getLogger(__name__)
 
 
-class DataSampleViewSet(mixins.CreateModelMixin,
+class DataSampleViewSet(LedgerListPaginationMixin,
+                        mixins.CreateModelMixin,
                         mixins.RetrieveModelMixin,
                         mixins.ListModelMixin,
                         GenericViewSet):
     queryset = DataSample.objects.all()
     serializer_class = DataSampleSerializer
+    ledger_list_call = 'queryDataSamples'
 
     @staticmethod
     def check_datamanagers(data_manager_keys):
@@ -189,8 +193,13 @@ class DataSampleViewSet(mixins.CreateModelMixin,
             return Response(data, status=st, headers=headers)
 
     def list(self, request, *args, **kwargs):
+        if self.is_list_paginated(request):
+            return self.list_page(request)
+
         try:
-            data = query_ledger(get_channel_name(request), fcn='queryDataSamples', args=[])
+            data = get_projected_assets(get_channel_name(request), 'queryDataSamples')
+            if data is None:
+                data = query_ledger(get_channel_name(request), fcn='queryDataSamples', args=[])
         except LedgerError as e:
             return Response({'message': str(e.msg)}, status=e.status)
 
@@ -1,9 +1,9 @@
 import logging
-import itertools
 
 from urllib.parse import unquote
 
 from substrapp.ledger.api import query_ledger
+from substrapp.ledger.projection import get_projected_assets
 from substrapp import exceptions
 
 logger = logging.getLogger(__name__)
@@ -102,15 +102,141 @@ def _get_model_tuple(model):
         raise NotImplementedError
 
 
-def flatten_without_duplicates(list_of_list):
-    res = []
-    for item in itertools.chain.from_iterable(list_of_list):
-        if item not in res:
-            res.append(item)
-    return res
+def _contains(values, value):
+    try:
+        return value in values
+    except TypeError:  # unhashable asset attribute, it cannot be equal to a filter value
+        return False
 
 
-def filter_list(channel_name, object_type, data, query_params):
+def _get_attribute_getter(asset_type):
+    """Return the function reading the filtered attributes of an asset type."""
+    if asset_type == 'model':
+        return lambda model, attribute: _get_model_tuple(model).get(attribute)
+
+    if asset_type == 'objective':
+        def _get_objective_attribute(objective, attribute):
+            if attribute == 'metrics':  # specific to nested metrics
+                return objective[attribute]['name']
+            return objective[attribute]
+        return _get_objective_attribute
+
+    return lambda asset, attribute: asset.get(attribute)
+
+
+def _get_out_model_attributes(model, attribute):
+    """Return the values of an attribute of the models output by a model tuple."""
+    model_tuple = _get_model_tuple(model)
+    values = []
+    if model_tuple.get('out_model'):
+        values.append(model_tuple['out_model'].get(attribute))
+    for out_model in ('out_trunk_model', 'out_head_model'):
+        if model_tuple.get(out_model) and model_tuple[out_model].get('out_model'):
+            values.append(model_tuple[out_model]['out_model'].get(attribute))
+    return values
+
+
+def _compile_matcher(asset_type, subfilters, same_nature):
+    """Return a predicate matching the assets of a type against all the attribute filters of a group."""
+    subfilters = [(attribute, frozenset(values)) for attribute, values in subfilters.items()]
+
+    if asset_type == 'model' and not same_nature:
+        # models are referenced by other assets through their output models
+        return lambda model: all(
+            any(_contains(values, value) for value in _get_out_model_attributes(model, attribute))
+            for attribute, values in subfilters
+        )
+
+    get_attribute = _get_attribute_getter(asset_type)
+    return lambda asset: all(_contains(values, get_attribute(asset, attribute)) for attribute, values in subfilters)
+
+
+def _get_testtuple_objective_key(model):
+    if model['testtuple'] and model['testtuple']['objective']:
+        return model['testtuple']['objective']['key']
+    return None
+
+
+def _get_model_opener_checksums(models):
+    checksums = set()
+    for model in models:
+        for model_tuple in (model.get('testtuple'), _get_model_tuple(model)):
+            try:
+                checksums.add(model_tuple['dataset']['opener_checksum'])
+            except (KeyError, TypeError):  # missing testtuple or dataset
+                pass
+    return checksums
+
+
+def _link_algos_to_models(algos):
+    keys = {algo['key'] for algo in algos}
+    return lambda model: _get_model_tuple(model)['algo']['key'] in keys
+
+
+def _link_models_to_algos(models):
+    keys = {_get_model_tuple(model)['algo']['key'] for model in models}
+    return lambda algo: algo['key'] in keys
+
+
+def _link_models_to_datasets(models):
+    checksums = _get_model_opener_checksums(models)
+    return lambda dataset: dataset['opener']['checksum'] in checksums
+
+
+def _link_models_to_objectives(models):
+    keys = {_get_testtuple_objective_key(model) for model in models} - {None}
+    return lambda objective: objective['key'] in keys
+
+
+def _link_datasets_to_models(datasets):
+    keys = {dataset['key'] for dataset in datasets}
+    return lambda model: _get_model_tuple(model).get('dataset', {}).get('key', '') in keys
+
+
+def _link_datasets_to_objectives(datasets):
+    keys = {dataset['key'] for dataset in datasets}
+    objective_keys = {dataset['objective_key'] for dataset in datasets}
+    return lambda objective: (
+        objective['key'] in objective_keys or
+        bool(objective['test_dataset'] and objective['test_dataset']['data_manager_key'] in keys)
+    )
+
+
+def _link_objectives_to_models(objectives):
+    keys = {objective['key'] for objective in objectives}
+    return lambda model: _get_testtuple_objective_key(model) in keys
+
+
+def _link_objectives_to_datasets(objectives):
+    keys = {objective['key'] for objective in objectives}
+    return lambda dataset: dataset['objective_key'] in keys
+
+
+# For each (filter asset type, filtered asset type), the function building a predicate
+# on the filtered assets from the matching filter assets
+LINKS = {
+    ('algo', 'model'): _link_algos_to_models,
+    ('composite_algo', 'model'): _link_algos_to_models,
+    ('aggregate_algo', 'model'): _link_algos_to_models,
+    ('model', 'algo'): _link_models_to_algos,
+    ('model', 'composite_algo'): _link_models_to_algos,
+    ('model', 'aggregate_algo'): _link_models_to_algos,
+    ('model', 'dataset'): _link_models_to_datasets,
+    ('model', 'objective'): _link_models_to_objectives,
+    ('dataset', 'model'): _link_datasets_to_models,
+    ('dataset', 'objective'): _link_datasets_to_objectives,
+    ('objective', 'model'): _link_objectives_to_models,
+    ('objective', 'dataset'): _link_objectives_to_datasets,
+}
+
+
+def compile_filters(object_type, query_params):
+    """Parse and validate search filters.
+
+    Return a list of (filter_key, matcher) pairs, an asset is in the search results if it matches
+    any of them. The matcher is a predicate on the filtered assets if the filter key is of the same
+    nature as the filtered assets, on the assets of the filter key type otherwise.
+    """
     try:
         filters = get_filters(query_params)
     except Exception:
@@ -119,130 +245,60 @@ def filter_list(channel_name, object_type, data, query_params):
         logger.exception(message)
         raise exceptions.BadRequestError(message)
 
-    object_list = []
-
+    compiled_filters = []
     for user_filter in filters:
-
         for filter_key, subfilters in user_filter.items():
-
             if filter_key not in AUTHORIZED_FILTERS[object_type]:
                 raise exceptions.BadRequestError(
                     f'Malformed search filters: not authorized filter key {filter_key} for asset {object_type}')
 
-            # Will be appended in object_list after been filtered
-            filtered_list = data
-
-            if _same_nature(filter_key, object_type):
-                # Filter by own asset
-                if filter_key == 'model':
-                    for attribute, val in subfilters.items():
-                        filtered_list = [x for x in filtered_list if _get_model_tuple(x).get(attribute) in val]
-                elif filter_key == 'objective':
-                    for attribute, val in subfilters.items():
-                        if attribute == 'metrics':  # specific to nested metrics
-                            filtered_list = [x for x in filtered_list if x[attribute]['name'] in val]
-                        else:
-                            filtered_list = [x for x in filtered_list if x[attribute] in val]
-
-                else:
-                    for attribute, val in subfilters.items():
-                        filtered_list = [x for x in filtered_list if x.get(attribute) in val]
+            same_nature = _same_nature(filter_key, object_type)
+            matcher = _compile_matcher(object_type if same_nature else filter_key, subfilters, same_nature)
+            compiled_filters.append((filter_key, matcher))
+
+    return compiled_filters
+
+
+class _FilteringAssets:
+    """Assets of other types used by the search filters, queried at most once per search."""
+
+    def __init__(self, channel_name):
+        self.channel_name = channel_name
+        self._assets = {}
+
+    def get(self, asset_type):
+        if asset_type not in self._assets:
+            fcn = FILTER_QUERIES[asset_type]
+            data = get_projected_assets(self.channel_name, fcn)
+            if data is None:
+                data = query_ledger(self.channel_name, fcn=fcn, args=[])
+            self._assets[asset_type] = data or []
+        return self._assets[asset_type]
+
+
+def filter_list(channel_name, object_type, data, query_params):
+    filters = compile_filters(object_type, query_params)
+    filtering_assets = _FilteringAssets(channel_name)
+
+    selected = set()
+    object_list = []
+
+    for filter_key, matcher in filters:
+        if _same_nature(filter_key, object_type):
+            # Filter by own asset
+            predicate = matcher
+        else:
+            # Filter by other asset
+            link = LINKS.get((filter_key, object_type))
+            if link is None:
+                predicate = None
             else:
-                # Filter by other asset
-
-                # Get other asset list
-                filtering_data = query_ledger(channel_name, fcn=FILTER_QUERIES[filter_key], args=[])
-
-                filtering_data = filtering_data if filtering_data else []
-
-                if filter_key in ('algo', 'composite_algo', 'aggregate_algo'):
-                    for attribute, val in subfilters.items():
-                        filtering_data = [x for x in filtering_data if x[attribute] in val]
-                        keys = [x['key'] for x in filtering_data]
-                        if object_type == 'model':
-                            filtered_list = [x for x in filtered_list
-                                             if _get_model_tuple(x)['algo']['key'] in keys]
-
-                elif filter_key == 'model':
-                    for attribute, val in subfilters.items():
-                        filtering_data = [
-                            x for x in filtering_data
-                            if (
-                                (
-                                    _get_model_tuple(x).get('out_model') and
-                                    _get_model_tuple(x)['out_model'][attribute] in val
-                                ) or (
-                                    _get_model_tuple(x).get('out_trunk_model') and
-                                    _get_model_tuple(x)['out_trunk_model'].get('out_model') and
-                                    _get_model_tuple(x)['out_trunk_model']['out_model'][attribute] in val
-                                ) or (
-                                    _get_model_tuple(x).get('out_head_model') and
-                                    _get_model_tuple(x)['out_head_model'].get('out_model') and
-                                    _get_model_tuple(x)['out_head_model']['out_model'][attribute] in val
-                                )
-                            )
-                        ]
-
-                        if object_type in ['algo', 'composite_algo', 'aggregate_algo']:
-                            keys = [_get_model_tuple(x)['algo']['key'] for x in filtering_data]
-                            filtered_list = [x for x in filtered_list if x['key'] in keys]
-
-                        elif object_type == 'dataset':
-                            checksums = []
-                            for x in filtering_data:
-                                try:
-                                    checksums.append(x['testtuple']['dataset']['opener_checksum'])
-                                except KeyError:
-                                    pass
-                                try:
-                                    checksums.append(_get_model_tuple(x)['dataset']['opener_checksum'])
-                                except KeyError:
-                                    pass
-
-                            filtered_list = [
-                                x for x in filtered_list
-                                if x['opener']['checksum'] in checksums
-                            ]
-
-                        elif object_type == 'objective':
-                            keys = [
-                                x['testtuple']['objective']['key'] for x in filtering_data
-                                if x['testtuple'] and x['testtuple']['objective']
-                            ]
-                            filtered_list = [x for x in filtered_list if x['key'] in keys]
-
-                elif filter_key == 'dataset':
-                    for attribute, val in subfilters.items():
-                        filtering_data = [x for x in filtering_data if x[attribute] in val]
-                        keys = [x['key'] for x in filtering_data]
-                        if object_type == 'model':
-                            filtered_list = [x for x in filtered_list
-                                             if _get_model_tuple(x).get('dataset', {}).get('key', '') in keys]
-                        elif object_type == 'objective':
-                            objective_keys = [x['objective_key'] for x in filtering_data]
-                            filtered_list = [x for x in filtered_list
-                                             if x['key'] in objective_keys or
-                                             (x['test_dataset'] and x['test_dataset']['data_manager_key'] in keys)]
-
-                elif filter_key == 'objective':
-                    for attribute, val in subfilters.items():
-                        if attribute == 'metrics':  # specific to nested metrics
-                            filtering_data = [x for x in filtering_data if x[attribute]['name'] in val]
-                        else:
-                            filtering_data = [x for x in filtering_data if x[attribute] in val]
-
-                        keys = [x['key'] for x in filtering_data]
-
-                        if object_type == 'model':
-                            filtered_list = [
-                                x for x in filtered_list
-                                if (x['testtuple'] and x['testtuple']['objective'] and
-                                    x['testtuple']['objective']['key'] in keys)
-                            ]
-                        elif object_type == 'dataset':
-                            filtered_list = [x for x in filtered_list
-                                             if x['objective_key'] in keys]
-
-            object_list.append(filtered_list)
-
-    return flatten_without_duplicates(object_list)
+                predicate = link([x for x in filtering_assets.get(filter_key) if matcher(x)])
+
+        # the results of all the filters are listed in order, without duplicates
+        for x in data:
+            if id(x) not in selected and (predicate is None or predicate(x)):
+                selected.add(id(x))
+                object_list.append(x)
+
+    return object_list
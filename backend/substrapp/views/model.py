@@ -12,18 +12,22 @@ from node.authentication import NodeUser
 from substrapp.models import Model
 from substrapp.ledger.api import query_ledger, get_object_from_ledger
 from substrapp.ledger.exceptions import LedgerError
-from substrapp.views.utils import validate_key, get_remote_asset, PermissionMixin, get_channel_name, PermissionError
+from substrapp.views.utils import (LedgerListPaginationMixin, validate_key, get_remote_asset, PermissionMixin,
+                                   get_channel_name, PermissionError)
 from substrapp.views.filters_utils import filter_list
 
 logger = logging.getLogger(__name__)
 
 
-class ModelViewSet(mixins.RetrieveModelMixin,
+class ModelViewSet(LedgerListPaginationMixin,
+                   mixins.RetrieveModelMixin,
                    mixins.ListModelMixin,
                    GenericViewSet):
     queryset = Model.objects.all()
     ledger_query_call = 'queryModelDetails'
     # permission_classes = (permissions.IsAuthenticated,)
+    ledger_list_call = 'queryModels'
+    list_object_type = 'model'
 
     def create_or_update_model(self, channel_name, traintuple, key):
         if traintuple['out_model'] is None:
@@ -73,6 +77,9 @@ class ModelViewSet(mixins.RetrieveModelMixin,
             return Response(data, status=status.HTTP_200_OK)
 
     def list(self, request, *args, **kwargs):
+        if self.is_list_paginated(request):
+            return self.list_page(request)
+
         try:
             data = query_ledger(get_channel_name(request), fcn='queryModels', args=[])
         except LedgerError as e:
@@ -13,9 +13,10 @@ from substrapp.models import Objective
 from substrapp.serializers import ObjectiveSerializer, LedgerObjectiveSerializer
 
 from substrapp.ledger.api import query_ledger, get_object_from_ledger
+from substrapp.ledger.projection import get_projected_assets
 from substrapp.ledger.exceptions import LedgerError, LedgerTimeout, LedgerConflict
 from substrapp.utils import get_hash
-from substrapp.views.utils import (PermissionMixin, validate_key,
+from substrapp.views.utils import (LedgerListPaginationMixin, PermissionMixin, validate_key,
                                    get_success_create_code, ValidationException,
                                    LedgerException, get_remote_asset, validate_sort,
                                    node_has_process_permission, get_channel_name)
@@ -30,13 +31,16 @@ def replace_storage_addresses(request, objective):
     )
 
 
-class ObjectiveViewSet(mixins.CreateModelMixin,
+class ObjectiveViewSet(LedgerListPaginationMixin,
+                       mixins.CreateModelMixin,
                        mixins.ListModelMixin,
                        mixins.RetrieveModelMixin,
                        GenericViewSet):
     queryset = Objective.objects.all()
     serializer_class = ObjectiveSerializer
     ledger_query_call = 'queryObjective'
+    ledger_list_call = 'queryObjectives'
+    list_object_type = 'objective'
 
     def perform_create(self, serializer):
         return serializer.save()
@@ -173,8 +177,13 @@ class ObjectiveViewSet(mixins.CreateModelMixin,
             return Response(data, status=status.HTTP_200_OK)
 
     def list(self, request, *args, **kwargs):
+        if self.is_list_paginated(request):
+            return self.list_page(request, process_asset=lambda asset: replace_storage_addresses(request, asset))
+
         try:
-            data = query_ledger(get_channel_name(request), fcn='queryObjectives', args=[])
+            data = get_projected_assets(get_channel_name(request), 'queryObjectives')
+            if data is None:
+                data = query_ledger(get_channel_name(request), fcn='queryObjectives', args=[])
         except LedgerError as e:
             return Response({'message': str(e.msg)}, status=e.status)
 
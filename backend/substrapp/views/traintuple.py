@@ -6,18 +6,23 @@ from rest_framework.viewsets import GenericViewSet
 
 from substrapp.serializers import LedgerTrainTupleSerializer
 from substrapp.ledger.api import query_ledger, get_object_from_ledger
+from substrapp.ledger.projection import get_projected_assets, get_projected_asset
 from substrapp.ledger.exceptions import LedgerError, LedgerConflict
 from substrapp.views.computeplan import create_compute_plan
 from substrapp.views.filters_utils import filter_list
-from substrapp.views.utils import (validate_key, get_success_create_code, LedgerException, get_channel_name)
+from substrapp.views.utils import (LedgerListPaginationMixin, validate_key, get_success_create_code, LedgerException,
+                                   get_channel_name)
 
 
-class TrainTupleViewSet(mixins.CreateModelMixin,
+class TrainTupleViewSet(LedgerListPaginationMixin,
+                        mixins.CreateModelMixin,
                         mixins.RetrieveModelMixin,
                         mixins.ListModelMixin,
                         GenericViewSet):
     serializer_class = LedgerTrainTupleSerializer
     ledger_query_call = 'queryTraintuple'
+    ledger_list_call = 'queryTraintuples'
+    list_object_type = 'traintuple'
 
     def get_queryset(self):
         return []
@@ -72,8 +77,13 @@ class TrainTupleViewSet(mixins.CreateModelMixin,
             return Response(data, status=st, headers=headers)
 
     def list(self, request, *args, **kwargs):
+        if self.is_list_paginated(request):
+            return self.list_page(request)
+
         try:
-            data = query_ledger(get_channel_name(request), fcn='queryTraintuples', args=[])
+            data = get_projected_assets(get_channel_name(request), 'queryTraintuples')
+            if data is None:
+                data = query_ledger(get_channel_name(request), fcn='queryTraintuples', args=[])
         except LedgerError as e:
             return Response({'message': str(e.msg)}, status=e.status)
 
@@ -92,7 +102,10 @@ class TrainTupleViewSet(mixins.CreateModelMixin,
 
     def _retrieve(self, channel_name, key):
         validate_key(key)
-        return get_object_from_ledger(channel_name, key, self.ledger_query_call)
+        data = get_projected_asset(channel_name, key, self.ledger_query_call)
+        if data is None:
+            data = get_object_from_ledger(channel_name, key, self.ledger_query_call)
+        return data
 
     def retrieve(self, request, *args, **kwargs):
         lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
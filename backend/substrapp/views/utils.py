@@ -1,14 +1,18 @@
+import heapq
 import os
+import re
 import uuid
 
-from django.http import FileResponse
+from django.http import FileResponse, HttpResponse
 from rest_framework.authentication import BasicAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.settings import api_settings
 
 from node.authentication import NodeUser
-from substrapp.ledger.api import get_object_from_ledger
+from libs.pagination import LedgerPagination
+from substrapp.ledger.api import get_object_from_ledger, iter_query_ledger, query_ledger, query_ledger_page
+from substrapp.ledger.projection import get_projected_assets, get_projected_assets_page
 from substrapp.ledger.exceptions import LedgerError
 from substrapp.utils import NodeError, get_remote_file, get_owner, get_remote_file_content
 from node.models import OutgoingNode
@@ -19,8 +23,10 @@ from requests.auth import HTTPBasicAuth
 from wsgiref.util import is_hop_by_hop
 
 from substrapp import exceptions
+from substrapp.views.filters_utils import filter_list
 
 HTTP_HEADER_PROXY_ASSET = 'Substra-Proxy-Asset'
+BYTE_RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
 
 
 class PermissionError(Exception):
@@ -46,6 +52,43 @@ def get_remote_asset(channel_name, url, node_id, content_checksum, salt=None):
     return get_remote_file_content(channel_name, url, auth, content_checksum, salt=salt)
 
 
+def get_byte_range(range_header, size):
+    """Return the first and last bytes of the single range requested by a `Range` header.
+
+    Return None if the whole file must be sent: no header, or an unsupported one. Raise ValueError if
+    the range cannot be satisfied.
+    """
+    if not range_header:
+        return None
+
+    match = BYTE_RANGE_PATTERN.match(range_header.strip())
+    if match is None:
+        return None
+
+    start, end = match.groups()
+    if not start and not end:
+        return None
+
+    if not start:
+        # the last `end` bytes
+        start, end = max(0, size - int(end)), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+
+    if start >= size or start > end:
+        raise ValueError(f'Range {range_header} cannot be satisfied for {size} bytes')
+    return start, end
+
+
+def _read_file_range(f, length, block_size):
+    while length > 0:
+        chunk = f.read(min(block_size, length))
+        if not chunk:
+            break
+        length -= len(chunk)
+        yield chunk
+
+
 class CustomFileResponse(FileResponse):
     def set_headers(self, filelike):
         super(CustomFileResponse, self).set_headers(filelike)
@@ -107,7 +150,7 @@ class PermissionMixin(object):
                             status=status.HTTP_403_FORBIDDEN)
 
         if get_owner() == asset['owner']:
-            response = self._download_local_file(django_field)
+            response = self._download_local_file(request, django_field)
         else:
             if not ledger_field:
                 ledger_field = django_field
@@ -132,16 +175,37 @@ class PermissionMixin(object):
             return Response({'message': str(e)},
                             status=status.HTTP_403_FORBIDDEN)
 
-        return self._download_local_file(django_field)
+        return self._download_local_file(request, django_field)
 
-    def _download_local_file(self, django_field):
+    def _download_local_file(self, request, django_field):
         obj = self.get_object()
         data = getattr(obj, django_field)
+        file_size = os.path.getsize(data.path)
+
+        try:
+            byte_range = get_byte_range(request.headers.get('Range'), file_size)
+        except ValueError:
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = f'bytes */{file_size}'
+            return response
+
+        f = open(data.path, 'rb')
         response = CustomFileResponse(
-            open(data.path, 'rb'),
+            f,
             as_attachment=True,
             filename=os.path.basename(data.path)
         )
+        response['Accept-Ranges'] = 'bytes'
+
+        if byte_range is not None:
+            # the interrupted downloads of other nodes are resumed with range requests
+            start, end = byte_range
+            f.seek(start)
+            response.streaming_content = _read_file_range(f, end - start + 1, response.block_size)
+            response.status_code = status.HTTP_206_PARTIAL_CONTENT
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = f'bytes {start}-{end}/{file_size}'
+
         return response
 
     def _download_remote_file(self, channel_name, storage_address, asset):
@@ -225,3 +289,94 @@ def is_proxied_request(request) -> bool:
     :param request: incoming HTTP request
     """
     return HTTP_HEADER_PROXY_ASSET in request.headers
+
+
+class LedgerListPaginationMixin(object):
+    """Paginate the list of the assets returned by `ledger_list_call`.
+
+    Without search filters, only the assets of the requested page are fetched: from the projection
+    using the last returned key as cursor, or from the ledger using the chaincode bookmarks.
+    """
+    pagination_class = LedgerPagination
+    ledger_list_call = None
+    list_object_type = None
+
+    def is_list_paginated(self, request):
+        return self.paginator.get_page_size(request) is not None
+
+    def list_page(self, request, process_asset=None):
+        page_size = self.paginator.get_page_size(request)
+        cursor = self.paginator.decode_cursor(request)
+
+        search = request.query_params.get('search') if self.list_object_type else None
+
+        try:
+            if search is None:
+                results, next_cursor = self._get_page(get_channel_name(request), page_size, cursor)
+            else:
+                results, next_cursor = self._get_filtered_page(get_channel_name(request), search, page_size, cursor)
+        except LedgerError as e:
+            return Response({'message': str(e.msg)}, status=e.status)
+
+        if process_asset is not None:
+            for asset in results:
+                process_asset(asset)
+
+        return self.paginator.get_paginated_response(results, next_cursor)
+
+    def _get_page(self, channel_name, page_size, cursor):
+        if 'bookmark' not in cursor:
+            page = get_projected_assets_page(channel_name, self.ledger_list_call, page_size, cursor.get('key'))
+            if page is not None:
+                results, has_next = page
+                return results, {'key': results[-1]['key']} if has_next else None
+
+            if 'key' in cursor:
+                # the projection is not up to date anymore: list the following assets from the ledger
+                # the ledger list is streamed so that only the assets of the page are kept in memory
+                data = heapq.nsmallest(
+                    page_size + 1,
+                    (asset for asset in iter_query_ledger(channel_name, self.ledger_list_call)
+                     if asset['key'] > cursor['key']),
+                    key=lambda a: a['key'])
+                results = data[:page_size]
+                return results, {'key': results[-1]['key']} if len(data) > page_size else None
+
+        return self._get_ledger_page(channel_name, page_size, cursor.get('bookmark', ''), cursor.get('offset', 0))
+
+    def _get_ledger_page(self, channel_name, page_size, bookmark, offset):
+        results = []
+
+        while True:
+            page, next_bookmark = query_ledger_page(channel_name, self.ledger_list_call, bookmark)
+
+            end = offset + page_size - len(results)
+            results.extend(page[offset:end])
+
+            if end < len(page):
+                # the page ends in the middle of the bookmark page
+                return results, {'bookmark': bookmark, 'offset': end}
+
+            if not next_bookmark:
+                return results, None
+
+            bookmark, offset = next_bookmark, 0
+
+            if len(results) == page_size:
+                return results, {'bookmark': bookmark, 'offset': 0}
+
+    def _get_filtered_page(self, channel_name, search, page_size, cursor):
+        # filters need the whole list
+        data = get_projected_assets(channel_name, self.ledger_list_call)
+        if data is None:
+            data = query_ledger(channel_name, fcn=self.ledger_list_call, args=[]) or []
+
+        data = filter_list(
+            channel_name=channel_name,
+            object_type=self.list_object_type,
+            data=data,
+            query_params=search)
+
+        offset = cursor.get('offset', 0)
+        results = data[offset:offset + page_size]
+        return results, {'offset': offset + page_size} if offset + page_size < len(data) else None